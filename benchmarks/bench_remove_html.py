@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Compares the HTML stripping of the summaries on a feed of 10k entries.
+
+Usage: python -m benchmarks.bench_remove_html
+"""
+import re
+import timeit
+from HTMLParser import HTMLParser
+
+from clnews.utils import remove_html, remove_html_bulk
+
+ENTRIES = 10000
+
+SUMMARY = u'<![CDATA[<div class="summary"><p>The central bank raised ' \
+          u'interest rates &amp; bond yields rose &#8212; the most ' \
+          u'since 2008.</p><img src="http://cdn/%d.jpg"/></div>]]>'
+
+SUMMARIES = [SUMMARY % i for i in range(ENTRIES)]
+
+
+def remove_html_0_4(string):
+    """ The implementation of clnews 0.4.0."""
+    p = re.compile(r'<.*?>')
+    string = p.sub('', string)
+
+    return string
+
+
+def remove_html_0_4_unescape(string):
+    """ The implementation of clnews 0.4.0 decoding the entities as well."""
+    return HTMLParser().unescape(remove_html_0_4(string))
+
+
+def bench(name, func, number=5):
+    seconds = min(timeit.repeat(func, number=1, repeat=number))
+    print '%-28s %8.1f ms %10.0f entries/s' % (name, seconds * 1000,
+                                              ENTRIES / seconds)
+    return seconds
+
+
+def main():
+    print 'Stripping %d summaries' % ENTRIES
+    bench('0.4.0, tags only', lambda: [remove_html_0_4(s) for s in SUMMARIES])
+    before = bench('0.4.0 + unescape',
+                   lambda: [remove_html_0_4_unescape(s) for s in SUMMARIES])
+    single = bench('remove_html',
+                   lambda: [remove_html(s) for s in SUMMARIES])
+    bulk = bench('remove_html_bulk', lambda: remove_html_bulk(SUMMARIES))
+    print 'speedup over 0.4.0 + unescape: %.1fx single, %.1fx bulk' % \
+          (before / single, before / bulk)
+
+
+if __name__ == '__main__':
+    main()
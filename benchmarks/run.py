@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Benchmarks the fetch -> parse -> render pipeline of clnews.
+
+Synthetic feeds are served from a local HTTP server and every benchmark runs
+in a fresh interpreter so that its peak memory is measured in isolation.
+
+Usage:
+    python -m benchmarks.run [--items N] [--repeat N] [--only NAME...]
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+A comparison run exits with status 1 when the throughput of a benchmark drops
+below the baseline by more than the tolerance.
+"""
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+from itertools import islice
+from collections import OrderedDict
+
+import feedparser
+
+from clnews.news import Event, Channel
+from clnews.utils import remove_html, remove_html_bulk
+from clnews.commands import Get
+from benchmarks.server import SUMMARY, make_feed, start_server
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """ Registers a benchmark.
+
+    The decorated function receives the base URL of the feed server and the
+    number of items and returns the function to be timed.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@benchmark('Channel._get_data')
+def bench_get_data(base_url, items):
+    return Channel('rss', '%s/rss/%d' % (base_url, items))._get_data
+
+
+@benchmark('Channel.get_events')
+def bench_get_events(base_url, items):
+    return Channel('rss', '%s/rss/%d' % (base_url, items)).get_events
+
+
+@benchmark('Channel.get_events (atom)')
+def bench_get_events_atom(base_url, items):
+    return Channel('atom', '%s/atom/%d' % (base_url, items)).get_events
+
+
+@benchmark('Channel.iter_events')
+def bench_iter_events(base_url, items):
+    channel = Channel('rss', '%s/rss/%d' % (base_url, items))
+    return lambda: list(channel.iter_events())
+
+
+@benchmark('Get.print_output (first screen)')
+def bench_print_output_first_screen(base_url, items):
+    command = Get.__new__(Get)
+    command.buffer = Channel('rss', '%s/rss/%d' % (base_url, items))\
+                     .get_events()
+    return lambda: list(islice(Get.print_output.__wrapped__(command), 10))
+
+
+@benchmark('Event')
+def bench_event(base_url, items):
+    entries = feedparser.parse(make_feed('rss', items)).entries
+    return lambda: [Event(e.title, e.link, e.published, e.summary, e.id)
+                    for e in entries]
+
+
+@benchmark('remove_html')
+def bench_remove_html(base_url, items):
+    summaries = [SUMMARY % i for i in xrange(items)]
+    return lambda: [remove_html(summary) for summary in summaries]
+
+
+@benchmark('remove_html_bulk')
+def bench_remove_html_bulk(base_url, items):
+    summaries = [SUMMARY % i for i in xrange(items)]
+    return lambda: remove_html_bulk(summaries)
+
+
+@benchmark('Get.print_output')
+def bench_print_output(base_url, items):
+    command = Get.__new__(Get)
+    command.buffer = Channel('rss', '%s/rss/%d' % (base_url, items))\
+                     .get_events()
+    return lambda: ''.join(Get.print_output.__wrapped__(command))
+
+
+def measure(name, base_url, items, repeat):
+    """ Times a benchmark in the current process.
+
+    Returns:
+        dict. The best time in seconds, the throughput in items per second and
+        the peak resident memory in MB.
+    """
+    func = BENCHMARKS[name](base_url, items)
+    func()
+
+    times = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+
+    best = min(times)
+    return {'seconds': best,
+            'throughput': items / best if best else float('inf'),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF)
+                           .ru_maxrss / 1024.0}
+
+
+def run_isolated(name, base_url, items, repeat):
+    """ Runs a benchmark in a fresh interpreter."""
+    output = subprocess.check_output([sys.executable, '-m', 'benchmarks.run',
+                                      '--child', name, '--url', base_url,
+                                      '--items', str(items),
+                                      '--repeat', str(repeat)])
+    return json.loads(output)
+
+
+def compare(results, baseline, tolerance):
+    """ Compares the results with a baseline.
+
+    Returns:
+        list. The names of the benchmarks which regressed.
+    """
+    regressions = []
+    for name, result in results.iteritems():
+        if name not in baseline['results']:
+            continue
+
+        expected = baseline['results'][name]['throughput']
+        change = result['throughput'] / expected - 1
+        status = 'ok'
+        if change < -tolerance:
+            status = 'REGRESSION'
+            regressions.append(name)
+        print '%-32s %+7.1f%%  %s' % (name, change * 100, status)
+
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='benchmarks.run')
+    parser.add_argument('--items', type=int, default=1000,
+                        help='number of items per feed')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed runs, the best is kept')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS.keys(),
+                        metavar='NAME', help='benchmarks to run')
+    parser.add_argument('--save', metavar='FILE',
+                        help='stores the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compares the results with a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed throughput drop, 0.25 for 25%%')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.child:
+        print json.dumps(measure(args.child, args.url, args.items,
+                                 args.repeat))
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['items'] != args.items:
+            print 'The baseline was recorded with %d items.' % \
+                  baseline['items']
+            return 2
+
+    server, base_url = start_server()
+    results = OrderedDict()
+    print '%-32s %10s %14s %10s' % ('benchmark', 'ms', 'items/s', 'peak MB')
+    try:
+        for name in args.only or BENCHMARKS.keys():
+            results[name] = result = run_isolated(name, base_url, args.items,
+                                                  args.repeat)
+            print '%-32s %10.1f %14.0f %10.1f' % (name,
+                                                  result['seconds'] * 1000,
+                                                  result['throughput'],
+                                                  result['peak_rss_mb'])
+    finally:
+        server.shutdown()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'items': args.items, 'results': results}, f, indent=2,
+                      sort_keys=True)
+
+    if baseline is not None:
+        print
+        if compare(results, baseline, args.tolerance):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Serves synthetic RSS and Atom feeds of configurable size over HTTP.
+
+The feeds are available under /rss/<items> and /atom/<items>.
+"""
+import re
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+SUMMARY = '<p>The central bank raised interest rates &amp; bond yields ' \
+          'rose &#8212; the most since 2008.</p><img src="http://cdn/%d.jpg"/>'
+
+RSS = '<?xml version="1.0" encoding="utf-8"?>\n' \
+      '<rss version="2.0"><channel><title>Benchmark</title>' \
+      '<link>http://localhost/</link><description>Benchmark feed' \
+      '</description>%s</channel></rss>'
+
+RSS_ITEM = '<item><title>Event number %(i)d</title>' \
+           '<link>http://localhost/events/%(i)d</link>' \
+           '<guid>http://localhost/events/%(i)d</guid>' \
+           '<pubDate>%(date)s</pubDate>' \
+           '<description><![CDATA[%(summary)s]]></description></item>'
+
+ATOM = '<?xml version="1.0" encoding="utf-8"?>\n' \
+       '<feed xmlns="http://www.w3.org/2005/Atom"><title>Benchmark</title>' \
+       '<id>urn:benchmark</id><updated>2015-01-10T10:00:00Z</updated>' \
+       '%s</feed>'
+
+ATOM_ITEM = '<entry><title>Event number %(i)d</title>' \
+            '<id>urn:benchmark:%(i)d</id>' \
+            '<link rel="alternate" href="http://localhost/events/%(i)d"/>' \
+            '<published>%(iso)s</published><updated>%(iso)s</updated>' \
+            '<summary type="html">%(escaped)s</summary></entry>'
+
+PATH = re.compile(r'^/(rss|atom)/(\d+)$')
+
+
+def make_feed(kind, items):
+    """ Returns a feed of the given kind ('rss' or 'atom') and size."""
+    entries = []
+    for i in xrange(items):
+        minutes = (items - i) % 60
+        summary = SUMMARY % i
+        entries.append((RSS_ITEM if kind == 'rss' else ATOM_ITEM) % {
+            'i': i,
+            'date': 'Sat, 10 Jan 2015 10:%02d:00 GMT' % minutes,
+            'iso': '2015-01-10T10:%02d:00Z' % minutes,
+            'summary': summary,
+            'escaped': summary.replace('&', '&amp;').replace('<', '&lt;')
+                              .replace('>', '&gt;'),
+        })
+
+    return (RSS if kind == 'rss' else ATOM) % ''.join(entries)
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """ Serves the synthetic feeds, caching them per size."""
+
+    protocol_version = 'HTTP/1.1'
+    feeds = {}
+
+    def do_GET(self):
+        match = PATH.match(self.path)
+        if not match:
+            self.send_error(404)
+            return
+
+        key = (match.group(1), int(match.group(2)))
+        if key not in self.feeds:
+            self.feeds[key] = make_feed(*key)
+        body = self.feeds[key]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/%s+xml' % key[0])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_server(port=0):
+    """ Starts the server in a background thread.
+
+    Returns:
+        tuple. (server, base URL)
+    """
+    server = FeedServer(('127.0.0.1', port), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server, 'http://127.0.0.1:%d' % server.server_port
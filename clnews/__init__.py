@@ -1,9 +1,38 @@
+import sys
+import types
 
 from clnews.exceptions import EventAttrError, ChannelDataNotFound, ChannelServerError,\
                        ChannelServerError, ChannelRetrieveEventsError
 
-from clnews.news import Event, Channel
+# the names exported on their first access, so that running a single
+# subcommand does not load every module: name -> (module, attribute)
+LAZY_NAMES = {
+    'Event': ('clnews.news', 'Event'),
+    'Channel': ('clnews.news', 'Channel'),
+    'Shell': ('clnews.shell', 'Shell'),
+    'commands': ('clnews.commands', None),
+}
 
-from clnews.shell import Shell
 
-import clnews.commands
+class LazyPackage(types.ModuleType):
+    """ The clnews package, importing the modules of its names lazily."""
+
+    def __getattr__(self, name):
+        if name not in LAZY_NAMES:
+            raise AttributeError(name)
+
+        module, attribute = LAZY_NAMES[name]
+        __import__(module)
+        value = sys.modules[module]
+        if attribute is not None:
+            value = getattr(value, attribute)
+        setattr(self, name, value)
+
+        return value
+
+
+_package = LazyPackage(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+# the original module clears its globals when it is collected
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
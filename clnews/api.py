@@ -0,0 +1,250 @@
+"""
+.. module:: api
+   :platform: Unix
+      :synopsis: This module contains the HTTP/JSON API of the stored channels
+      and events.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import json
+import hashlib
+import urlparse
+from collections import OrderedDict
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from clnews import config
+from clnews.stats import STATS
+from clnews.daemon import Daemon
+from clnews.batch import event_record, list_channels, CHANNEL_FIELDS, \
+EVENT_FIELDS, SEARCH_FIELDS
+from clnews.exceptions import APIBadRequest
+
+
+def encode_cursor(cursor):
+    """ Converts a cursor of :meth:`store.Store.page_events` to a string."""
+    if cursor is None:
+        return None
+
+    published, event_id = cursor
+    return '%s:%d' % ('' if published is None else published, event_id)
+
+
+def decode_cursor(value):
+    """ Converts a string to a cursor of :meth:`store.Store.page_events`.
+
+    Raises:
+        APIBadRequest: The cursor is not valid.
+    """
+    try:
+        published, event_id = value.split(':')
+        return int(published) if published else None, int(event_id)
+    except ValueError:
+        raise APIBadRequest('Invalid cursor: %s' % value)
+
+
+def _integer(params, name, default=None):
+    if name not in params:
+        return default
+
+    try:
+        return int(params[name])
+    except ValueError:
+        raise APIBadRequest('%s should be an integer' % name)
+
+
+def _objects(fields, records):
+    return (json.dumps(OrderedDict(zip(fields, record)))
+            for record in records)
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    """ Handles the requests of the API.
+
+    GET /channels
+        The channels of the list.
+    GET /events?channel=<code>&since=<timestamp>&limit=<n>&cursor=<cursor>
+        A page of the stored events, the newest first, along with the cursor
+        of the next page.
+    GET /search?q=<query>&limit=<n>
+        The stored events matching the query, see :func:`search.parse_query`.
+    POST /refresh?channel=<code>,...
+        Retrieves the given channels, or all of them, if they are due.
+    GET /metrics
+        The timings and the counters of the server in the text format of
+        Prometheus, see :class:`stats.Stats`.
+
+    The GET responses carry an ETag derived from the revision of the store, so
+    that the clients revalidate them without the data being read again.
+    """
+
+    server_version = 'clnews/%s' % config.VERSION
+
+    # the ETag of the response being sent
+    etag = None
+
+    def do_GET(self):
+        self._dispatch({'/channels': self.get_channels,
+                        '/events': self.get_events,
+                        '/search': self.search,
+                        '/metrics': self.metrics})
+
+    def do_POST(self):
+        self._dispatch({'/refresh': self.refresh})
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _dispatch(self, routes):
+        parts = urlparse.urlsplit(self.path)
+        route = routes.get(parts.path.rstrip('/'))
+        if route is None:
+            self._send_error(404, 'Not found')
+            return
+
+        try:
+            route(dict(urlparse.parse_qsl(parts.query)))
+        except APIBadRequest as error:
+            self._send_error(400, str(error))
+
+    def _send_error(self, status, message):
+        body = json.dumps({'error': message})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_modified(self):
+        """ Sends a 304 if the client has the current revision of the data.
+
+        Returns:
+            bool. True if the response was sent.
+        """
+        etag = '"%s"' % hashlib.md5(self.path + self.server.store.revision())\
+                               .hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return True
+
+        self.etag = etag
+        return False
+
+    def _send_json(self, name, items, extra=None):
+        """ Streams a JSON object holding a list of encoded items.
+
+        Args:
+            name (str): The key of the list.
+            items (iterable): The JSON encoded items.
+
+        Kwargs:
+            extra (dict): The rest of the keys of the object.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-cache')
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        self.end_headers()
+
+        self.wfile.write('{"%s": [' % name)
+        for i, item in enumerate(items):
+            self.wfile.write(item if not i else ', ' + item)
+        self.wfile.write(']')
+        for key, value in (extra or {}).iteritems():
+            self.wfile.write(', %s: %s' % (json.dumps(key), json.dumps(value)))
+        self.wfile.write('}\n')
+
+    def get_channels(self, params):
+        if self._not_modified():
+            return
+
+        self._send_json('channels', _objects(
+            CHANNEL_FIELDS, list_channels(self.server.store)))
+
+    def get_events(self, params):
+        limit = _integer(params, 'limit', config.API_PAGE_LIMIT)
+        if not 0 < limit <= config.API_MAX_LIMIT:
+            raise APIBadRequest('limit should be between 1 and %d' %
+                                config.API_MAX_LIMIT)
+        cursor = decode_cursor(params['cursor']) if 'cursor' in params \
+                 else None
+        since = _integer(params, 'since')
+        if self._not_modified():
+            return
+
+        events, cursor = self.server.store.page_events(params.get('channel'),
+                                                       since, limit, cursor)
+        self._send_json('events',
+                        _objects(EVENT_FIELDS,
+                                 (event_record(code, event)
+                                  for code, event in events)),
+                        {'cursor': encode_cursor(cursor)})
+
+    def search(self, params):
+        if not params.get('q'):
+            raise APIBadRequest('q is required')
+        limit = _integer(params, 'limit', config.SEARCH_LIMIT)
+        if self._not_modified():
+            return
+
+        try:
+            results = self.server.store.search(params['q'], limit)
+        except ValueError:
+            raise APIBadRequest('Dates should be given as YYYY-MM-DD.')
+
+        self._send_json('results', _objects(
+            SEARCH_FIELDS, ((round(score, 4),) + event_record(code, event)
+                            for score, code, event in results)))
+
+    def metrics(self, params):
+        body = STATS.prometheus()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def refresh(self, params):
+        codes = params['channel'].split(',') if params.get('channel') \
+                else None
+        # waits for a running refresh or poll of the daemon
+        wait = self.server.daemon.poll(codes=codes)
+
+        body = json.dumps({'next': wait})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class APIServer(ThreadingMixIn, HTTPServer):
+    """ Serves the API, every request in its own thread.
+
+    The requests are answered from the store, the channels are retrieved only
+    by the refreshes and the optional polling daemon.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, store, daemon=None, verbose=False):
+        """ Initializes the class.
+
+        Args:
+            address (tuple): The (host, port) to listen to.
+            store (:class:`store.Store`): The store of the channels.
+
+        Kwargs:
+            daemon (:class:`daemon.Daemon`): Retrieves the channels on the
+            refreshes.
+            verbose (bool): Logs the requests on the stderr.
+        """
+        HTTPServer.__init__(self, address, APIHandler)
+        self.store = store
+        self.daemon = daemon or Daemon(store)
+        self.verbose = verbose
@@ -0,0 +1,203 @@
+"""
+.. module:: batch
+   :platform: Unix
+      :synopsis: This module contains the non-interactive commands of clnews
+      and their machine-readable output.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import csv
+import json
+from collections import OrderedDict
+
+from clnews import config
+from clnews.search import parse_query
+from clnews.news import Channel, new_events
+from clnews.fetch import fetch_channels
+from clnews.cache import ValidatorCache
+from clnews.dedup import DedupIndex
+from clnews.store import Store, migrate_data_file
+
+CHANNEL_FIELDS = ('code', 'name', 'url')
+
+EVENT_FIELDS = ('channel', 'title', 'url', 'date', 'published', 'guid',
+                'summary')
+
+SEARCH_FIELDS = ('score',) + EVENT_FIELDS
+
+
+def _to_csv(value):
+    if value is None:
+        return ''
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return value
+
+
+def write_ndjson(stream, fields, records):
+    """ Writes the records as JSON objects, one per line.
+
+    The stream is flushed after every record so that the consumers receive
+    the records as soon as they are available.
+
+    Args:
+        stream (file): The output stream.
+        fields (tuple): The names of the fields of the records.
+        records (iterable): The records as tuples of values.
+    """
+    for record in records:
+        stream.write(json.dumps(OrderedDict(zip(fields, record))) + '\n')
+        stream.flush()
+
+
+def write_csv(stream, fields, records):
+    """ Writes the records as CSV rows after a header row.
+
+    See :func:`write_ndjson`.
+    """
+    writer = csv.writer(stream)
+    writer.writerow(fields)
+    for record in records:
+        writer.writerow([_to_csv(value) for value in record])
+        stream.flush()
+
+
+WRITERS = {'ndjson': write_ndjson, 'csv': write_csv}
+
+
+def open_store():
+    """ Returns the store, importing the data of the older versions."""
+    store = Store(config.STORE_PATH)
+    migrate_data_file(store, config.CHANNELS_PATH)
+
+    return store
+
+
+def event_record(code, event):
+    """ Returns the record of an event, see EVENT_FIELDS."""
+    return (code, event.title, event.url, event.date, event.published,
+            event.guid, event.summary)
+
+
+def list_channels(store):
+    """ Yields the records of the channels, see CHANNEL_FIELDS."""
+    channels = store.load()['channels']
+    for code in sorted(channels):
+        yield code, channels[code]['name'], channels[code]['url']
+
+
+def get_events(store, codes, errors, dedup=None, new=False):
+    """ Yields the records of the events of the given channels.
+
+    The channels kept up to date by the daemon are read from the store while
+    the rest are retrieved concurrently, each one being yielded as soon as it
+    is available.
+
+    Args:
+        store (:class:`store.Store`): The store of the channels.
+        codes (list): The codes of the channels.
+        errors (list): The codes of the channels which could not be retrieved
+        are appended in it.
+
+    Kwargs:
+        dedup (:class:`dedup.DedupIndex`): Collapses the events already
+        retrieved by another channel.
+        new (bool): Only the events which were not shown before, see
+        :func:`news.new_events`.
+
+    Yields:
+        tuple. The records of the events, see EVENT_FIELDS.
+
+    Raises:
+        KeyError: A code is not in the list of the channels.
+    """
+    channels = store.load()['channels']
+    cache = ValidatorCache(store)
+    stale = []
+    retrieve = None
+    if new:
+        # the store or the feed is picked per channel by new_events
+        stale = [Channel(channels[code]['name'], channels[code]['url'], code,
+                         cache) for code in codes]
+        codes = []
+        retrieve = lambda channel: new_events(store, channel)
+
+    for code in codes:
+        url = channels[code]['url']
+        if store.is_fresh(url):
+            events = store.get_events(url)
+            if dedup is not None:
+                events = dedup.filter(events, code)
+            for event in events:
+                yield event_record(code, event)
+        else:
+            stale.append(Channel(channels[code]['name'], url, code, cache))
+
+    for channel, events in fetch_channels(stale, retrieve=retrieve):
+        if events is None:
+            errors.append(channel.code)
+            continue
+        if dedup is not None:
+            events = dedup.filter(events, channel.code)
+        for event in events:
+            yield event_record(channel.code, event)
+
+
+def search_events(store, query, limit=None):
+    """ Yields the records of the stored events matching a query.
+
+    Raises:
+        ValueError: The query is not valid.
+    """
+    for score, code, event in store.search(query,
+                                           limit or config.SEARCH_LIMIT):
+        yield (round(score, 4),) + event_record(code, event)
+
+
+def run_list(args, stream):
+    """ Writes the channels."""
+    WRITERS[args.format](stream, CHANNEL_FIELDS, list_channels(open_store()))
+
+
+def run_get(args, stream):
+    """ Writes the events of the given channels or of all of them.
+
+    Raises:
+        SystemExit: A channel is unknown or could not be retrieved.
+    """
+    store = open_store()
+    channels = store.load()['channels']
+    codes = args.codes or sorted(channels)
+    unknown = [code for code in codes if code not in channels]
+    if unknown:
+        raise SystemExit('Channel(s) not found: %s' % ', '.join(unknown))
+
+    errors = []
+    dedup = DedupIndex(config.DEDUP_PATH)
+    try:
+        WRITERS[args.format](stream, EVENT_FIELDS,
+                             get_events(store, codes, errors, dedup, args.new))
+    finally:
+        dedup.save()
+
+    if errors:
+        raise SystemExit('Error while retrieving: %s' % ', '.join(errors))
+
+
+def run_search(args, stream):
+    """ Writes the stored events matching the query.
+
+    Raises:
+        SystemExit: The query is not valid.
+    """
+    query = ' '.join(args.query)
+    # checked before the header of the output is written
+    try:
+        parse_query(query)
+    except ValueError:
+        raise SystemExit('Dates should be given as YYYY-MM-DD.')
+
+    WRITERS[args.format](stream, SEARCH_FIELDS,
+                         search_events(open_store(), query, args.limit))
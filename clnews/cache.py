@@ -0,0 +1,169 @@
+"""
+.. module:: cache
+   :platform: Unix
+      :synopsis: This module contains the caches of the channels' data.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import time
+import threading
+from collections import OrderedDict
+
+from clnews import config
+
+# the estimated memory taken by an event apart from its texts in bytes
+EVENT_OVERHEAD = 200
+
+
+class ValidatorCache(object):
+    """ Keeps the HTTP validators and the last events of every channel.
+
+    The ETag and Last-Modified values returned by the servers are sent back on
+    the next retrieval so that unchanged feeds are answered with a 304 and the
+    stored events are reused instead of downloading and parsing them again.
+    """
+
+    def __init__(self, store):
+        """ Initializes the class.
+
+        Args:
+            store (:class:`store.Store`): The store where the validators and
+            the events are persisted.
+        """
+        self.store = store
+
+    def get(self, url):
+        """ Returns the cached validators of the given URL.
+
+        Args:
+            url (str): The URL of the channel.
+
+        Returns:
+            tuple. (etag, modified) or None if the URL has no validators.
+        """
+        validators = self.store.get_validators(url)
+        if validators and any(validators):
+            return validators
+
+        return None
+
+    def get_events(self, url):
+        """ Returns the events of the latest retrieval of the given URL."""
+        return self.store.get_events(url)
+
+    def set(self, url, etag, modified, events):
+        """ Caches the validators and the events of the given URL.
+
+        Returns:
+            int. The number of the events which were not cached before.
+        """
+        return self.store.save_events(url, events, etag, modified)
+
+
+def events_size(events):
+    """ Estimates the memory taken by the given events in bytes."""
+    return sum(len(event.title or '') + len(event.url or '') +
+               len(event.date or '') + len(event.summary or '') +
+               len(event.guid or '') + EVENT_OVERHEAD
+               for event in events)
+
+
+class EventCache(object):
+    """ Keeps the latest events of the channels in memory.
+
+    The entries expire after a time to live and the least recently used ones
+    are evicted when the events take more memory than the budget, so that
+    repeated retrievals of a channel are served without reaching the store or
+    the network while its events are recent.
+    """
+
+    def __init__(self, ttl=None, budget=None):
+        """ Initializes the class.
+
+        Kwargs:
+            ttl (int): The seconds the events are kept for.
+            budget (int): The maximum estimated memory of the events in bytes.
+        """
+        self.ttl = ttl if ttl is not None else config.EVENT_CACHE_TTL
+        self.budget = budget if budget is not None \
+                      else config.EVENT_CACHE_BUDGET
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, code, url, now=None):
+        """ Returns the cached events of a channel.
+
+        Args:
+            code (str): The code of the channel.
+            url (str): The URL of the channel, the events of an older URL are
+            not returned.
+
+        Kwargs:
+            now (float): The current timestamp.
+
+        Returns:
+            list. The :class:`news.Event` objects or None if they are not
+            cached or they expired.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            entry = self._entries.pop(code, None)
+            if entry is None or entry[0] <= now or entry[1] != url:
+                if entry is not None:
+                    self.size -= entry[3]
+                self.misses += 1
+                return None
+
+            # the most recently used entries are kept at the end
+            self._entries[code] = entry
+            self.hits += 1
+
+            return entry[2]
+
+    def set(self, code, url, events, now=None):
+        """ Caches the events of a channel.
+
+        Args:
+            code (str): The code of the channel.
+            url (str): The URL of the channel.
+            events (list): The :class:`news.Event` objects.
+
+        Kwargs:
+            now (float): The current timestamp.
+        """
+        now = now if now is not None else time.time()
+        size = events_size(events)
+        with self._lock:
+            self._discard(code)
+            if size > self.budget:
+                return
+
+            self._entries[code] = (now + self.ttl, url, events, size)
+            self.size += size
+            while self.size > self.budget:
+                self.size -= self._entries.popitem(last=False)[1][3]
+                self.evictions += 1
+
+    def _discard(self, code):
+        entry = self._entries.pop(code, None)
+        if entry is not None:
+            self.size -= entry[3]
+
+    def discard(self, code):
+        """ Removes the events of a channel."""
+        with self._lock:
+            self._discard(code)
+
+    def clear(self):
+        """ Removes all the events."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -7,14 +7,42 @@
 
       """
 
+from itertools import chain
+
 from colorama import Fore, Style
 
 from clnews import config
-from clnews.news import Channel
+from clnews.news import Channel, new_events
+from clnews.fetch import fetch_channels, validate_urls
+from clnews.opml import make_code, read_opml, write_opml
+from clnews.cache import ValidatorCache, EventCache
+from clnews.dedup import DedupIndex
+from clnews.registry import ChannelRegistry, feed_url
 from clnews.decorators import less
-from clnews.utils import DataFile, validate_url
+from clnews.stats import STATS
+from clnews.store import Store, migrate_data_file
+from clnews.utils import validate_url
 from clnews.exceptions import  CommandIOError, ChannelRetrieveEventsError, \
-CommandExecutionError
+CommandExecutionError, ChannelDataNotFound, ChannelServerError, \
+StoreConflictError
+
+
+def format_events(events):
+    """ Formats lazily the given events for the output of the commands.
+
+    Returns:
+        generator. The text of every event followed by an empty line.
+
+    Raises:
+        TypeError: The events are not iterable.
+    """
+    return ("%3s. %s, %s\n     %s\n     %s\n\n" %
+            (Fore.WHITE + Style.BRIGHT + str(i), event.title,
+             Fore.MAGENTA + event.date,
+             Fore.WHITE + Style.DIM + event.url,
+             Fore.YELLOW + Style.NORMAL + event.summary)
+            for i, event
+            in enumerate(events, 1))
 
 
 class Command(object):
@@ -27,15 +55,25 @@ class Command(object):
     description = None
     options = ''
     data = {'channels': {}}
+    cache = None
+    dedup = None
+    events = None
+    # the version of the channels of the store loaded in data
+    version = None
 
     def __init__(self):
         """Initializes of the command."""
 
         # saves the output of the command
         self.buffer = None
-        self.data_file = DataFile(config.CHANNELS_PATH)
-        if not Command.data:
-            Command.data = self.data_file.load()
+        self.store = Store(config.STORE_PATH)
+        if Command.cache is None:
+            migrate_data_file(self.store, config.CHANNELS_PATH)
+            Command.cache = ValidatorCache(self.store)
+            Command.dedup = DedupIndex(config.DEDUP_PATH)
+            Command.events = EventCache()
+            Command.version = self.store.channels_version()
+            Command.data = self.store.load()
 
 
     def execute(self, *args):
@@ -43,17 +81,37 @@ class Command(object):
         """
         raise NotImplementedError
 
+    def reload(self):
+        """ Reloads the channels if they changed since they were loaded, e.g.
+        by another clnews process.
+        """
+        version = self.store.channels_version()
+        if version != Command.version:
+            Command.version = version
+            Command.data = self.store.load()
+
     def print_output(self):
         """ Prints the output of the command"""
         print self.buffer
 
+    @classmethod
+    def channels(cls):
+        """ Returns the :class:`registry.ChannelRegistry` of the channels,
+        indexing them first if they were given as a plain dict.
+        """
+        channels = cls.data.get('channels')
+        if not isinstance(channels, ChannelRegistry):
+            channels = cls.data['channels'] = ChannelRegistry(channels)
+
+        return channels
+
     @classmethod
     def code_exists(cls, code):
-        return code in cls.data['channels']
+        return code in cls.channels()
 
     @classmethod
     def url_exists(cls, url):
-        return url in [val['url'] for val in cls.data['channels'].values()]
+        return cls.channels().find_url(url) is not None
 
 class Help(Command):
     """ Implements the .help command.
@@ -114,17 +172,16 @@ class List(Command):
             list.
         """
         try:
-            output = ["%s| Name %s| Code" % (5 * " ", 15 * " "),
-                      "%s+%s+%s" % (5 * "-", 21 * "-", 20 * "-")]
-            output += ["%5s|%20s | %s" % (str(i + 1), name, short)
-                       for i, (short, name)
-                       in enumerate(self.buffer)]
-
-            return "\n".join(output)
+            lines = ("%5s|%20s | %s\n" % (str(i), name, short)
+                     for i, (short, name)
+                     in enumerate(self.buffer, 1))
         except TypeError:
             # the buffer is not a list as expected
             raise CommandIOError
 
+        return chain(["%s| Name %s| Code\n" % (5 * " ", 15 * " "),
+                      "%s+%s+%s\n" % (5 * "-", 21 * "-", 20 * "-")], lines)
+
 
 class Get(Command):
     """ Implements the .get command.
@@ -134,12 +191,14 @@ class Get(Command):
 
     name = ".get"
     description = "retrieves the news of a given channel"
-    options = '[channel_code]'
+    options = '[--fresh] [--new] [channel_code]'
 
     def execute(self, *args):
         """ Executes the command.
 
-        Retrieves the events for the given channel.
+        Retrieves the events for the given channel. The events retrieved
+        lately are served from memory unless --fresh is given, while --new
+        keeps only the events which were not shown before.
 
         Raises:
             CommandExecutionError
@@ -147,22 +206,114 @@ class Get(Command):
         if not Command.data:
             raise CommandExecutionError("You channels' list is empty.")
 
+        fresh = '--fresh' in args
+        new = '--new' in args
+        args = [arg for arg in args if arg not in ('--fresh', '--new')]
         if len(args) != 1:
             raise CommandExecutionError('Check the provided arguments.')
 
-        channel_code = args[0]
-        if channel_code not in Command.data['channels'].keys():
+        channel_code = Command.channels().lookup(args[0])
+        if channel_code is None:
             raise CommandExecutionError("Channel not found.")
 
         name = Command.data['channels'][channel_code]['name']
         url = Command.data['channels'][channel_code]['url']
 
-        channel = Channel(name, url)
+        if new:
+            channel = Channel(name, url, channel_code, Command.cache)
+            try:
+                events = new_events(self.store, channel, fresh)
+            except (ChannelDataNotFound, ChannelServerError,
+                    ChannelRetrieveEventsError):
+                raise CommandExecutionError("Error while retrieving data.")
+        else:
+            events = None if fresh else Command.events.get(channel_code, url)
+        if events is None:
+            if not fresh and self.store.is_fresh(url):
+                # kept up to date by the daemon
+                events = self.store.get_events(url)
+            else:
+                channel = Channel(name, url, channel_code, Command.cache)
+                try:
+                    events = channel.get_events()
+                except ChannelRetrieveEventsError:
+                    raise CommandExecutionError("Error while retrieving "
+                                                "data.")
+            Command.events.set(channel_code, url, events)
+
+        # the events already shown by another channel are collapsed
+        self.buffer = Command.dedup.filter(events, channel_code)
+        Command.dedup.save()
+
+    @less
+    def print_output(self):
+        """ Prints the output of the command
 
+        Raises:
+            CommandIOError: An error occured when the buffer is not a
+            list.
+        """
         try:
-            self.buffer = channel.get_events()
-        except ChannelRetrieveEventsError:
-            raise CommandExecutionError("Error while retrieving data.")
+            return format_events(self.buffer)
+
+        except TypeError:
+            # the buffer is not a list as expected
+            raise CommandIOError
+
+
+class GetAll(Command):
+    """ Implements the .getall command.
+
+    Derives from :class:`shell.Command` class and implements the .getall
+    command
+    """
+
+    name = ".getall"
+    description = "retrieves the news of many channels at once"
+    options = '[channel_code]...'
+
+    def execute(self, *args):
+        """ Executes the command.
+
+        Retrieves concurrently the events of the given channels or of all the
+        channels when none is given. The events retrieved lately are served
+        from memory and the ones kept up to date by the daemon from the store.
+
+        Raises:
+            CommandExecutionError
+        """
+        if not Command.data or not Command.data.get('channels'):
+            raise CommandExecutionError("You channels' list is empty.")
+
+        channels = Command.data['channels']
+        codes = args or sorted(channels)
+        for code in codes:
+            if code not in channels:
+                msg = 'Channel %s was not found in your list' % code
+                raise CommandExecutionError(msg)
+
+        self.buffer = []
+        stale = []
+        for code in codes:
+            channel = Channel(channels[code]['name'], channels[code]['url'],
+                              code, Command.cache)
+            events = Command.events.get(code, channel.url)
+            if events is None and self.store.is_fresh(channel.url):
+                # kept up to date by the daemon
+                events = self.store.get_events(channel.url)
+                Command.events.set(code, channel.url, events)
+            if events is None:
+                stale.append(channel)
+            else:
+                self.buffer.append((channel,
+                                    Command.dedup.filter(events, code)))
+
+        for channel, events in fetch_channels(stale):
+            if events is not None:
+                Command.events.set(channel.code, channel.url, events)
+                events = Command.dedup.filter(events, channel.code)
+            self.buffer.append((channel, events))
+        Command.dedup.save()
 
     @less
     def print_output(self):
@@ -172,20 +323,76 @@ class Get(Command):
             CommandIOError: An error occured when the buffer is not a
             list.
         """
+        if not isinstance(self.buffer, list):
+            raise CommandIOError
+
+        return self._format_output()
+
+    def _format_output(self):
         try:
-            output = ["%3s. %s, %s\n     %s\n     %s\n" %
-                      (Fore.WHITE + Style.BRIGHT + str(i + 1), event.title,
-                       Fore.MAGENTA + event.date,
-                       Fore.WHITE + Style.DIM + event.url,
-                       Fore.YELLOW + Style.NORMAL + event.summary)
-                      for i, event
-                      in enumerate(self.buffer)
-                      ]
+            for channel, events in self.buffer:
+                yield Fore.CYAN + Style.BRIGHT + "%s (%s)\n\n" % \
+                      (channel.name, channel.code)
+                if events is None:
+                    yield Fore.RED + Style.NORMAL + \
+                          "     Error while retrieving data.\n\n"
+                else:
+                    for entry in format_events(events):
+                        yield entry
+
+        except (TypeError, ValueError):
+            # the buffer is not a list of (channel, events) as expected
+            raise CommandIOError
+
+
+class Search(Command):
+    """ Implements the .search command.
+
+    Derives from :class:`shell.Command` class and implements the .search
+    command
+    """
+
+    name = ".search"
+    description = "searches the retrieved news"
+    options = '[term | "phrase" | channel:code | since:date | until:date]...'
+
+    def execute(self, *args):
+        """ Executes the command.
 
-            return "\n".join(output)
+        Searches the stored events ranking them by relevance.
+
+        Raises:
+            CommandExecutionError
+        """
+        if not args:
+            raise CommandExecutionError('No search terms were provided.')
+
+        try:
+            self.buffer = self.store.search(' '.join(args),
+                                            config.SEARCH_LIMIT)
+        except ValueError:
+            raise CommandExecutionError('Dates should be given as '
+                                        'YYYY-MM-DD.')
+
+    @less
+    def print_output(self):
+        """ Prints the output of the command
+
+        Raises:
+            CommandIOError: An error occured when the buffer is not a
+            list.
+        """
+        try:
+            return ("%3s. %s, %s %s\n     %s\n     %s\n\n" %
+                    (Fore.WHITE + Style.BRIGHT + str(i),
+                     event.title, Fore.CYAN + code,
+                     Fore.MAGENTA + event.date,
+                     Fore.WHITE + Style.DIM + event.url,
+                     Fore.YELLOW + Style.NORMAL + event.summary)
+                    for i, (_, code, event) in enumerate(self.buffer, 1))
 
         except TypeError:
-            # the buffer is not a list as expected
+            # the buffer is not a list of results as expected
             raise CommandIOError
 
 
@@ -228,12 +435,13 @@ class Add(Command):
         if not validate_url(url):
             raise CommandExecutionError('URL is either not valid or broken')
 
-        channel = {code: {'name': name, 'url': url}}
-        if 'channels' in Command.data:
-            Command.data['channels'].update(channel)
-        else:
-            Command.data['channels'] = channel
-        self.data_file.save(Command.data)
+        try:
+            self.store.add_channel(code, name, url)
+        except StoreConflictError:
+            # added meanwhile by another process
+            msg = 'This URL already exists in your list.'
+            raise CommandExecutionError(msg)
+        Command.channels()[code] = {'name': name, 'url': url}
         self.buffer = 'The RSS URL was added in your list.'
 
 
@@ -254,18 +462,169 @@ class Remove(Command):
 
         # remove all
         if len(args) == 1 and args[0] == '*':
-            Command.data = {}
-            self.data_file.save(Command.data)
+            # the stories of the removed channels are no longer collapsed
+            for code in Command.channels():
+                Command.dedup.discard(code)
+            Command.dedup.save()
+            Command.data = {'channels': ChannelRegistry()}
+            Command.events.clear()
+            self.store.clear()
             self.buffer = 'All the channels were removed from your list.'
             return
 
-        data_copy = dict(Command.data)
-        channel_codes = data_copy['channels'].keys()
         for arg in args:
-            if arg in channel_codes:
-                del data_copy['channels'][arg]
-            else:
+            if not Command.code_exists(arg):
                 msg = 'Channel %s was not found in your list' % arg
                 raise CommandExecutionError(msg)
-        self.data_file.save(data_copy)
+
+        for arg in args:
+            del Command.data['channels'][arg]
+            Command.events.discard(arg)
+            Command.dedup.discard(arg)
+        Command.dedup.save()
+        self.store.remove_channels(args)
         self.buffer = 'The channel(s) were removed from your list.'
+
+
+class Import(Command):
+    """ Implements the .import command.
+
+    Derives from :class:`shell.Command` class and implements the .import
+    command
+    """
+
+    name = ".import"
+    description = "adds the channels of an OPML file."
+    options = '[file]'
+
+    def execute(self, *args):
+        """ Executes the command.
+
+        Validates concurrently the URLs of the file and adds the valid ones
+        at once. The channels whose URL is already in the list are skipped.
+
+        Raises:
+            CommandExecutionError
+        """
+        if len(args) != 1:
+            raise CommandExecutionError('Command .import requires exactly 1 '
+                                        'argument: [file]')
+
+        try:
+            entries = read_opml(args[0])
+        except (IOError, SyntaxError) as error:
+            raise CommandExecutionError('The file could not be read: %s' %
+                                        error)
+
+        registry = Command.channels()
+        urls = set()
+        failures = []
+        candidates = []
+        for code, name, url in entries:
+            if registry.find_url(url) is not None or \
+               feed_url(url) in urls:
+                failures.append((url, 'already in your list'))
+            else:
+                urls.add(feed_url(url))
+                candidates.append((code, name, url))
+
+        valid = set(url for url, ok
+                    in validate_urls(url for _, _, url in candidates) if ok)
+
+        # the codes are given in the order of the file
+        channels = []
+        taken = set(registry)
+        for code, name, url in candidates:
+            if url not in valid:
+                failures.append((url, 'not valid or broken'))
+                continue
+            if not code or code in taken:
+                code = make_code(name, taken)
+            taken.add(code)
+            channels.append((code, name, url))
+
+        # the URLs added meanwhile by another process are skipped
+        conflicts = self.store.add_channels(channels)
+        failures += [(url, 'already in your list')
+                     for _, _, url in conflicts]
+        channels = [channel for channel in channels
+                    if channel not in conflicts]
+        for code, name, url in channels:
+            registry[code] = {'name': name, 'url': url}
+
+        self.buffer = '%d channel(s) were added in your list.' % len(channels)
+        if failures:
+            self.buffer += '\n%d URL(s) were skipped:\n' % len(failures)
+            self.buffer += '\n'.join('     %s: %s' % failure
+                                      for failure in sorted(failures))
+
+
+class Export(Command):
+    """ Implements the .export command.
+
+    Derives from :class:`shell.Command` class and implements the .export
+    command
+    """
+
+    name = ".export"
+    description = "saves the channels in an OPML file."
+    options = '[file]'
+
+    def execute(self, *args):
+        """ Executes the command.
+
+        Raises:
+            CommandExecutionError
+        """
+        if len(args) != 1:
+            raise CommandExecutionError('Command .export requires exactly 1 '
+                                        'argument: [file]')
+
+        try:
+            write_opml(args[0], Command.data['channels'])
+        except IOError as error:
+            raise CommandExecutionError('The file could not be written: %s' %
+                                        error)
+
+        self.buffer = '%d channel(s) were saved in %s.' % \
+                      (len(Command.data['channels']), args[0])
+
+
+class Stats(Command):
+    """ Implements the .stats command.
+
+    Derives from :class:`shell.Command` class and implements the .stats
+    command
+    """
+
+    name = ".stats"
+    description = "shows the timings and the counters of the session."
+    options = '[--prometheus] [--clear]'
+
+    def execute(self, *args):
+        """ Executes the command.
+
+        Lists the timings of the retrievals per channel and of the commands,
+        the slowest first, and the counters, e.g. of the downloaded bytes.
+        --prometheus gives them in the text format of Prometheus while
+        --clear resets them.
+
+        Raises:
+            CommandExecutionError
+        """
+        if any(arg not in ('--prometheus', '--clear') for arg in args):
+            raise CommandExecutionError('Check the provided arguments.')
+
+        if '--clear' in args:
+            STATS.clear()
+            self.buffer = 'The statistics were cleared.'
+        elif '--prometheus' in args:
+            self.buffer = STATS.prometheus().rstrip('\n')
+        else:
+            events = Command.events
+            self.buffer = STATS.report() + \
+                          '\nevent cache: %d hits, %d misses, %d evictions, ' \
+                          '%d channels, %d KB' % (events.hits, events.misses,
+                                                  events.evictions,
+                                                  len(events),
+                                                  events.size / 1024)
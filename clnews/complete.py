@@ -0,0 +1,108 @@
+"""
+.. module:: complete
+   :platform: Unix
+      :synopsis: This module contains the tab completion of the shell.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import bisect
+
+# the commands whose arguments are channel codes
+CHANNEL_COMMANDS = ('.get', '.getall', '.remove')
+
+# the options of the commands, sorted
+OPTIONS = {'.get': ['--fresh', '--new'],
+           '.stats': ['--clear', '--prometheus']}
+
+# the filter of the .search command which takes a channel code
+CHANNEL_FILTER = 'channel:'
+
+# the characters which separate the completed words
+DELIMITERS = ' \t\n'
+
+
+def starting(words, prefix):
+    """ Returns the words of a sorted list which start with the prefix."""
+    matches = []
+    for i in xrange(bisect.bisect_left(words, prefix), len(words)):
+        if not words[i].startswith(prefix):
+            break
+        matches.append(words[i])
+
+    return matches
+
+
+class Completer(object):
+    """ Completes the commands of the shell and their channel codes.
+
+    The commands are kept sorted and the channels are looked up in the indexes
+    of the :class:`registry.ChannelRegistry`, so that the completions are
+    found by binary searches however many the channels are. A word completes
+    to the codes starting with it and to the codes of the channels whose name
+    starts with it.
+    """
+
+    def __init__(self, commands, channels):
+        """ Initializes the class.
+
+        Args:
+            commands (list): The names of the commands.
+            channels (function): Returns the current
+            :class:`registry.ChannelRegistry`.
+        """
+        self.commands = sorted(commands)
+        self.channels = channels
+        self._matches = []
+
+    def codes(self, prefix):
+        """ Returns the codes matching the prefix, see :class:`Completer`."""
+        registry = self.channels()
+        codes = registry.complete(prefix)
+        seen = set(codes)
+        for code in registry.complete_name(prefix):
+            if code not in seen:
+                seen.add(code)
+                codes.append(code)
+
+        return codes
+
+    def matches(self, line, text):
+        """ Returns the completions of a word of a line.
+
+        Args:
+            line (str): The line up to the word.
+            text (str): The word being completed.
+
+        Returns:
+            list. The completed words.
+        """
+        tokens = line.split()
+        if not tokens:
+            return starting(self.commands, text)
+
+        command = tokens[0]
+        if text.startswith('-'):
+            return starting(OPTIONS.get(command, []), text)
+        elif command in CHANNEL_COMMANDS:
+            return self.codes(text)
+        elif command == '.search' and text.startswith(CHANNEL_FILTER):
+            return [CHANNEL_FILTER + code
+                    for code in self.codes(text[len(CHANNEL_FILTER):])]
+
+        return []
+
+    def __call__(self, text, state):
+        """ The completer of readline, returns the completion of the given
+        index or None when there are no more.
+        """
+        if state == 0:
+            import readline
+
+            line = readline.get_line_buffer()[:readline.get_begidx()]
+            self._matches = self.matches(line, text)
+
+        try:
+            return self._matches[state]
+        except IndexError:
+            return None
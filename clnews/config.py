@@ -13,4 +13,74 @@ VERSION = "0.4.0"
 
 PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
 
+STORE_PATH = os.path.join(PROJECT_PATH, "data/clnews.db")
+
+# maximum number of idle read-only connections kept per store
+STORE_READERS = 8
+
+DEDUP_PATH = os.path.join(PROJECT_PATH, "data/dedup.dat")
+
+# seconds the keys of the deduplicated events are kept for after they were
+# last retrieved
+DEDUP_TTL = 30 * 24 * 60 * 60
+
+# the pickled channels' file of the older versions, imported into the store
 CHANNELS_PATH = os.path.join(PROJECT_PATH, "data/channels.dat")
+
+# maximum number of channels being fetched at the same time
+FETCH_WORKERS = 16
+
+# maximum number of concurrent requests towards the same host
+FETCH_PER_HOST = 4
+
+# timeout of the requests in seconds
+FETCH_TIMEOUT = 30
+
+# number of processes parsing the feeds of many channels, the number of the
+# CPUs if None, while with 1 the feeds are parsed by the fetching threads
+PARSE_WORKERS = None
+
+# maximum seconds the parsing of a feed may take in a process
+PARSE_TIMEOUT = 60
+
+# maximum number of idle keep-alive connections kept per host
+HTTP_POOL_SIZE = 4
+
+# seconds the addresses of the hosts are cached for
+DNS_TTL = 5 * 60
+
+USER_AGENT = 'clnews/%s' % VERSION
+
+# timeout of the validation of the added URLs in seconds
+VALIDATE_TIMEOUT = 5
+
+# seconds the validation of a URL is cached for, much shorter when it
+# failed as the server may be down only for a while
+VALIDATE_TTL = 10 * 60
+VALIDATE_FAILURE_TTL = 30
+
+# initial, minimum and maximum polling intervals of the daemon in seconds
+POLL_INTERVAL = 15 * 60
+POLL_MIN_INTERVAL = 60
+POLL_MAX_INTERVAL = 24 * 60 * 60
+
+# maximum number of results of the .search command
+SEARCH_LIMIT = 50
+
+# the pager of the output of the commands: 'less', 'internal' for the
+# in-process one or None to print the output directly
+PAGER = 'less'
+
+# the address of the HTTP API
+API_HOST = '127.0.0.1'
+API_PORT = 8080
+
+# default and maximum number of events of a page of the HTTP API
+API_PAGE_LIMIT = 50
+API_MAX_LIMIT = 1000
+
+# seconds the events of a channel are kept in memory for
+EVENT_CACHE_TTL = 5 * 60
+
+# maximum estimated memory of the events kept in memory in bytes
+EVENT_CACHE_BUDGET = 32 * 1024 * 1024
@@ -0,0 +1,149 @@
+"""
+.. module:: daemon
+   :platform: Unix
+      :synopsis: This module contains the background polling of the channels.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import time
+import logging
+import threading
+
+from clnews import config
+from clnews.news import Channel
+from clnews.fetch import Fetcher
+from clnews.cache import ValidatorCache
+
+logger = logging.getLogger(__name__)
+
+# the factors the interval is multiplied with when a channel has no new events
+# or could not be retrieved
+QUIET_BACKOFF = 1.5
+FAILURE_BACKOFF = 2
+
+
+def next_interval(interval, new_count, failures, hint=None):
+    """ Computes the polling interval of a channel after a retrieval.
+
+    The interval is halved when new events were found and grows exponentially
+    while the channel stays quiet or keeps failing. It never drops below the
+    refresh period advertised by the feed.
+
+    Args:
+        interval (int): The current interval in seconds.
+        new_count (int): The number of new events of the retrieval.
+        failures (int): The number of consecutive failed retrievals.
+
+    Kwargs:
+        hint (int): The refresh period advertised by the feed in seconds.
+
+    Returns:
+        int. The next interval in seconds.
+    """
+    if failures:
+        interval *= FAILURE_BACKOFF
+    elif new_count:
+        interval /= 2.0
+    else:
+        interval *= QUIET_BACKOFF
+
+    if hint:
+        interval = max(interval, min(hint, config.POLL_MAX_INTERVAL))
+
+    return int(min(max(interval, config.POLL_MIN_INTERVAL),
+                   config.POLL_MAX_INTERVAL))
+
+
+class Daemon(object):
+    """ Polls the channels of the store on an adaptive schedule.
+
+    The new events are written in the store so that the interactive commands
+    read them from the disk instead of the network.
+    """
+
+    def __init__(self, store, fetcher=None, dedup=None):
+        """ Initializes the class.
+
+        Args:
+            store (:class:`store.Store`): The store of the channels.
+
+        Kwargs:
+            fetcher (:class:`fetch.Fetcher`): The fetcher of the channels.
+            dedup (:class:`dedup.DedupIndex`): The index where the retrieved
+            events are added.
+        """
+        self.store = store
+        self.cache = ValidatorCache(store)
+        self.fetcher = fetcher or Fetcher()
+        self.dedup = dedup
+        self.running = False
+        # the polling loop and the refreshes of the API poll one at a time
+        self._lock = threading.Lock()
+
+    def poll(self, now=None, codes=None):
+        """ Retrieves the channels which are due.
+
+        Kwargs:
+            now (int): The current timestamp.
+            codes (list): Only the channels with these codes, all of them if
+            None.
+
+        Returns:
+            int. The seconds until the next channel is due.
+        """
+        # the channels retrieved by a concurrent poll are not due anymore
+        # once it is over
+        with self._lock:
+            return self._poll(now, codes)
+
+    def _poll(self, now, codes):
+        now = now if now is not None else int(time.time())
+        due = dict((entry['code'], entry)
+                   for entry in self.store.get_schedule()
+                   if (not entry['next_fetch'] or entry['next_fetch'] <= now)
+                   and (codes is None or entry['code'] in codes))
+
+        channels = [Channel(entry['name'], entry['url'], code, self.cache)
+                    for code, entry in due.iteritems()]
+        for channel, events in self.fetcher.fetch(channels):
+            entry = due[channel.code]
+            if events is None:
+                failures = entry['failures'] + 1
+                logger.warning('%s: retrieval failed (%r)', channel.code,
+                               channel.error)
+            else:
+                failures = 0
+                if self.dedup is not None:
+                    self.dedup.filter(events, channel.code)
+
+            interval = next_interval(entry['interval'] or config.POLL_INTERVAL,
+                                     channel.new_count, failures,
+                                     channel.hint or entry['hint'])
+            self.store.set_schedule(channel.code, interval, now + interval,
+                                    failures, channel.hint)
+            logger.info('%s: %d new events, next retrieval in %ds',
+                        channel.code, channel.new_count, interval)
+
+        if self.dedup is not None and due:
+            self.dedup.save()
+
+        # the channels added meanwhile are due immediately
+        pending = [entry['next_fetch'] or now
+                   for entry in self.store.get_schedule()]
+        if not pending:
+            return config.POLL_INTERVAL
+
+        return max(min(pending) - now, 0)
+
+    def run(self):
+        """ Polls the channels until :meth:`stop` is called."""
+        self.running = True
+        while self.running:
+            wait = self.poll()
+            # wakes up regularly to pick up the channels added meanwhile
+            time.sleep(max(min(wait, config.POLL_MIN_INTERVAL), 1))
+
+    def stop(self):
+        """ Stops the polling loop."""
+        self.running = False
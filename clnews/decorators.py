@@ -8,28 +8,116 @@
       """
 
 from subprocess import Popen, PIPE
+import sys
 import errno
+import fcntl
+import struct
+import termios
+
+from clnews import config
+
+
+def terminal_rows(stream):
+    """ Returns the number of rows of the terminal of the given stream."""
+    try:
+        rows = struct.unpack('hh', fcntl.ioctl(stream.fileno(),
+                                               termios.TIOCGWINSZ, '1234'))[0]
+    except (IOError, AttributeError, ValueError):
+        rows = 0
+
+    return rows or 24
+
+
+class Pager(object):
+    """ Pages the output in process, one screen at a time.
+
+    After every screen it waits for Enter before showing the next one, while
+    'q' closes the pager.
+    """
+
+    def __init__(self, stream=None, rows=None, prompt=raw_input):
+        """ Initializes the class.
+
+        Kwargs:
+            stream (file): The stream of the output, the stdout if None.
+            rows (int): The rows of a screen, the terminal's if None.
+            prompt (function): Reads the answer of the user to a prompt.
+        """
+        self.stream = stream or sys.stdout
+        self.rows = rows or terminal_rows(self.stream)
+        self.prompt = prompt
+        self._lines = 0
+
+    def write(self, text):
+        """ Writes the given text pausing at the end of every screen.
+
+        Raises:
+            IOError: The user closed the pager, with errno.EPIPE as a broken
+            pipe would.
+        """
+        for line in text.splitlines(True):
+            if self._lines >= self.rows - 1:
+                self.stream.flush()
+                if self.prompt('--More--').strip().lower() == 'q':
+                    raise IOError(errno.EPIPE, 'The pager was closed')
+                self._lines = 0
+            self.stream.write(line)
+            self._lines += 1
+
+    def close(self):
+        self.stream.flush()
+
+
+def _open_pager():
+    if not sys.stdout.isatty() or not config.PAGER:
+        return sys.stdout, None
+    elif config.PAGER == 'internal':
+        return Pager(), None
+
+    pipe = Popen([config.PAGER, '-R'], stdin=PIPE)
+    return pipe.stdin, pipe
+
 
 def less(func):
     """Less decorator.
 
-    Pipes the output of the decorated function into the less commans
+    Pipes the output of the decorated function into the pager given in
+    config.PAGER. The output is either a string or an iterable of strings which
+    is consumed lazily, so that the pager shows the first screen as soon as it
+    is formatted and the formatting stops when the pager is closed.
 
     """
     def inner(self):
-        pipe = Popen(['less', '-R'], stdin=PIPE)
-        line = func(self)
+        output = func(self)
+        if isinstance(output, basestring):
+            output = [output]
+
+        stream, pipe = _open_pager()
         try:
-            pipe.stdin.write(line)
+            for chunk in output:
+                stream.write(chunk)
         except IOError as err:
-            if err.errno == errno.EPIPE or err.errno == errno.EINVAL:
-                # Stop loop on "Invalid pipe" or "Invalid argument".
-                # No sense in continuing with broken pipe.
-                return
-            else:
+            if err.errno != errno.EPIPE and err.errno != errno.EINVAL:
                 # Raise any other error.
                 raise
+            # Stop loop on "Invalid pipe" or "Invalid argument".
+            # No sense in continuing with broken pipe.
+        finally:
+            if hasattr(output, 'close'):
+                # stops the formatting
+                output.close()
+
+            # the pager is waited for even when the formatting failed or was
+            # interrupted, so that it does not keep holding the terminal
+            if pipe is not None:
+                try:
+                    stream.close()
+                except IOError:
+                    pass
+                pipe.wait()
+            elif stream is not sys.stdout:
+                stream.close()
 
-        pipe.stdin.close()
-        pipe.wait()
+    # gives access to the output without the pager
+    inner.__wrapped__ = func
     return inner
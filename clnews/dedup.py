@@ -0,0 +1,309 @@
+"""
+.. module:: dedup
+   :platform: Unix
+      :synopsis: This module contains the deduplication of events across
+      channels.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import re
+import time
+import struct
+import urllib
+import hashlib
+import urlparse
+import threading
+
+from clnews import config
+from clnews.utils import DataFile, to_unicode
+
+# query parameters which do not change the content of a page
+TRACKING_PARAMS = re.compile(r'^(utm_.*|fbclid|gclid|ref|rss|cmp)$')
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# the fingerprints consist of 8 one-byte minhashes and are split in bands of
+# 2 bytes; two fingerprints which differ in at most 2 bytes share a band
+HASHES = 8
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# the GUIDs which are URLs identify the events across the channels
+PERMALINK = re.compile(r'^https?://', re.IGNORECASE)
+
+DAY = 24 * 60 * 60
+
+# the texts with fewer tokens are too short to be fingerprinted reliably
+MIN_TOKENS = 5
+
+
+def normalize_url(url):
+    """ Normalizes a URL so that equivalent URLs compare equal.
+
+    The scheme and host are lowercased, the default port, the fragment, the
+    trailing slash and the tracking parameters are removed and the query
+    parameters are sorted.
+    """
+    parts = urlparse.urlsplit(url.strip())
+    netloc = parts.netloc.lower()
+    if netloc.endswith(':80') or netloc.endswith(':443'):
+        netloc = netloc.rsplit(':', 1)[0]
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+
+    query = sorted((key, value)
+                   for key, value in urlparse.parse_qsl(parts.query, True)
+                   if not TRACKING_PARAMS.match(key))
+
+    return urlparse.urlunsplit(('', netloc, parts.path.rstrip('/') or '/',
+                                urllib.urlencode(query), ''))
+
+
+def hash64(text):
+    """ Returns a 64 bit hash of the given text."""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+
+    return int(hashlib.md5(text).hexdigest()[:16], 16)
+
+
+def fingerprint(text):
+    """ Returns the 64 bit MinHash fingerprint of the given text.
+
+    The text is split in overlapping pairs of words and every byte of the
+    fingerprint keeps the lowest 8 bits of the minimum of a different hash of
+    them, so the share of equal bytes of two fingerprints estimates how
+    similar their texts are.
+
+    Returns:
+        int. The fingerprint or None if the text is too short.
+    """
+    tokens = TOKEN.findall(to_unicode(text).lower())
+    if len(tokens) < MIN_TOKENS:
+        return None
+
+    minimums = [0xFFFF] * HASHES
+    for shingle in set(zip(tokens, tokens[1:])):
+        digest = hashlib.md5(u' '.join(shingle).encode('utf-8')).digest()
+        minimums = map(min, minimums, struct.unpack('>8H', digest))
+
+    return sum((value & 0xFF) << i * 8 for i, value in enumerate(minimums))
+
+
+def similarity(a, b):
+    """ Returns the number of the equal bytes of two fingerprints."""
+    return sum(1 for i in xrange(HASHES)
+               if (a >> i * 8 & 0xFF) == (b >> i * 8 & 0xFF))
+
+
+class DedupIndex(object):
+    """ Detects the events which were already retrieved by another channel.
+
+    The events are keyed on the hashes of their normalized URL and GUID and on
+    the MinHash fingerprint of their title and summary. Every key belongs to
+    the channel that retrieved it first, so that a channel keeps showing its
+    own events while the same story syndicated by other channels is collapsed.
+
+    The exact keys are looked up in a dict and the fingerprints in buckets per
+    band, so all the lookups take constant time. Every key is kept along with
+    the day its channel last retrieved it and is dropped when it has not been
+    retrieved for config.DEDUP_TTL seconds, or when its channel is removed.
+    """
+
+    def __init__(self, filename=None, threshold=6, ttl=None):
+        """ Initializes the class.
+
+        Kwargs:
+            filename (str): The file where the index is persisted.
+            threshold (int): The minimum number of equal bytes of the
+            fingerprints of near duplicates.
+            ttl (int): The seconds the keys are kept for, config.DEDUP_TTL
+            if None.
+        """
+        self.data_file = DataFile(filename) if filename else None
+        self.threshold = threshold
+        self.ttl = ttl if ttl is not None else config.DEDUP_TTL
+        self._lock = threading.Lock()
+        # key -> (owner, day), the tuples being shared
+        self._keys = {}
+        self._fingerprints = {}
+        self._bands = {}
+        self._owners = {}
+        # whether the index changed since it was loaded or saved
+        self._dirty = False
+        # the owners discarded since the index was loaded or saved
+        self._discarded = set()
+
+        data = self.data_file.load() if self.data_file else None
+        if data:
+            today = _today()
+            self._keys = dict((key, self._owner(owner, today))
+                              for key, owner in data['keys'].iteritems())
+            for fingerprint, owner in data['fingerprints'].iteritems():
+                self._add_fingerprint(fingerprint, self._owner(owner, today))
+
+    def __len__(self):
+        return len(self._keys) + len(self._fingerprints)
+
+    def _owner(self, owner, day):
+        # the older files keep only the owners
+        if not isinstance(owner, tuple):
+            owner = (owner, day)
+
+        return self._owners.setdefault(owner, owner)
+
+    def _band_keys(self, fingerprint):
+        return [(band, fingerprint >> band * BAND_BITS & BAND_MASK)
+                for band in xrange(BANDS)]
+
+    def _add_fingerprint(self, fingerprint, owner):
+        self._fingerprints[fingerprint] = owner
+        for key in self._band_keys(fingerprint):
+            self._bands.setdefault(key, []).append(fingerprint)
+
+    def _remove_fingerprint(self, fingerprint):
+        del self._fingerprints[fingerprint]
+        for key in self._band_keys(fingerprint):
+            self._bands[key].remove(fingerprint)
+            if not self._bands[key]:
+                del self._bands[key]
+
+    def _find_fingerprint(self, fingerprint):
+        if fingerprint in self._fingerprints:
+            return fingerprint
+
+        for key in self._band_keys(fingerprint):
+            for candidate in self._bands.get(key, ()):
+                if similarity(fingerprint, candidate) >= self.threshold:
+                    return candidate
+
+        return None
+
+    def keys(self, event, owner):
+        """ Returns the exact keys and the fingerprint of an event.
+
+        A GUID which is not a URL is unique only in its own feed, so it is
+        keyed along with the code of the channel.
+        """
+        keys = [hash64(normalize_url(event.url))]
+        if event.guid and event.guid != event.url:
+            if PERMALINK.match(event.guid):
+                keys.append(hash64(event.guid))
+            else:
+                keys.append(hash64(u'%s\0%s' % (owner,
+                                                 to_unicode(event.guid))))
+
+        return keys, fingerprint(u'%s %s' % (to_unicode(event.title),
+                                             to_unicode(event.summary)))
+
+    def add(self, event, owner):
+        """ Adds an event in the index.
+
+        Args:
+            event (:class:`news.Event`): The event to add.
+            owner (str): The code of the channel of the event.
+
+        Returns:
+            bool. False if the event was already retrieved by another channel.
+        """
+        keys, fingerprint = self.keys(event, owner)
+        with self._lock:
+            found = [self._keys.get(key) for key in keys]
+            if fingerprint is not None:
+                similar = self._find_fingerprint(fingerprint)
+                found.append(self._fingerprints.get(similar))
+
+            found = [found for found in found if found is not None]
+            if found and found[0][0] != owner:
+                return False
+
+            # the keys of the channel are renewed once a day
+            value = self._owner(owner, _today())
+            for key in keys:
+                if self._keys.get(key) != value:
+                    self._keys[key] = value
+                    self._dirty = True
+            if fingerprint is not None:
+                if similar is None:
+                    self._add_fingerprint(fingerprint, value)
+                    self._dirty = True
+                elif self._fingerprints[similar] != value:
+                    self._fingerprints[similar] = value
+                    self._dirty = True
+
+            return True
+
+    def filter(self, events, owner):
+        """ Returns the events which were not retrieved by another channel.
+
+        Args:
+            events (list): The :class:`news.Event` objects of a channel.
+            owner (str): The code of the channel.
+        """
+        return [event for event in events if self.add(event, owner)]
+
+    def discard(self, owner):
+        """ Drops the keys of a channel, e.g. when it is removed, so that the
+        events it retrieved first are shown by the other channels.
+
+        Args:
+            owner (str): The code of the channel.
+        """
+        with self._lock:
+            self._discard(lambda value: value[0] == owner)
+            self._discarded.add(owner)
+
+    def prune(self, now=None):
+        """ Drops the keys which were not retrieved for self.ttl seconds."""
+        oldest = _today(now) - self.ttl // DAY
+        with self._lock:
+            self._discard(lambda value: value[1] < oldest)
+
+    def _discard(self, match):
+        for key in [key for key, value in self._keys.iteritems()
+                    if match(value)]:
+            del self._keys[key]
+            self._dirty = True
+        for fingerprint in [fingerprint for fingerprint, value
+                            in self._fingerprints.iteritems() if match(value)]:
+            self._remove_fingerprint(fingerprint)
+            self._dirty = True
+
+    def save(self):
+        """ Persists the index, unless it has not changed.
+
+        The expired keys are dropped before the index is written.
+        """
+        if self.data_file is None or not self._dirty:
+            return
+
+        self.prune()
+        with self._lock:
+            self.data_file.update(self._merge)
+            self._dirty = False
+            self._discarded.clear()
+
+    def _merge(self, data):
+        # keeps the events indexed by the other processes meanwhile, except
+        # the ones of the discarded or expired channels
+        if data:
+            today = _today()
+            oldest = today - self.ttl // DAY
+            for key, owner in data['keys'].iteritems():
+                owner = self._owner(owner, today)
+                if key not in self._keys and owner[1] >= oldest and \
+                   owner[0] not in self._discarded:
+                    self._keys[key] = owner
+            for fingerprint, owner in data['fingerprints'].iteritems():
+                owner = self._owner(owner, today)
+                if fingerprint not in self._fingerprints and \
+                   owner[1] >= oldest and owner[0] not in self._discarded:
+                    self._add_fingerprint(fingerprint, owner)
+
+        return {'keys': self._keys, 'fingerprints': self._fingerprints}
+
+
+def _today(now=None):
+    return int((now if now is not None else time.time()) // DAY)
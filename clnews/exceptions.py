@@ -25,6 +25,10 @@ class ChannelRetrieveEventsError(Exception):
     """ Is raised when an uncaught exceptions occurs during events' retrieval."""
 
 
+class TransportError(Exception):
+    """ Is raised when an HTTP request fails."""
+
+
 # Shell Exceptions
 class ShellLoadDataIOError(Exception):
     """ Is raised when the data file is not found"""
@@ -41,6 +45,16 @@ class CommandIOError(Exception):
     """ Is raised when output is not of the expected type."""
 
 
+# Store Exceptions
+class StoreConflictError(Exception):
+    """ Is raised when the URL of a channel belongs to another channel"""
+
+
 # Data structure exceptions
 class StackEmptyError(Exception):
     """ Is raised when a stack is empty"""
+
+
+# API Exceptions
+class APIBadRequest(Exception):
+    """ Is raised when a request of the API has invalid parameters."""
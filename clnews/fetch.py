@@ -0,0 +1,194 @@
+"""
+.. module:: fetch
+   :platform: Unix
+      :synopsis: This module contains the concurrent retrieval of channels.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import threading
+import urlparse
+import functools
+from Queue import Queue
+from collections import deque
+
+from clnews import config
+from clnews.stats import STATS
+from clnews.utils import validate_url
+
+
+class Fetcher(object):
+    """ Retrieves the events of many channels concurrently.
+
+    The channels are fetched by a bounded pool of threads while a semaphore per
+    host caps the number of simultaneous requests towards the same server.
+    The channels of a host are queued only as its requests finish, so that
+    the threads never wait for a busy host while other hosts are pending.
+    When many channels are fetched, their feeds are parsed by a pool of
+    processes, see :class:`parse.ParsePool`.
+    """
+
+    def __init__(self, workers=None, per_host=None, parser=None):
+        """ Initializes the class.
+
+        Kwargs:
+            workers (int): The maximum number of threads.
+            per_host (int): The maximum number of concurrent requests per host.
+            parser (:class:`parse.ParsePool`): Parses the feeds, the shared
+            pool if None.
+        """
+        self.workers = workers or config.FETCH_WORKERS
+        self.per_host = per_host or config.FETCH_PER_HOST
+        self.parser = parser
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = _host(url)
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+
+            return self._hosts[host]
+
+    def _parser(self):
+        if self.parser is not None:
+            return self.parser
+
+        # multiprocessing is loaded only when many channels are fetched
+        from clnews.parse import default_pool
+        return default_pool()
+
+    def _fetch(self, retrieve, channel):
+        # the semaphore is waited for only by concurrent calls of the fetcher
+        with self._host_semaphore(channel.url):
+            try:
+                events = retrieve(channel)
+            except Exception as error:
+                # the error is handed over to the consumer along with the
+                # channel instead of killing the worker
+                channel.error = error
+                events = None
+                STATS.incr('errors', channel=channel.code or channel.url)
+
+        return channel, events
+
+    def _validate(self, url):
+        with self._host_semaphore(url):
+            return url, validate_url(url)
+
+    def _worker(self, func, tasks, results, done):
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            host, item = task
+            result = func(item)
+            done(host)
+            results.put(result)
+
+    def _run(self, func, items, url):
+        """ Runs a function over the items in the pool of threads, yielding
+        its results as soon as they are ready.
+
+        At most self.per_host items of the same host are queued at a time,
+        the next one being queued as soon as one of them is done.
+
+        Args:
+            func (function): The function to run.
+            items (list): The arguments of the function.
+            url (function): Returns the URL of an item.
+        """
+        if not items:
+            return
+
+        tasks = Queue()
+        results = Queue()
+        # host -> the items waiting for a request to the host to finish
+        waiting = {}
+        queued = {}
+        for item in items:
+            host = _host(url(item))
+            if queued.get(host, 0) < self.per_host:
+                queued[host] = queued.get(host, 0) + 1
+                tasks.put((host, item))
+            else:
+                waiting.setdefault(host, deque()).append(item)
+
+        lock = threading.Lock()
+
+        def done(host):
+            with lock:
+                if waiting.get(host):
+                    tasks.put((host, waiting[host].popleft()))
+
+        workers = min(self.workers, len(items))
+        for _ in range(workers):
+            thread = threading.Thread(target=self._worker,
+                                      args=(func, tasks, results, done))
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for _ in items:
+                yield results.get()
+        finally:
+            for _ in range(workers):
+                tasks.put(None)
+
+    def fetch(self, channels, retrieve=None):
+        """ Retrieves the events of the given channels.
+
+        Args:
+            channels (list): The :class:`news.Channel` objects to fetch.
+
+        Kwargs:
+            retrieve (function): Returns the events of a channel, its
+            get_events method if None.
+
+        Yields:
+            tuple. (channel, events) as soon as each channel is retrieved. The
+            events are None when the retrieval failed, in which case the error
+            is available in channel.error.
+        """
+        retrieve = retrieve or (lambda channel: channel.get_events())
+        channels = list(channels)
+        for channel in channels:
+            channel.error = None
+
+        parser = self._parser() if len(channels) > 1 else None
+        if parser is not None:
+            # the processes are forked by the first feed being parsed, as
+            # the events of many retrievals are streamed instead
+            for channel in channels:
+                channel.parser = parser
+
+        for result in self._run(functools.partial(self._fetch, retrieve),
+                                channels, lambda channel: channel.url):
+            yield result
+
+    def validate(self, urls):
+        """ Validates the given URLs, see :func:`utils.validate_url`.
+
+        Args:
+            urls (list): The URLs to validate.
+
+        Yields:
+            tuple. (url, valid) as soon as each URL is validated.
+        """
+        for result in self._run(self._validate, list(urls), lambda url: url):
+            yield result
+
+
+def _host(url):
+    return urlparse.urlparse(url).netloc.lower()
+
+
+def fetch_channels(channels, workers=None, per_host=None, retrieve=None):
+    """ Shortcut of :meth:`Fetcher.fetch`."""
+    return Fetcher(workers, per_host).fetch(channels, retrieve)
+
+
+def validate_urls(urls, workers=None, per_host=None):
+    """ Shortcut of :meth:`Fetcher.validate`."""
+    return Fetcher(workers, per_host).validate(urls)
@@ -6,16 +6,33 @@
       .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
 
       """
-import feedparser
+import bisect
+import calendar
+from array import array
 
-from clnews.utils import remove_html
+from clnews.utils import remove_html, remove_html_bulk, to_unicode, \
+pop_validated_response
+from clnews.stats import STATS
 from clnews.exceptions import ChannelDataNotFound, ChannelServerError, \
-ChannelRetrieveEventsError
+ChannelRetrieveEventsError, TransportError
+
+# the syndication module's update periods in seconds
+UPDATE_PERIODS = {
+    'hourly': 60 * 60,
+    'daily': 24 * 60 * 60,
+    'weekly': 7 * 24 * 60 * 60,
+    'monthly': 30 * 24 * 60 * 60,
+    'yearly': 365 * 24 * 60 * 60,
+}
+
 
 class Event(object):
     """ Wraps up the data of an event."""
 
-    def __init__(self, title, url, date, summary=None):
+    __slots__ = ('title', 'url', 'date', 'summary', 'guid', 'published')
+
+    def __init__(self, title, url, date, summary=None, guid=None,
+                 published=None, html=True):
         """ Initializes the class.
 
         Args:
@@ -25,42 +42,340 @@ class Event(object):
 
         Kwargs:
             summary (str): The summary title of the event.
+            guid (str): The unique id of the event in the feed.
+            published (int): The date of the event as a UTC timestamp.
+            html (bool): Whether the summary contains HTML to be removed.
         """
         self.title = title
         self.url = url
         self.date = date
-        self.summary = remove_html(summary) if summary else ""
+        if not summary:
+            self.summary = ""
+        elif html:
+            self.summary = remove_html(summary)
+        else:
+            self.summary = summary
+        self.guid = guid
+        self.published = published
 
     def __repr__(self):
         return "%s, %s" % (self.title, self.url)
 
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class EventBatch(object):
+    """ Stores many events in columns instead of one object per event.
+
+    The texts of the events are kept in a few large unicode chunks addressed
+    by an array of offsets, the channels and the dates are interned and the
+    publication dates are kept in an array, so that large numbers of events
+    can be held, filtered and sorted without creating an :class:`Event` per
+    event.
+    """
+
+    # the texts of every event, in order
+    TEXTS = ('title', 'url', 'summary', 'guid')
+
+    # the texts are added to the last chunk until it reaches this length, so
+    # that a chunk is copied a bounded number of times
+    CHUNK = 8 * 1024
+
+    # stands for the events without a publication date
+    NO_DATE = -2 ** 63
+
+    def __init__(self, events=(), channel=None):
+        """ Initializes the class.
+
+        Kwargs:
+            events (list): The :class:`Event` objects to add.
+            channel (str): The code of the channel of the events.
+        """
+        self._chunks = []
+        # the offsets of the first texts of the chunks
+        self._starts = array('l')
+        self._pending = []
+        self._length = 0
+        self._offsets = array('l', [0])
+        self._channels = array('l')
+        self._dates = array('l')
+        self._published = array('l')
+        # the channels and the dates are interned apart
+        self._channel_values = []
+        self._channel_indexes = {}
+        self._date_values = []
+        self._date_indexes = {}
+        self.extend(events, channel)
+
+    def __len__(self):
+        return len(self._published)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        event = Event.__new__(Event)
+        for name in self.TEXTS:
+            setattr(event, name, self.get(i, name))
+        event.guid = event.guid or None
+        event.date = self._date_values[self._dates[i]]
+        event.published = self.get(i, 'published')
+
+        return event
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __getstate__(self):
+        self._flush()
+        state = dict(self.__dict__)
+        del state['_channel_indexes']
+        del state['_date_indexes']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._channel_indexes = dict(
+            (value, i) for i, value in enumerate(self._channel_values))
+        self._date_indexes = dict(
+            (value, i) for i, value in enumerate(self._date_values))
+
+    @staticmethod
+    def _intern(value, values, indexes):
+        if value not in indexes:
+            indexes[value] = len(values)
+            values.append(value)
+
+        return indexes[value]
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        text = u''.join(self._pending)
+        self._pending = []
+        if self._chunks and len(self._chunks[-1]) < self.CHUNK:
+            self._chunks[-1] += text
+        else:
+            self._starts.append(self._offsets[-1] - len(text))
+            self._chunks.append(text)
+
+    def append(self, event, channel=None):
+        """ Adds an event.
+
+        Args:
+            event (:class:`Event`): The event to add.
+
+        Kwargs:
+            channel (str): The code of the channel of the event.
+        """
+        for name in self.TEXTS:
+            text = to_unicode(getattr(event, name))
+            self._pending.append(text)
+            self._length += len(text)
+            self._offsets.append(self._length)
+
+        self._channels.append(self._intern(channel, self._channel_values,
+                                           self._channel_indexes))
+        self._dates.append(self._intern(event.date, self._date_values,
+                                        self._date_indexes))
+        self._published.append(self.NO_DATE if event.published is None
+                               else event.published)
+
+    def extend(self, events, channel=None):
+        """ Adds many events of the same channel."""
+        for event in events:
+            self.append(event, channel)
+
+    def get(self, i, name):
+        """ Returns a field of an event without creating an :class:`Event`.
+
+        Args:
+            i (int): The position of the event.
+            name (str): The name of the field, one of :attr:`TEXTS`, 'date',
+            'published' or 'channel'.
+        """
+        if name == 'published':
+            published = self._published[i]
+            return None if published == self.NO_DATE else published
+        elif name == 'channel':
+            return self._channel_values[self._channels[i]]
+        elif name == 'date':
+            return self._date_values[self._dates[i]]
+
+        self._flush()
+        position = i * len(self.TEXTS) + self.TEXTS.index(name)
+        start = self._offsets[position]
+        # the texts of an event are never split between chunks
+        chunk = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        base = self._starts[chunk]
+        return self._chunks[chunk][start - base:
+                                   self._offsets[position + 1] - base]
+
+    def filter(self, channel=None, since=None, until=None, indexes=None):
+        """ Returns the positions of the events matching the given criteria.
+
+        Kwargs:
+            channel (str): The code of the channel of the events.
+            since (int): The events published at or after this timestamp.
+            until (int): The events published before this timestamp.
+            indexes (list): The positions to filter, all of them if None.
+
+        Returns:
+            array. The positions of the matching events.
+        """
+        if channel is not None and channel not in self._channel_indexes:
+            return array('l')
+
+        channel = self._channel_indexes.get(channel)
+        result = array('l')
+        for i in (xrange(len(self)) if indexes is None else indexes):
+            published = self._published[i]
+            if channel is not None and self._channels[i] != channel:
+                continue
+            if since is not None and (published == self.NO_DATE or
+                                      published < since):
+                continue
+            if until is not None and (published == self.NO_DATE or
+                                      published >= until):
+                continue
+            result.append(i)
+
+        return result
+
+    def sort(self, name='published', reverse=True, indexes=None):
+        """ Returns the positions of the events sorted by a field.
+
+        Kwargs:
+            name (str): The field to sort by, see :meth:`get`.
+            reverse (bool): From the largest to the smallest value.
+            indexes (list): The positions to sort, all of them if None.
+
+        Returns:
+            array. The sorted positions.
+        """
+        if name == 'published':
+            key = self._published.__getitem__
+        else:
+            key = lambda i: self.get(i, name)
+
+        return array('l', sorted(xrange(len(self)) if indexes is None
+                                 else indexes, key=key, reverse=reverse))
+
+
 class Channel(object):
     """ Implements the Channel functionality."""
 
 
-    def __init__(self, name, url):
+    def __init__(self, name, url, code=None, cache=None, transport=None,
+                 parser=None):
         """ Initializes the class.
 
         Args:
             name (str): The name of the channel.
             url (str): The URL of the channel.
+
+        Kwargs:
+            code (str): The code of the channel in the user's list.
+            cache (:class:`cache.ValidatorCache`): The cache of the HTTP
+            validators.
+            transport (:class:`transport.HTTPTransport`): The transport of
+            the requests, the shared one if None.
+            parser (function): Parses the downloaded feeds, see
+            :func:`parse_feed` which is used if None.
         """
         self.name = name
         self.url = url
+        self.code = code
+        self.cache = cache
+        if transport is None:
+            # httplib and ssl are slow to load
+            from clnews.transport import default_transport
+            transport = default_transport()
+        self.transport = transport
+        self.parser = parser or parse_feed
         self.events = []
+        self.error = None
+        self.etag = None
+        self.modified = None
+        # the number of events which were not retrieved before
+        self.new_count = 0
+        # the refresh period advertised by the feed in seconds
+        self.hint = None
 
-    def _get_data(self):
+    def _download(self):
+        """ Downloads the feed.
 
-        response = feedparser.parse(self.url)
+        Returns:
+            :class:`transport.Response`. The response or None if the feed has
+            not been modified since the last retrieval.
+        """
+        validators = self.cache.get(self.url) if self.cache is not None \
+                     else None
+
+        headers = {}
+        if validators:
+            etag, modified = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if modified:
+                headers['If-Modified-Since'] = modified
 
-        if response.status == 200:
+        # the first retrieval after the validation of the URL reuses its
+        # response
+        response = None if validators else pop_validated_response(self.url)
+        if response is None:
+            try:
+                with STATS.timer('download', channel=self.code or self.url):
+                    response = self.transport.request(self.url, headers)
+            except TransportError:
+                raise ChannelServerError
+
+        if response.status == 304 and validators:
+            STATS.incr('not_modified', channel=self.code or self.url)
+            return None
+        elif response.status == 200:
             pass
         elif response.status == 404:
             raise ChannelDataNotFound
         else:
             raise ChannelServerError
 
-        return response.entries
+        self.etag = response.headers.get('etag')
+        self.modified = response.headers.get('last-modified')
+        STATS.incr('bytes', len(response.body), channel=self.code or self.url)
+
+        return response
+
+    def _get_data(self):
+        """ Retrieves the entries of the feed.
+
+        Returns:
+            list. The entries of the feed or None if the feed has not been
+            modified since the last retrieval.
+        """
+        response = self._download()
+        if response is None:
+            return None
+
+        # imported on the first retrieval as it is slow to load
+        import feedparser
+
+        # the downloaded feed is handed over to the parser
+        with STATS.timer('parse', channel=self.code or self.url):
+            parsed = feedparser.parse(response.body,
+                                      response_headers=response.headers)
+        self.hint = refresh_hint(parsed.feed)
+
+        return parsed.entries
 
     def get_events(self):
         """ Retrieves the current events.
@@ -69,15 +384,175 @@ class Channel(object):
             ChannelRetrieveEventsError: An error occured while retrieving the
             events.
         """
-        event_entries = self._get_data()
+        with STATS.timer('retrieve', channel=self.code or self.url):
+            return self._get_events()
+
+    def _get_events(self):
+        response = self._download()
+
+        if response is None:
+            # not modified, the events of the last retrieval are reused
+            self.new_count = 0
+            self.events = self.cache.get_events(self.url)
+            return self.events
+
+        with STATS.timer('parse', channel=self.code or self.url):
+            self.events, self.hint = self.parser(response.body,
+                                                 response.headers)
+
+        if self.cache is not None:
+            self.new_count = self.cache.set(self.url, self.etag,
+                                            self.modified, self.events)
+        else:
+            self.new_count = len(self.events)
+
+        return self.events
+
+    def iter_events(self, since=None, last_guid=None):
+        """ Retrieves the current events incrementally.
+
+        The feed is parsed while it is being downloaded and the events are
+        yielded as soon as they are parsed, which keeps the memory bounded on
+        very large feeds. The retrieval stops at the first event which is not
+        newer than the given ones.
+
+        Kwargs:
+            since (int): Stop at the events published at or before this
+            timestamp.
+            last_guid (str): Stop at the event with this guid or URL.
+
+        Yields:
+            :class:`Event`. The events of the feed.
+
+        Raises:
+            ChannelDataNotFound: The feed was not found.
+            ChannelServerError: The feed could not be downloaded.
+            ChannelRetrieveEventsError: The feed could not be parsed.
+        """
+        from clnews.stream import iter_events
 
         try:
-            self.events = [Event(e.title, e.link, e.published, e.summary)
-                           for e
-                           in event_entries]
-        except TypeError:
-            # when the event list is not a list as it should
+            response = self.transport.open(self.url)
+        except TransportError:
+            raise ChannelServerError
+
+        try:
+            if response.status == 404:
+                raise ChannelDataNotFound
+            elif response.status != 200:
+                raise ChannelServerError
+
+            for event in iter_events(response, since, last_guid):
+                yield event
+        except SyntaxError:
+            # not well-formed XML
             raise ChannelRetrieveEventsError
+        except TransportError:
+            raise ChannelServerError
+        finally:
+            response.close()
 
-        return self.events
+
+def high_water_mark(events):
+    """ Returns the (guid, published) of the newest of the given events.
+
+    The events are given in the order of their feed, the newest first.
+    """
+    newest = events[0]
+    published = max(event.published for event in events)
+
+    return newest.guid or newest.url, published
+
+
+def new_events(store, channel, fresh=False):
+    """ Returns the events of a channel which were not shown to the user yet
+    and advances its high-water mark past them.
+
+    The stored events are used while the daemon keeps them up to date,
+    otherwise the parsing of the feed stops at the first seen event.
+
+    Args:
+        store (:class:`store.Store`): The store of the marks.
+        channel (:class:`Channel`): The channel.
+
+    Kwargs:
+        fresh (bool): Retrieve the channel even if the stored events are up to
+        date.
+
+    Returns:
+        list. The new :class:`Event` objects, the newest first.
+    """
+    guid, published = store.get_seen(channel.code)
+    if not fresh and published is not None and store.is_fresh(channel.url):
+        events = store.get_events(channel.url, latest=False, since=published)
+    else:
+        events = list(channel.iter_events(published, guid))
+
+    if events:
+        store.set_seen(channel.code, *high_water_mark(events))
+
+    return events
+
+
+def parse_feed(body, headers=None):
+    """ Parses a downloaded feed into events.
+
+    Args:
+        body (str): The feed.
+
+    Kwargs:
+        headers (dict): The headers of the response of the feed.
+
+    Returns:
+        tuple. The :class:`Event` objects and the refresh period advertised
+        by the feed, see :func:`refresh_hint`.
+
+    Raises:
+        ChannelRetrieveEventsError: The feed could not be parsed.
+    """
+    # imported on the first retrieval as it is slow to load
+    import feedparser
+
+    parsed = feedparser.parse(body, response_headers=headers or {})
+    try:
+        summaries = remove_html_bulk([e.get('summary')
+                                      for e in parsed.entries])
+        events = [Event(e.title, e.link, e.published, summary,
+                        e.get('id'), timestamp(e), html=False)
+                  for e, summary in zip(parsed.entries, summaries)]
+    except TypeError:
+        # when the event list is not a list as it should
+        raise ChannelRetrieveEventsError
+
+    return events, refresh_hint(parsed.feed)
+
+
+def timestamp(entry):
+    """ Returns the publication date of a feed entry as a UTC timestamp."""
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+
+    return calendar.timegm(parsed) if parsed else None
+
+
+def refresh_hint(feed):
+    """ Returns the refresh period advertised by a feed in seconds.
+
+    The RSS ttl element takes precedence over the syndication module's
+    updatePeriod and updateFrequency elements.
+
+    Returns:
+        int. The period in seconds or None if the feed advertises none.
+    """
+    try:
+        if feed.get('ttl'):
+            return int(feed['ttl']) * 60
+
+        period = UPDATE_PERIODS.get(feed.get('sy_updateperiod'))
+        if period:
+            frequency = int(feed.get('sy_updatefrequency') or 1)
+            return period / max(frequency, 1)
+    except (TypeError, ValueError):
+        pass
+
+    return None
 
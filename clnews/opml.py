@@ -0,0 +1,89 @@
+"""
+.. module:: opml
+   :platform: Unix
+      :synopsis: This module contains the import and export of the channels
+      in OPML files.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import re
+from xml.etree import cElementTree as ElementTree
+
+CODE_LENGTH = 10
+
+NON_CODE = re.compile(r'[^a-z0-9]+')
+
+
+def make_code(name, taken):
+    """ Derives a channel code from the name of a channel.
+
+    Args:
+        name (str): The name of the channel.
+        taken (set): The codes already in use, the new code is added in it.
+
+    Returns:
+        str. A code which is not in taken.
+    """
+    base = NON_CODE.sub('', name.lower())[:CODE_LENGTH] or 'channel'
+    code = base
+    suffix = 1
+    while code in taken:
+        suffix += 1
+        code = '%s%d' % (base, suffix)
+    taken.add(code)
+
+    return code
+
+
+def read_opml(filename):
+    """ Reads the channels of an OPML file.
+
+    The outlines may be nested in folders, the ones without an xmlUrl are
+    skipped.
+
+    Args:
+        filename (str): The path of the file.
+
+    Returns:
+        list. (code, name, url) tuples in the order of the file. The code is
+        None unless it was exported by clnews.
+
+    Raises:
+        IOError: The file could not be read.
+        SyntaxError: The file is not well-formed XML.
+    """
+    channels = []
+    for outline in ElementTree.parse(filename).iter('outline'):
+        url = outline.get('xmlUrl')
+        if not url:
+            continue
+        name = outline.get('text') or outline.get('title') or url
+        channels.append((outline.get('code'), name.encode('utf-8'),
+                         url.encode('utf-8')))
+
+    return channels
+
+
+def write_opml(filename, channels):
+    """ Writes the given channels in an OPML file.
+
+    Args:
+        filename (str): The path of the file.
+        channels (dict): The channels keyed on their codes, as in the data of
+        the commands.
+
+    Raises:
+        IOError: The file could not be written.
+    """
+    root = ElementTree.Element('opml', version='2.0')
+    ElementTree.SubElement(ElementTree.SubElement(root, 'head'),
+                           'title').text = 'clnews channels'
+    body = ElementTree.SubElement(root, 'body')
+    for code in sorted(channels):
+        name = channels[code]['name'].decode('utf-8')
+        ElementTree.SubElement(body, 'outline', type='rss', code=code,
+                               text=name, title=name,
+                               xmlUrl=channels[code]['url'].decode('utf-8'))
+
+    ElementTree.ElementTree(root).write(filename, encoding='utf-8')
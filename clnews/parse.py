@@ -0,0 +1,118 @@
+"""
+.. module:: parse
+   :platform: Unix
+      :synopsis: This module contains the parsing of the feeds in worker
+      processes.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import signal
+import threading
+import multiprocessing
+
+from clnews import config
+from clnews.news import EventBatch, parse_feed
+from clnews.exceptions import ChannelRetrieveEventsError
+
+
+def init_worker():
+    """ Leaves the interrupts of the terminal to the parent process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def parse_batch(body, headers):
+    """ Parses a feed into an :class:`news.EventBatch`, which is much smaller
+    to send between the processes than the events.
+
+    See :func:`news.parse_feed`.
+    """
+    events, hint = parse_feed(body, headers)
+
+    return EventBatch(events), hint
+
+
+class ParsePool(object):
+    """ Parses the downloaded feeds in a pool of processes.
+
+    The parsing of the feeds is CPU bound and runs in pure Python, so the
+    threads retrieving the channels hand the downloaded feeds over to the
+    pool instead of parsing them one at a time under the GIL. A pool is used
+    as the parser of the channels, see :class:`news.Channel`.
+    """
+
+    def __init__(self, workers=None):
+        """ Initializes the class.
+
+        Kwargs:
+            workers (int): The number of processes, config.PARSE_WORKERS or
+            the number of the CPUs if None.
+        """
+        self.workers = workers or config.PARSE_WORKERS or \
+                       multiprocessing.cpu_count()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Starts the processes unless they are running.
+
+        The processes are started by the first feed being parsed, unless the
+        long running processes start them before their threads, see
+        :func:`default_pool`.
+        """
+        with self._lock:
+            if self._pool is None:
+                # loaded once instead of in every process
+                import feedparser
+
+                self._pool = multiprocessing.Pool(self.workers,
+                                                  initializer=init_worker)
+
+    def close(self):
+        """ Stops the processes."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+    def __call__(self, body, headers=None):
+        """ Parses a feed in one of the processes, see
+        :func:`news.parse_feed`.
+
+        Raises:
+            ChannelRetrieveEventsError: The feed could not be parsed in
+            config.PARSE_TIMEOUT seconds.
+        """
+        self.start()
+        try:
+            batch, hint = self._pool.apply_async(
+                parse_batch, (body, headers)).get(config.PARSE_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            raise ChannelRetrieveEventsError
+
+        return list(batch), hint
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    """ Returns the pool shared by the retrievals of many channels, or None
+    if config.PARSE_WORKERS is 1 and the feeds are parsed by the retrieving
+    threads themselves.
+
+    The long running processes, which retrieve the channels from other
+    threads, start the pool before their threads.
+    """
+    global _default_pool
+
+    if config.PARSE_WORKERS == 1:
+        return None
+
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = ParsePool()
+
+        return _default_pool
@@ -0,0 +1,183 @@
+"""
+.. module:: registry
+   :platform: Unix
+      :synopsis: This module contains the indexed list of the channels.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import bisect
+import urlparse
+import itertools
+
+# the ports which are left out of the URLs of the feeds
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def feed_url(url):
+    """ Normalizes the URL of a feed so that the equivalent URLs of a feed
+    compare equal.
+
+    The scheme and the host are lowercased and the default port, the trailing
+    slash and the fragment are removed. Unlike the URLs of the events, see
+    :func:`dedup.normalize_url`, the query is kept as it is, since it may
+    select the feed, and the scheme is kept.
+    """
+    parts = urlparse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    host, _, port = netloc.rpartition(':')
+    if host and port == DEFAULT_PORTS.get(scheme):
+        netloc = host
+
+    return urlparse.urlunsplit((scheme, netloc, parts.path.rstrip('/'),
+                                parts.query, ''))
+
+
+def _name(channel):
+    return (channel.get('name') or '').lower()
+
+
+def _starting(pairs, prefix):
+    """ Returns the codes of the sorted (key, code) pairs whose key starts
+    with the lowercased prefix.
+    """
+    prefix = prefix.lower()
+    codes = []
+    for key, code in itertools.islice(pairs,
+                                      bisect.bisect_left(pairs, (prefix,)),
+                                      None):
+        if not key.startswith(prefix):
+            break
+        codes.append(code)
+
+    return codes
+
+
+class ChannelRegistry(dict):
+    """ The channels of the list, {code: {'name': name, 'url': url}}.
+
+    Besides the mapping of the codes it keeps an index of the normalized URLs
+    and sorted lists of the lowercased codes and names, all updated along with
+    the mapping, so that a URL is looked up in constant time and the codes or
+    names starting with a prefix by a binary search.
+
+    The channels should be replaced rather than modified in place, as the
+    indexes do not follow the changes of their URLs and names.
+    """
+
+    def __init__(self, channels=None):
+        """ Initializes the class.
+
+        Kwargs:
+            channels (dict): The initial channels.
+        """
+        dict.__init__(self)
+        # normalized URL -> set of codes
+        self._urls = {}
+        # sorted (lowercased code, code) pairs
+        self._codes = []
+        # sorted (lowercased name, code) pairs
+        self._names = []
+        if channels:
+            self.update(channels)
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def _index(self, code, channel):
+        self._urls.setdefault(feed_url(channel['url']), set()).add(code)
+        bisect.insort(self._codes, (code.lower(), code))
+        bisect.insort(self._names, (_name(channel), code))
+
+    def _unindex(self, code):
+        url = feed_url(self[code]['url'])
+        self._urls[url].discard(code)
+        if not self._urls[url]:
+            del self._urls[url]
+        del self._codes[bisect.bisect_left(self._codes, (code.lower(), code))]
+        del self._names[bisect.bisect_left(self._names,
+                                           (_name(self[code]), code))]
+
+    def __setitem__(self, code, channel):
+        if code in self:
+            self._unindex(code)
+        dict.__setitem__(self, code, channel)
+        self._index(code, channel)
+
+    def __delitem__(self, code):
+        if code not in self:
+            raise KeyError(code)
+        self._unindex(code)
+        dict.__delitem__(self, code)
+
+    def update(self, *args, **kwargs):
+        for code, channel in dict(*args, **kwargs).iteritems():
+            self[code] = channel
+
+    def setdefault(self, code, channel=None):
+        if code not in self:
+            self[code] = channel
+
+        return self[code]
+
+    def pop(self, code, *default):
+        if code not in self:
+            if default:
+                return default[0]
+            raise KeyError(code)
+
+        channel = self[code]
+        del self[code]
+        return channel
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): the registry is empty')
+
+        code = self._codes[0][1]
+        return code, self.pop(code)
+
+    def clear(self):
+        dict.clear(self)
+        self._urls.clear()
+        del self._codes[:]
+        del self._names[:]
+
+    def copy(self):
+        return self.__class__(self)
+
+    def find_url(self, url):
+        """ Returns the code of a channel with the given URL or None.
+
+        The URLs are compared normalized, see :func:`feed_url`.
+        """
+        codes = self._urls.get(feed_url(url))
+        return min(codes) if codes else None
+
+    def complete(self, prefix):
+        """ Returns the codes starting with the given prefix, ignoring the
+        case, in alphabetical order.
+        """
+        return _starting(self._codes, prefix)
+
+    def complete_name(self, prefix):
+        """ Returns the codes of the channels whose name starts with the
+        given prefix, ignoring the case, in the alphabetical order of the
+        names.
+        """
+        return _starting(self._names, prefix)
+
+    def lookup(self, code):
+        """ Returns the code of the list matching the given one or None.
+
+        The code matches itself or, ignoring the case, a single code of the
+        list.
+        """
+        if code in self:
+            return code
+
+        lower = code.lower()
+        matches = [match for match in self.complete(lower)
+                   if match.lower() == lower]
+        return matches[0] if len(matches) == 1 else None
@@ -0,0 +1,299 @@
+"""
+.. module:: search
+   :platform: Unix
+      :synopsis: This module contains the full text search of the events.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import re
+import math
+import time
+import calendar
+
+from clnews.utils import to_unicode
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+QUERY_TOKEN = re.compile(r'"([^"]*)"|(\w+):(\S+)|(\S+)', re.UNICODE)
+
+DAY = 24 * 60 * 60
+
+# the terms too common to be worth indexing
+STOPWORDS = frozenset(u'''
+a about after all also an and any are as at be been but by can could did do
+does for from had has have he her his how i if in into is it its just more
+most my no not of on or our out over she so than that the their them then
+there these they this to up was we were what when which who will with would
+you your
+'''.split())
+
+# the number of the events of the rarest term of the phrases of a query
+# which are matched against the phrases at a time
+PHRASE_CANDIDATES = 10000
+
+# the size of the batches of the ids given to a query
+BATCH = 500
+
+
+def tokenize(text):
+    """ Splits a text in lowercase unicode terms."""
+    return TOKEN.findall(to_unicode(text).lower())
+
+
+def index_terms(tokens):
+    """ Returns the (position, term) of the tokens which are not stopwords,
+    the positions of the rest being skipped.
+    """
+    return [(position, token) for position, token in enumerate(tokens)
+            if token not in STOPWORDS]
+
+
+def parse_date(value):
+    """ Converts a YYYY-MM-DD date to a UTC timestamp.
+
+    Raises:
+        ValueError: The date is not valid.
+    """
+    return calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+
+
+def parse_query(query):
+    """ Parses a search query.
+
+    The query consists of terms, "quoted phrases" and the filters
+    channel:<code>, since:<YYYY-MM-DD> and until:<YYYY-MM-DD>.
+
+    Returns:
+        tuple. (terms, phrases, filters) where phrases is a list of lists of
+        terms and filters is a dict.
+
+    Raises:
+        ValueError: A filter is not valid.
+    """
+    terms = []
+    phrases = []
+    filters = {}
+    for phrase, key, value, words in QUERY_TOKEN.findall(query):
+        if phrase:
+            tokens = tokenize(phrase)
+            if len(tokens) > 1:
+                phrases.append(tokens)
+            else:
+                terms += tokens
+        elif key == 'channel':
+            filters['channel'] = value
+        elif key == 'since':
+            filters['since'] = parse_date(value)
+        elif key == 'until':
+            filters['until'] = parse_date(value) + DAY
+        else:
+            terms += tokenize(words or '%s %s' % (key, value))
+
+    return terms, phrases, filters
+
+
+def index_event(conn, event_id, title, summary):
+    """ Adds an event in the inverted index.
+
+    The previous postings of the event, if any, are replaced.
+
+    Args:
+        conn (:class:`sqlite3.Connection`): The connection of the store.
+        event_id (int): The id of the event.
+        title (str): The title of the event.
+        summary (str): The summary of the event.
+    """
+    unindex_event(conn, event_id)
+
+    positions = {}
+    tokens = index_terms(tokenize(title) + tokenize(summary))
+    for position, token in tokens:
+        positions.setdefault(token, []).append(str(position))
+
+    # the length of the event is kept along with its postings so that they
+    # are scored without reading the events
+    conn.executemany('INSERT INTO postings (term, event, positions, '
+                     'frequency, length) VALUES (?, ?, ?, ?, ?)',
+                     [(term, event_id, ' '.join(value), len(value),
+                       len(tokens))
+                      for term, value in positions.iteritems()])
+    conn.execute('UPDATE events SET length = ? WHERE id = ?',
+                 (len(tokens), event_id))
+    conn.execute('UPDATE search_stats SET docs = docs + 1, '
+                 'length = length + ?', (len(tokens),))
+
+
+def unindex_event(conn, event_id):
+    """ Removes an event from the inverted index."""
+    length = conn.execute('SELECT length FROM events WHERE id = ?',
+                          (event_id,)).fetchone()
+    if not length or length[0] is None:
+        return
+
+    conn.execute('DELETE FROM postings WHERE event = ?', (event_id,))
+    conn.execute('UPDATE events SET length = NULL WHERE id = ?', (event_id,))
+    conn.execute('UPDATE search_stats SET docs = docs - 1, '
+                 'length = length - ?', (length[0],))
+
+
+def _has_phrase(positions, phrase):
+    """ Returns True if the terms of a phrase appear at their offsets.
+
+    Args:
+        positions (dict): The positions of the terms in an event.
+        phrase (list): The (offset, term) of the terms of the phrase.
+    """
+    (first, term), rest = phrase[0], phrase[1:]
+    return any(all(start - first + offset in positions[other]
+                   for offset, other in rest)
+               for start in positions[term])
+
+
+def _filters(filters):
+    where = ''
+    params = []
+    if 'channel' in filters:
+        where += ' AND e.channel = ?'
+        params.append(filters['channel'])
+    if 'since' in filters:
+        where += ' AND e.published >= ?'
+        params.append(filters['since'])
+    if 'until' in filters:
+        where += ' AND e.published < ?'
+        params.append(filters['until'])
+
+    return where, params
+
+
+def _narrow(conn, candidates, term):
+    """ Keeps the candidates containing the term, adding its positions."""
+    ids = list(candidates)
+    found = {}
+    for i in xrange(0, len(ids), BATCH):
+        batch = ids[i:i + BATCH]
+        found.update(conn.execute(
+            'SELECT event, positions FROM postings WHERE term = ? '
+            'AND event IN (%s)' % ', '.join('?' * len(batch)),
+            [term] + batch).fetchall())
+
+    narrowed = {}
+    for event_id, positions in found.iteritems():
+        narrowed[event_id] = candidates[event_id]
+        narrowed[event_id][term] = positions
+
+    return narrowed
+
+
+def _match_phrases(conn, phrases, frequencies, filters):
+    """ Returns the ids of the events containing every phrase.
+
+    The postings of the rarest term are read a page of PHRASE_CANDIDATES
+    events at a time, the most recent first, and every other term only
+    narrows the page down before the positions are compared.
+    """
+    terms = sorted(set(term for phrase in phrases for _, term in phrase),
+                   key=frequencies.get)
+    where, params = _filters(filters)
+    matches = []
+    last = None
+    while True:
+        rows = conn.execute(
+            'SELECT p.event, p.positions FROM postings p '
+            'JOIN events e ON e.id = p.event WHERE p.term = ?' + where +
+            ('' if last is None else ' AND p.event < ?') +
+            ' ORDER BY p.event DESC LIMIT ?',
+            [terms[0]] + params + ([] if last is None else [last]) +
+            [PHRASE_CANDIDATES]).fetchall()
+        if not rows:
+            return matches
+        last = rows[-1][0]
+
+        candidates = dict((event_id, {terms[0]: positions})
+                          for event_id, positions in rows)
+        for term in terms[1:]:
+            if not candidates:
+                break
+            candidates = _narrow(conn, candidates, term)
+
+        for event_id, postings in candidates.iteritems():
+            positions = dict((term, set(int(p) for p in value.split()))
+                             for term, value in postings.iteritems())
+            if all(_has_phrase(positions, phrase) for phrase in phrases):
+                matches.append(event_id)
+
+
+def search(conn, query, limit=20):
+    """ Searches the indexed events ranking them with BM25.
+
+    The events have to contain every phrase of the query and at least one of
+    its terms. The stopwords of the query are skipped, like when indexing,
+    and the events are scored and ranked by SQLite.
+
+    Args:
+        conn (:class:`sqlite3.Connection`): The connection of the store.
+        query (str): The search query, see :func:`parse_query`.
+
+    Kwargs:
+        limit (int): The maximum number of results.
+
+    Returns:
+        list. (score, event_id) tuples, the best first.
+    """
+    terms, phrases, filters = parse_query(query)
+    phrases = [phrase for phrase in (index_terms(phrase) for phrase in phrases)
+               if phrase]
+    all_terms = set(term for term in terms if term not in STOPWORDS)
+    for phrase in phrases:
+        all_terms.update(term for _, term in phrase)
+    if not all_terms:
+        return []
+
+    docs, length = conn.execute('SELECT docs, length FROM search_stats')\
+                       .fetchone()
+    average = float(length) / docs if docs and length else 1.0
+
+    frequencies = {}
+    weights = []
+    for term in all_terms:
+        frequency = conn.execute('SELECT COUNT(*) FROM postings '
+                                 'WHERE term = ?', (term,)).fetchone()[0]
+        frequencies[term] = frequency
+        weights += [term, math.log(1 + (docs - frequency + 0.5) /
+                                   (frequency + 0.5))]
+
+    score = ('SUM((CASE p.term %s END) * p.frequency * %f / '
+             '(p.frequency + %f * (%f + %f * p.length / %f)))' %
+             (' '.join(['WHEN ? THEN ?'] * len(all_terms)), K1 + 1, K1, 1 - B,
+              B, average))
+    # the events are read only to be filtered
+    join = ' JOIN events e ON e.id = p.event' if filters else ''
+    where, params = _filters(filters)
+
+    def rank(where, params):
+        rows = conn.execute('SELECT %s AS score, p.event FROM postings p%s '
+                            'WHERE p.term IN (%s)%s GROUP BY p.event '
+                            'ORDER BY score DESC, p.event DESC LIMIT ?' %
+                            (score, join, ', '.join('?' * len(all_terms)),
+                             where),
+                            weights + list(all_terms) + params + [limit])
+        return [tuple(row) for row in rows]
+
+    if not phrases:
+        return rank(where, params)
+
+    # the matches are ranked a batch at a time, rather than written in a
+    # table, so that the search never writes to the store
+    matches = _match_phrases(conn, phrases, frequencies, filters)
+    results = []
+    for i in xrange(0, len(matches), BATCH):
+        batch = matches[i:i + BATCH]
+        results += rank(where + ' AND p.event IN (%s)' %
+                        ', '.join('?' * len(batch)), params + batch)
+
+    results.sort(key=lambda result: (-result[0], -result[1]))
+    return results[:limit]
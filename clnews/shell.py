@@ -7,31 +7,104 @@
 
       """
 import sys
-import readline
-
-from colorama import init as colorama_init
+import time
+import argparse
+import __builtin__
 
 from clnews import config
-from clnews.commands import Command
+from clnews.stats import STATS
 from clnews.exceptions import CommandExecutionError, CommandIOError
 
 reload(sys)
 sys.setdefaultencoding("utf-8")
 
 
+class ImportProfiler(object):
+    """ Times the imports of the modules.
+
+    Every import of a module which is not loaded yet is timed, including the
+    imports it triggers itself.
+    """
+
+    def __init__(self):
+        """ Initializes the class."""
+        self.started = time.time()
+        self.imports = []
+        self._depth = 0
+        self._import = None
+
+    def start(self):
+        """ Starts timing the imports."""
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def stop(self):
+        """ Stops timing the imports."""
+        __builtin__.__import__ = self._import
+
+    def _timed_import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            return self._import(name, *args, **kwargs)
+
+        start = time.time()
+        self._depth += 1
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            self.imports.append((self._depth, name, time.time() - start))
+
+    def report(self, stream=None, limit=15):
+        """ Writes the slowest imports and the total time since the start.
+
+        Kwargs:
+            stream (file): The stream of the report, the stderr if None.
+            limit (int): The maximum number of imports reported.
+        """
+        stream = stream or sys.stderr
+        top = [(spent, name) for depth, name, spent in self.imports
+               if depth == 0]
+        stream.write('startup: %.1f ms, imports: %.1f ms\n' %
+                     ((time.time() - self.started) * 1000,
+                      sum(spent for spent, _ in top) * 1000))
+        for spent, name in sorted(top, reverse=True)[:limit]:
+            stream.write('%10.1f ms  %s\n' % (spent * 1000, name))
+
+
 class Shell(object):
     """ Implements the shell functionality."""
 
     def __init__(self):
-        """ Initializes the class."""
+        """ Initializes the class.
+
+        The commands are created on their first use.
+        """
+        import readline
+        from colorama import init as colorama_init
+        from clnews.commands import Command
+        from clnews.complete import Completer, DELIMITERS
 
         colorama_init()
+        self.history = []
+        self.commands = dict((klass.__dict__['name'], klass)
+                             for klass in Command.__subclasses__())
+        self._instances = {}
+        self.completer = Completer(self.commands, self._channels)
+        readline.set_completer(self.completer)
+        readline.set_completer_delims(DELIMITERS)
         readline.parse_and_bind('tab: complete')
         readline.parse_and_bind('set editing-mode vi')
-        self.history = []
-        self.commands = dict({(klass.__dict__['name'], klass())
-                              for klass in Command.__subclasses__()})
 
+    def _command(self, name):
+        if name not in self._instances:
+            self._instances[name] = self.commands[name]()
+
+        return self._instances[name]
+
+    def _channels(self):
+        # the channels are loaded along with the first command
+        command = self._command('.list')
+        return command.channels()
 
     def _prompt(self, text):
         sys.stdin.flush()
@@ -46,7 +119,7 @@ class Shell(object):
 
         tokens = user_input.split()
         try:
-            command = self.commands[tokens[0]]
+            command = self._command(tokens[0])
         except KeyError:
             raise CommandIOError('Command not found.\n')
 
@@ -69,8 +142,12 @@ class Shell(object):
                 continue
 
             try:
-                command.execute(*arguments)
-                command.print_output()
+                # the channels may have been changed by another process
+                command.reload()
+                with STATS.timer('execute', command=command.name):
+                    command.execute(*arguments)
+                with STATS.timer('render', command=command.name):
+                    command.print_output()
             except CommandExecutionError as error:
                 print "Command error:\t%s" % error.message
                 continue
@@ -79,7 +156,179 @@ class Shell(object):
                       + error.message
                 continue
 
-def main():
-    """ Entry point
+def _start_parse_pool():
+    """ Forks the processes parsing the feeds, before any thread is
+    started, see :func:`parse.default_pool`.
     """
+    from clnews.parse import default_pool
+
+    pool = default_pool()
+    if pool is not None:
+        pool.start()
+
+
+def run_shell(args):
+    """ Runs the interactive shell."""
+    config.PAGER = None if args.pager == 'none' else args.pager
     Shell()()
+
+
+def run_daemon(args):
+    """ Runs the polling daemon."""
+    import logging
+    from clnews.store import Store
+    from clnews.daemon import Daemon
+    from clnews.dedup import DedupIndex
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    _start_parse_pool()
+    daemon = Daemon(Store(config.STORE_PATH),
+                    dedup=DedupIndex(config.DEDUP_PATH))
+    if args.once:
+        daemon.poll()
+        return
+
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+def run_ui(args):
+    """ Runs the terminal user interface."""
+    from clnews.store import Store
+
+    try:
+        from clnews.ui import Browser
+    except ImportError:
+        sys.exit('The user interface requires urwid, pip install urwid.')
+
+    Browser(Store(config.STORE_PATH)).run()
+
+
+def run_serve(args):
+    """ Runs the HTTP API server."""
+    import threading
+    from clnews.api import APIServer
+    from clnews.batch import open_store
+    from clnews.daemon import Daemon
+    from clnews.dedup import DedupIndex
+
+    _start_parse_pool()
+    store = open_store()
+    daemon = Daemon(store, dedup=DedupIndex(config.DEDUP_PATH))
+    server = APIServer((args.host, args.port), store, daemon, args.verbose)
+    if args.poll:
+        thread = threading.Thread(target=daemon.run)
+        thread.daemon = True
+        thread.start()
+
+    print 'Serving on http://%s:%d/' % server.server_address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        daemon.stop()
+        server.server_close()
+
+
+def run_batch(args):
+    """ Runs a non-interactive command writing its output to the stdout."""
+    import errno
+    from clnews import batch
+
+    try:
+        getattr(batch, args.command)(args, sys.stdout)
+    except IOError as error:
+        # the reader of the output went away
+        if error.errno != errno.EPIPE:
+            raise
+
+
+def parse_args(argv):
+    """ Parses the command line arguments.
+
+    The interactive shell is run when no subcommand is given.
+    """
+    parser = argparse.ArgumentParser(prog='clnews',
+                                     description='Advanced news feed reader')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + config.VERSION)
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='reports the time spent in importing modules')
+    subparsers = parser.add_subparsers()
+
+    shell = subparsers.add_parser('shell', help='runs the interactive shell')
+    shell.add_argument('--pager', choices=['less', 'internal', 'none'],
+                       default=config.PAGER or 'none',
+                       help='pages the output with less, in process or not '
+                            'at all')
+    shell.set_defaults(func=run_shell)
+
+    ui = subparsers.add_parser('ui', help='runs the terminal user interface')
+    ui.set_defaults(func=run_ui)
+
+    formats = argparse.ArgumentParser(add_help=False)
+    formats.add_argument('--format', choices=['ndjson', 'csv'],
+                         default='ndjson', help='the format of the output')
+
+    list_ = subparsers.add_parser('list', parents=[formats],
+                                  help='prints the channels')
+    list_.set_defaults(func=run_batch, command='run_list')
+
+    get = subparsers.add_parser('get', parents=[formats],
+                                help='prints the news of channels')
+    get.add_argument('codes', nargs='*', metavar='code',
+                     help='the channels, all of them if none is given')
+    get.add_argument('--new', action='store_true',
+                     help='only the news which were not printed before')
+    get.set_defaults(func=run_batch, command='run_get')
+
+    search = subparsers.add_parser('search', parents=[formats],
+                                   help='prints the matching retrieved news')
+    search.add_argument('query', nargs='+',
+                        help='terms, "phrases" and channel:, since: or '
+                             'until: filters')
+    search.add_argument('--limit', type=int, default=config.SEARCH_LIMIT,
+                        help='the maximum number of results')
+    search.set_defaults(func=run_batch, command='run_search')
+
+    serve = subparsers.add_parser('serve', help='runs the HTTP API server')
+    serve.add_argument('--host', default=config.API_HOST,
+                       help='the address to listen to')
+    serve.add_argument('--port', type=int, default=config.API_PORT,
+                       help='the port to listen to')
+    serve.add_argument('--poll', action='store_true',
+                       help='keeps the channels up to date in the background')
+    serve.add_argument('--verbose', action='store_true',
+                       help='logs the requests')
+    serve.set_defaults(func=run_serve)
+
+    daemon = subparsers.add_parser('daemon',
+                                   help='polls the channels in the background')
+    daemon.add_argument('--once', action='store_true',
+                        help='retrieves the due channels once and exits')
+    daemon.set_defaults(func=run_daemon)
+
+    if not any(arg in subparsers.choices for arg in argv):
+        argv = list(argv) + ['shell']
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Entry point
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    profiler = None
+    if '--profile-startup' in argv:
+        profiler = ImportProfiler()
+        profiler.start()
+
+    args = parse_args(argv)
+    try:
+        args.func(args)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.report()
@@ -0,0 +1,203 @@
+"""
+.. module:: stats
+   :platform: Unix
+      :synopsis: This module contains the timings and the counters of the
+      operations of clnews.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+
+# the upper bounds of the buckets of the timings in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# the prefix of the names of the Prometheus metrics
+PREFIX = 'clnews_'
+
+
+def _labels(labels):
+    return tuple(sorted((key, value) for key, value in labels.iteritems()
+                        if value is not None))
+
+
+def _format_labels(labels, extra=()):
+    labels = labels + extra
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                                          .replace('"', '\\"'))
+                             for key, value in labels)
+
+
+class Histogram(object):
+    """ Counts the timings of an operation in buckets."""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """ Returns the upper bound of the bucket of the given quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+
+class Stats(object):
+    """ Keeps the timings and the counters of the operations.
+
+    The timings and the counters are named and optionally labelled, e.g. by
+    the code of a channel, and they are updated under a lock so that the
+    fetching threads can record them. Recording costs a dictionary lookup and
+    a few additions, so the hooks stay in the hot paths.
+    """
+
+    def __init__(self):
+        """ Initializes the class."""
+        self.timings = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        """ Records the duration of an operation.
+
+        Args:
+            name (str): The name of the operation.
+            seconds (float): Its duration.
+
+        Kwargs:
+            labels: The labels of the timing, the None ones are skipped.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            if key not in self.timings:
+                self.timings[key] = Histogram()
+            self.timings[key].observe(seconds)
+
+    def incr(self, name, value=1, **labels):
+        """ Increases a counter, see :meth:`observe`."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Times the enclosed block, see :meth:`observe`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def timed(self, name):
+        """ Decorator timing the calls of a function, see :meth:`observe`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def inner(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+
+            return inner
+
+        return decorator
+
+    def clear(self):
+        """ Forgets every timing and counter."""
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    def report(self, limit=None):
+        """ Returns the timings, the slowest first, and the counters as text.
+
+        Kwargs:
+            limit (int): The maximum number of timings listed.
+        """
+        with self._lock:
+            timings = sorted(self.timings.iteritems(),
+                             key=lambda item: item[1].total, reverse=True)
+            counters = sorted(self.counters.iteritems())
+
+        lines = ['%-36s %7s %9s %9s %9s' % ('timing', 'count', 'mean ms',
+                                             'p95 ms', 'max ms')]
+        for (name, labels), histogram in timings[:limit]:
+            lines.append('%-36s %7d %9.1f %9.1f %9.1f' % (
+                name + _format_labels(labels), histogram.count,
+                histogram.total / histogram.count * 1000,
+                histogram.quantile(0.95) * 1000, histogram.max * 1000))
+
+        if counters:
+            lines.append('')
+            lines.append('%-36s %7s' % ('counter', 'value'))
+            for (name, labels), value in counters:
+                lines.append('%-36s %7d' % (name + _format_labels(labels),
+                                            value))
+
+        return '\n'.join(lines) + '\n'
+
+    def prometheus(self):
+        """ Returns the timings and the counters in the text format of
+        Prometheus, the timings as histograms in seconds.
+        """
+        with self._lock:
+            timings = sorted((key, list(histogram.counts), histogram.count,
+                              histogram.total)
+                             for key, histogram in self.timings.iteritems())
+            counters = sorted(self.counters.iteritems())
+
+        lines = []
+        names = set()
+        for (name, labels), counts, count, total in timings:
+            metric = PREFIX + name + '_seconds'
+            if metric not in names:
+                names.add(metric)
+                lines.append('# TYPE %s histogram' % metric)
+            cumulative = 0
+            for bound, value in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += value
+                lines.append('%s_bucket%s %d' % (
+                    metric, _format_labels(labels, (('le', bound),)),
+                    cumulative))
+            lines.append('%s_sum%s %f' % (metric, _format_labels(labels),
+                                          total))
+            lines.append('%s_count%s %d' % (metric, _format_labels(labels),
+                                            count))
+
+        for (name, labels), value in counters:
+            metric = PREFIX + name + '_total'
+            if metric not in names:
+                names.add(metric)
+                lines.append('# TYPE %s counter' % metric)
+            lines.append('%s%s %d' % (metric, _format_labels(labels), value))
+
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+# the statistics of the process
+STATS = Stats()
+
+observe = STATS.observe
+incr = STATS.incr
+timer = STATS.timer
+timed = STATS.timed
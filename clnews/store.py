@@ -0,0 +1,606 @@
+"""
+.. module:: store
+   :platform: Unix
+      :synopsis: This module contains the SQLite storage of channels and events.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from clnews import config, search
+from clnews.news import Event
+from clnews.registry import ChannelRegistry
+from clnews.utils import DataFileMeta
+from clnews.exceptions import ShellLoadDataCorruptedFile, StoreConflictError
+
+
+# Every item is applied once, in order, on databases whose user_version is
+# lower than its position. New schema changes are appended at the end.
+MIGRATIONS = [
+    """
+    CREATE TABLE channels (
+        code TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        url TEXT NOT NULL UNIQUE,
+        etag TEXT,
+        modified TEXT,
+        fetched INTEGER,
+        generation INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE events (
+        id INTEGER PRIMARY KEY,
+        channel TEXT NOT NULL REFERENCES channels(code) ON DELETE CASCADE,
+        guid TEXT,
+        url TEXT NOT NULL,
+        title TEXT,
+        summary TEXT,
+        date TEXT,
+        published INTEGER,
+        generation INTEGER,
+        UNIQUE (channel, url)
+    );
+
+    CREATE INDEX events_url ON events(url);
+    CREATE INDEX events_channel_published ON events(channel, published);
+    CREATE INDEX events_published ON events(published);
+    """,
+    """
+    ALTER TABLE channels ADD COLUMN interval INTEGER;
+    ALTER TABLE channels ADD COLUMN next_fetch INTEGER;
+    ALTER TABLE channels ADD COLUMN failures INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE channels ADD COLUMN hint INTEGER;
+    """,
+    """
+    ALTER TABLE events ADD COLUMN length INTEGER;
+
+    CREATE TABLE postings (
+        term TEXT NOT NULL,
+        event INTEGER NOT NULL,
+        positions TEXT NOT NULL,
+        PRIMARY KEY (term, event)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX postings_event ON postings(event);
+
+    CREATE TABLE search_stats (
+        docs INTEGER NOT NULL,
+        length INTEGER NOT NULL
+    );
+
+    INSERT INTO search_stats VALUES (0, 0);
+
+    CREATE TRIGGER events_unindex BEFORE DELETE ON events
+    WHEN old.length IS NOT NULL
+    BEGIN
+        DELETE FROM postings WHERE event = old.id;
+        UPDATE search_stats SET docs = docs - 1, length = length - old.length;
+    END;
+    """,
+    """
+    ALTER TABLE channels ADD COLUMN seen_guid TEXT;
+    ALTER TABLE channels ADD COLUMN seen_published INTEGER;
+    """,
+    """
+    CREATE TABLE channels_version (version INTEGER NOT NULL);
+    INSERT INTO channels_version VALUES (0);
+
+    CREATE TRIGGER channels_inserted AFTER INSERT ON channels BEGIN
+        UPDATE channels_version SET version = version + 1;
+    END;
+    CREATE TRIGGER channels_updated AFTER UPDATE OF code, name, url
+    ON channels BEGIN
+        UPDATE channels_version SET version = version + 1;
+    END;
+    CREATE TRIGGER channels_deleted AFTER DELETE ON channels BEGIN
+        UPDATE channels_version SET version = version + 1;
+    END;
+    """,
+    """
+    ALTER TABLE postings ADD COLUMN frequency INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE postings ADD COLUMN length INTEGER NOT NULL DEFAULT 0;
+
+    -- the events are indexed again without the stopwords
+    DELETE FROM postings;
+    UPDATE events SET length = NULL;
+    UPDATE search_stats SET docs = 0, length = 0;
+    """,
+]
+
+
+class Store(object):
+    """ Stores the channels and their events in an SQLite database.
+
+    The database runs in WAL mode so that readers are not blocked by writers
+    and every change is written incrementally instead of rewriting all the
+    data. The changes go through a single connection, while the events are
+    read through a pool of read-only ones, so that many threads, e.g. of the
+    API, read them at the same time.
+    """
+    __metaclass__ = DataFileMeta
+
+    def __init__(self, filename):
+        """ Initializes the class.
+
+        Args:
+            filename (str): The path of the database.
+        """
+        if not filename or not isinstance(filename, str):
+            raise TypeError
+
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        # tells apart the revisions of different connections
+        self._opened = '%x' % int(time.time() * 1000)
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock:
+            version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+            for i, script in enumerate(MIGRATIONS[version:], version + 1):
+                self._conn.executescript(script)
+                self._conn.execute('PRAGMA user_version=%d' % i)
+            self._conn.commit()
+
+            if 0 < version < len(MIGRATIONS):
+                self.index_events()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = str
+        return conn
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    @contextmanager
+    def _reading(self):
+        """ Lends a read-only connection of the pool to the calling thread."""
+        with self._readers_lock:
+            conn = self._readers.pop() if self._readers else None
+        if conn is None:
+            conn = self._connect()
+            conn.execute('PRAGMA query_only=ON')
+
+        try:
+            yield conn
+        finally:
+            with self._readers_lock:
+                if len(self._readers) < config.STORE_READERS:
+                    self._readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def _read(self, query, params=()):
+        with self._reading() as conn:
+            return conn.execute(query, params).fetchall()
+
+    # channels
+
+    def load(self):
+        """ Returns the channels in the format of :attr:`Command.data`."""
+        rows = self._read('SELECT code, name, url FROM channels')
+        return {'channels': ChannelRegistry(
+            dict((row['code'], {'name': row['name'], 'url': row['url']})
+                 for row in rows))}
+
+    def channels_version(self):
+        """ Returns a number which changes whenever the channels are added,
+        removed or edited, by this or by another process.
+        """
+        return self._execute('SELECT version FROM channels_version')[0][0]
+
+    def add_channels(self, channels):
+        """ Adds or updates the given channels in a single transaction.
+
+        The channels whose URL belongs to another channel, e.g. one added
+        meanwhile by another process, are skipped.
+
+        Args:
+            channels (list): (code, name, url) tuples.
+
+        Returns:
+            list. The (code, name, url) tuples of the skipped channels.
+        """
+        conflicts = []
+        with self._lock:
+            with self._conn:
+                for code, name, url in channels:
+                    if self._conn.execute(
+                            'SELECT 1 FROM channels WHERE url = ? AND '
+                            'code != ?', (url, code)).fetchone():
+                        conflicts.append((code, name, url))
+                        continue
+                    self._conn.execute(
+                        'INSERT OR IGNORE INTO channels (code, name, url) '
+                        'VALUES (?, ?, ?)', (code, name, url))
+                    self._conn.execute(
+                        'UPDATE channels SET name = ?, url = ? '
+                        'WHERE code = ?', (name, url, code))
+
+        return conflicts
+
+    def add_channel(self, code, name, url):
+        """ Adds or updates a channel.
+
+        Raises:
+            StoreConflictError: The URL belongs to another channel.
+        """
+        if self.add_channels([(code, name, url)]):
+            raise StoreConflictError(url)
+
+    def remove_channels(self, codes):
+        """ Removes the given channels along with their events."""
+        with self._lock:
+            with self._conn:
+                self._conn.executemany('DELETE FROM channels WHERE code = ?',
+                                       [(code,) for code in codes])
+
+    def clear(self):
+        """ Removes all the channels and events."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM events')
+                self._conn.execute('DELETE FROM channels')
+
+    def get_validators(self, url):
+        """ Returns the (etag, modified) of the channel with the given URL or
+        None if the channel has not been retrieved yet.
+        """
+        rows = self._execute('SELECT etag, modified, fetched FROM channels '
+                             'WHERE url = ?', (url,))
+        if not rows or rows[0]['fetched'] is None:
+            return None
+
+        return rows[0]['etag'], rows[0]['modified']
+
+    # high-water marks
+
+    def get_seen(self, code):
+        """ Returns the (guid, published) of the newest event of a channel
+        which was shown to the user, both None if none was.
+        """
+        rows = self._execute('SELECT seen_guid, seen_published FROM channels '
+                             'WHERE code = ?', (code,))
+        if not rows:
+            return None, None
+
+        return rows[0]['seen_guid'], rows[0]['seen_published']
+
+    def set_seen(self, code, guid, published):
+        """ Updates the newest event of a channel shown to the user.
+
+        Args:
+            code (str): The code of the channel.
+            guid (str): The guid, or the URL, of the event.
+            published (int): The publication timestamp of the event.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute('UPDATE channels SET seen_guid = ?, '
+                                   'seen_published = ? WHERE code = ?',
+                                   (guid, published, code))
+
+    # schedule
+
+    def get_schedule(self):
+        """ Returns the polling schedule of all the channels.
+
+        Returns:
+            list. Dicts with the keys code, name, url, interval, next_fetch,
+            failures and hint.
+        """
+        rows = self._execute('SELECT code, name, url, interval, next_fetch, '
+                             'failures, hint FROM channels')
+        return [dict(zip(row.keys(), row)) for row in rows]
+
+    def set_schedule(self, code, interval, next_fetch, failures, hint=None):
+        """ Updates the polling schedule of a channel.
+
+        Args:
+            code (str): The code of the channel.
+            interval (int): The current polling interval in seconds.
+            next_fetch (int): The timestamp of the next retrieval.
+            failures (int): The number of consecutive failed retrievals.
+
+        Kwargs:
+            hint (int): The refresh period advertised by the feed in seconds.
+            The stored one is kept when None.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE channels SET interval = ?, next_fetch = ?, '
+                    'failures = ?, hint = COALESCE(?, hint) WHERE code = ?',
+                    (interval, next_fetch, failures, hint, code))
+
+    def is_fresh(self, url, now=None):
+        """ Returns True if the stored events of the channel with the given
+        URL are up to date according to the polling schedule.
+        """
+        now = now if now is not None else int(time.time())
+        rows = self._execute('SELECT next_fetch FROM channels WHERE url = ? '
+                             'AND generation > 0', (url,))
+
+        return bool(rows) and rows[0]['next_fetch'] is not None \
+               and rows[0]['next_fetch'] > now
+
+    # events
+
+    def save_events(self, url, events, etag=None, modified=None):
+        """ Saves the events of the latest retrieval of a channel.
+
+        Existing events are updated in place and new ones are inserted.
+
+        Args:
+            url (str): The URL of the channel.
+            events (list): The retrieved :class:`news.Event` objects.
+
+        Kwargs:
+            etag (str): The ETag returned by the server.
+            modified (str): The Last-Modified value returned by the server.
+
+        Returns:
+            int. The number of the events which were not stored before.
+        """
+        now = int(time.time())
+        inserted = 0
+        with self._lock:
+            with self._conn:
+                rows = self._conn.execute(
+                    'SELECT code, generation FROM channels WHERE url = ?',
+                    (url,)).fetchall()
+                if not rows:
+                    return 0
+
+                # the events of every retrieval are marked with a new
+                # generation of the channel
+                code = rows[0]['code']
+                generation = rows[0]['generation'] + 1
+                for event in events:
+                    params = (event.guid, event.title, event.summary,
+                              event.date, event.published, generation, code,
+                              event.url)
+                    row = self._conn.execute(
+                        'SELECT id, title, summary FROM events '
+                        'WHERE channel = ? AND url = ?',
+                        (code, event.url)).fetchone()
+                    if row is None:
+                        inserted += 1
+                        event_id = self._conn.execute(
+                            'INSERT INTO events (guid, title, summary, date, '
+                            'published, generation, channel, url) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', params
+                        ).lastrowid
+                    else:
+                        event_id = row['id']
+                        self._conn.execute(
+                            'UPDATE events SET guid = ?, title = ?, '
+                            'summary = ?, date = ?, published = ?, '
+                            'generation = ? WHERE channel = ? AND url = ?',
+                            params)
+                        if (row['title'], row['summary']) == \
+                           (event.title, event.summary):
+                            # the indexed text has not changed
+                            continue
+
+                    search.index_event(self._conn, event_id, event.title,
+                                       event.summary)
+
+                self._conn.execute(
+                    'UPDATE channels SET etag = ?, modified = ?, fetched = ?, '
+                    'generation = ? WHERE code = ?',
+                    (etag, modified, now, generation, code))
+
+        return inserted
+
+    def get_events(self, url, latest=True, since=None, limit=None):
+        """ Returns the stored events of a channel.
+
+        Args:
+            url (str): The URL of the channel.
+
+        Kwargs:
+            latest (bool): Only the events of the latest retrieval.
+            since (int): Only the events published after this timestamp.
+            limit (int): The maximum number of events.
+
+        Returns:
+            list. The :class:`news.Event` objects.
+        """
+        return list(self.iter_events(url, latest, since, limit))
+
+    def iter_events(self, url, latest=True, since=None, limit=None):
+        """ Yields the stored events of a channel as they are read, so that
+        the whole history is not held in memory, see :meth:`get_events`.
+
+        A read-only connection is held until the iteration ends.
+        """
+        query = 'SELECT e.* FROM events e JOIN channels c ' \
+                'ON e.channel = c.code WHERE c.url = ?'
+        params = [url]
+        if latest:
+            query += ' AND e.generation = c.generation'
+            order = 'e.id'
+        else:
+            order = 'e.published DESC'
+        if since is not None:
+            query += ' AND e.published > ?'
+            params.append(since)
+        query += ' ORDER BY %s' % order
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        with self._reading() as conn:
+            for row in conn.execute(query, params):
+                yield row_to_event(row)
+
+    def page_events(self, channel=None, since=None, limit=50, cursor=None):
+        """ Returns a page of the stored events, the newest first.
+
+        The pages are addressed by keyset, so they stay consistent while new
+        events are stored. The events without a publication date come last
+        and are paged separately, so that both parts are read in the order of
+        the indexes on the publication dates, which end with the ids.
+
+        Kwargs:
+            channel (str): Only the events of the channel with this code.
+            since (int): Only the events published after this timestamp.
+            limit (int): The maximum number of events.
+            cursor (tuple): The (published, id) of the last event of the
+            previous page.
+
+        Returns:
+            tuple. (events, cursor) where events is a list of (channel code,
+            :class:`news.Event`) tuples and cursor addresses the next page or
+            is None on the last one.
+        """
+        where = ''
+        params = []
+        if channel is not None:
+            where += ' AND channel = ?'
+            params.append(channel)
+
+        rows = []
+        with self._reading() as conn:
+            if cursor is None or cursor[0] is not None:
+                query = 'SELECT * FROM events WHERE published IS NOT NULL' + \
+                        where
+                dated = list(params)
+                if since is not None:
+                    query += ' AND published > ?'
+                    dated.append(since)
+                if cursor is not None:
+                    published, event_id = cursor
+                    query += ' AND (published < ? OR ' \
+                             '(published = ? AND id < ?))'
+                    dated += [published, published, event_id]
+                query += ' ORDER BY published DESC, id DESC LIMIT ?'
+                rows = conn.execute(query, dated + [limit + 1]).fetchall()
+
+            # the events without a date are never published after since
+            if len(rows) <= limit and since is None:
+                query = 'SELECT * FROM events WHERE published IS NULL' + where
+                if cursor is not None and cursor[0] is None:
+                    query += ' AND id < ?'
+                    params.append(cursor[1])
+                query += ' ORDER BY id DESC LIMIT ?'
+                rows += conn.execute(query, params +
+                                     [limit + 1 - len(rows)]).fetchall()
+
+        cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            cursor = (rows[-1]['published'], rows[-1]['id'])
+
+        return [(row['channel'], row_to_event(row)) for row in rows], cursor
+
+    def revision(self):
+        """ Returns a value which changes whenever the data change.
+
+        The changes of this connection and of the other processes, e.g. the
+        daemon, are both taken into account.
+        """
+        with self._lock:
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+            return '%s-%d-%d' % (self._opened, version,
+                                 self._conn.total_changes)
+
+
+    # search
+
+    def index_events(self):
+        """ Indexes the stored events which are not indexed yet."""
+        with self._lock:
+            with self._conn:
+                rows = self._conn.execute('SELECT id, title, summary '
+                                          'FROM events WHERE length IS NULL')
+                for row in rows.fetchall():
+                    search.index_event(self._conn, row['id'], row['title'],
+                                       row['summary'])
+
+    def search(self, query, limit=20):
+        """ Searches the stored events.
+
+        Args:
+            query (str): The search query, see :func:`search.parse_query`.
+
+        Kwargs:
+            limit (int): The maximum number of results.
+
+        Returns:
+            list. (score, channel code, :class:`news.Event`) tuples, the best
+            first.
+
+        Raises:
+            ValueError: The query is not valid.
+        """
+        with self._reading() as conn:
+            results = search.search(conn, query, limit)
+            if not results:
+                return []
+
+            ids = [event_id for _, event_id in results]
+            rows = conn.execute(
+                'SELECT * FROM events WHERE id IN (%s)' %
+                ', '.join('?' * len(ids)), ids).fetchall()
+
+        rows = dict((row['id'], row) for row in rows)
+        return [(score, rows[event_id]['channel'], row_to_event(rows[event_id]))
+                for score, event_id in results]
+
+
+def row_to_event(row):
+    """ Creates an :class:`news.Event` out of a row of the events table."""
+    return Event(row['title'], row['url'], row['date'], row['summary'],
+                 guid=row['guid'], published=row['published'], html=False)
+
+
+def migrate_data_file(store, filename):
+    """ Imports the channels of a pickled data file of the older versions.
+
+    The data file is renamed afterwards so that it is imported only once.
+
+    Args:
+        store (:class:`Store`): The store to import the channels into.
+        filename (str): The path of the pickled data file.
+
+    Raises:
+        ShellLoadDataCorruptedFile: The data file could not be unpickled.
+    """
+    if not os.path.exists(filename):
+        return
+
+    with open(filename, 'rb') as f:
+        try:
+            data = pickle.load(f)
+        except EOFError:
+            data = {}
+        except (pickle.UnpicklingError, ValueError, KeyError):
+            raise ShellLoadDataCorruptedFile
+
+    channels = (data or {}).get('channels', {})
+    store.add_channels([(code, channel['name'], channel['url'])
+                        for code, channel in channels.iteritems()])
+    os.rename(filename, filename + '.migrated')
@@ -0,0 +1,129 @@
+"""
+.. module:: stream
+   :platform: Unix
+      :synopsis: This module contains the incremental parsing of feeds.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import re
+import calendar
+from email.utils import parsedate_tz, mktime_tz
+from xml.etree.cElementTree import iterparse
+
+from clnews.news import Event
+
+# the elements of RSS and Atom items
+ITEMS = ('item', 'entry')
+TITLES = ('title',)
+LINKS = ('link',)
+GUIDS = ('guid', 'id')
+DATES = ('pubDate', 'published', 'updated', 'date')
+SUMMARIES = ('description', 'summary', 'content', 'encoded')
+
+ISO_DATE = re.compile(r'(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d))?'
+                      r'(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?)?$')
+
+
+def local_name(tag):
+    """ Strips the namespace of an element's tag."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_timestamp(value):
+    """ Converts an RFC 822 or ISO 8601 date to a UTC timestamp.
+
+    Returns:
+        int. The timestamp or None if the date could not be parsed.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    parsed = parsedate_tz(value)
+    if parsed:
+        return mktime_tz(parsed)
+
+    match = ISO_DATE.match(value)
+    if not match:
+        return None
+
+    year, month, day, hour, minute, second, zone = match.groups()
+    timestamp = calendar.timegm((int(year), int(month), int(day),
+                                 int(hour or 0), int(minute or 0),
+                                 int(second or 0), 0, 0, 0))
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        timestamp -= offset if zone[0] == '+' else -offset
+
+    return timestamp
+
+
+def _text(element):
+    return ''.join(element.itertext()).strip()
+
+
+def _item_to_event(item):
+    fields = {}
+    for child in item:
+        name = local_name(child.tag)
+        if name in LINKS:
+            # Atom links are given in attributes
+            if child.get('rel', 'alternate') == 'alternate':
+                fields.setdefault('link', child.get('href') or _text(child))
+        elif name in TITLES + GUIDS + DATES + SUMMARIES:
+            fields.setdefault(name, _text(child))
+
+    date = next((fields[name] for name in DATES if name in fields), '')
+    guid = next((fields[name] for name in GUIDS if name in fields), None)
+    summary = next((fields[name] for name in SUMMARIES if name in fields),
+                   None)
+
+    return Event(fields.get('title', ''), fields.get('link', guid), date,
+                 summary, guid, parse_timestamp(date))
+
+
+def iter_events(source, since=None, last_guid=None):
+    """ Parses a feed incrementally yielding its events.
+
+    Every item is parsed as soon as its closing tag is read and is discarded
+    right after, so the memory needed is bounded by the size of one item.
+    The parsing stops at the first item which is not newer than the given
+    ones, as the feeds list their items from the newest to the oldest.
+
+    Args:
+        source (file): The file-like object of the feed.
+
+    Kwargs:
+        since (int): Stop at the items published at or before this timestamp.
+        last_guid (str): Stop at the item with this guid or URL.
+
+    Yields:
+        :class:`news.Event`. The events of the feed.
+
+    Raises:
+        SyntaxError: The feed is not well-formed XML.
+    """
+    stack = []
+    for action, element in iterparse(source, events=('start', 'end')):
+        if action == 'start':
+            stack.append(element)
+            continue
+
+        stack.pop()
+        if local_name(element.tag) not in ITEMS:
+            continue
+
+        event = _item_to_event(element)
+        if last_guid is not None and last_guid in (event.guid, event.url):
+            return
+        if since is not None and event.published is not None \
+           and event.published <= since:
+            return
+
+        yield event
+
+        # the parsed item is dropped from the tree
+        if stack:
+            stack[-1].remove(element)
+        element.clear()
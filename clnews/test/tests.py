@@ -4,18 +4,113 @@ import unittest
 import datetime
 import os
 import sys
+import time
+import json
+import pickle
+import shutil
+import socket
+import sqlite3
+import tempfile
+import StringIO
+import threading
+import subprocess
+import gzip
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '../'))
 
 from clnews.exceptions import *
-from clnews.news import Event, Channel
-from clnews.shell import Shell
-from clnews.utils import remove_html, validate_url
-from clnews.commands import Command, Get, Add, Help, List, Remove
+from clnews.news import Event, EventBatch, Channel, parse_feed
+from clnews.shell import Shell, ImportProfiler, parse_args
+from clnews.utils import remove_html, remove_html_bulk, validate_url
+from clnews.commands import Command, Get, GetAll, Add, Help, List, Remove, \
+Import, Export, Stats
+from clnews.fetch import Fetcher
+from clnews.parse import ParsePool
+from clnews.stats import Stats as StatsRegistry, STATS
+from clnews.cache import ValidatorCache, EventCache, events_size
+from clnews.store import Store, migrate_data_file
+from clnews.daemon import Daemon, next_interval
+from clnews.search import parse_query
+from clnews import search
+from clnews.stream import iter_events, parse_timestamp
+from clnews.dedup import DedupIndex, normalize_url, fingerprint, similarity
+from clnews.registry import ChannelRegistry, feed_url
+from clnews.complete import Completer
+from clnews.transport import HTTPTransport, DNSCache, default_transport
+from clnews.opml import read_opml
+from clnews.api import APIServer
+from clnews.batch import get_events, write_csv, write_ndjson, run_search, \
+EVENT_FIELDS
+from clnews.decorators import Pager, less
+from clnews import config, decorators, utils
+
+try:
+    from clnews.ui import EventWalker, WIDGET_CACHE
+except ImportError:
+    # urwid is optional
+    EventWalker = None
+
+# the commands and the stores of the tests never touch the data of the user
+DATA_PATH = tempfile.mkdtemp()
+config.STORE_PATH = os.path.join(DATA_PATH, 'clnews.db')
+config.DEDUP_PATH = os.path.join(DATA_PATH, 'dedup.dat')
+config.CHANNELS_PATH = os.path.join(DATA_PATH, 'channels.dat')
 
 Command()
 Command.data['channels'] = {}
 
+RSS = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Local</title>%s</channel></rss>"""
+
+RSS_ITEM = """<item><title>Title %(i)d</title>
+<link>http://localhost/%(i)d</link><guid>http://localhost/%(i)d</guid>
+<pubDate>Sat, 10 Jan 2015 10:%(m)02d:00 GMT</pubDate>
+<description>&lt;p&gt;Summary %(i)d&lt;/p&gt;</description></item>"""
+
+
+def make_rss(items):
+    return RSS % ''.join(RSS_ITEM % {'i': i, 'm': 59 - i % 60}
+                         for i in range(items))
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """ Serves a feed of 3 items supporting conditional GET requests."""
+
+    etag = '"v1"'
+    not_modified = 0
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            FeedHandler.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        if self.path.startswith('/missing'):
+            self.send_error(404)
+            return
+
+        body = make_rss(3)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_feed_server():
+    server = HTTPServer(('127.0.0.1', 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
 class TestUtils(unittest.TestCase):
 
     def test_remove_html(self):
@@ -23,6 +118,20 @@ class TestUtils(unittest.TestCase):
         output = remove_html(html)
         self.assertEqual(output, 'test test test')
 
+        html = u'<![CDATA[<p>caf&eacute; &amp;lt; &#8212; &#x41;&nbsp;</p>' \
+               u'<!-- <p>comment</p> --><SCRIPT>var a = "<b>";</script>' \
+               u'<br\n/>&bogus; 1 &lt; 2]]>'
+        self.assertEqual(remove_html(html),
+                         u'caf\xe9 &lt; \u2014 A\xa0&bogus; 1 < 2')
+        self.assertEqual(remove_html('&eacute;'), '\xc3\xa9')
+
+    def test_remove_html_bulk(self):
+        strings = ['<b>one</b>', u'<i>tw\x00o</i> &amp;', None, '<b',
+                   '>three']
+        self.assertEqual(remove_html_bulk(strings),
+                         [u'one', u'two &', u'', u'<b', u'>three'])
+        self.assertEqual(remove_html_bulk([]), [])
+
 class TestNews(unittest.TestCase):
 
     def setUp(self):
@@ -56,6 +165,1269 @@ class TestNews(unittest.TestCase):
                                                      events[0].url))
 
 
+class TestEventBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = EventBatch([Event('title %d' % i, 'http://cnn/%d' % i,
+                                       'date %d' % (i % 2), 'summary',
+                                       published=i)
+                                 for i in range(3)], 'cnn')
+        self.batch.append(Event(u'\u03b5\u03bb', 'http://bbc/1', 'date 0'),
+                          'bbc')
+
+    def test_event_slots(self):
+        with self.assertRaises(AttributeError):
+            Event('title', 'url', 'date').channel = 'cnn'
+
+    def test_batch(self):
+        self.assertEqual(len(self.batch), 4)
+        self.assertEqual(self.batch.get(1, 'url'), 'http://cnn/1')
+        self.assertEqual(self.batch.get(3, 'channel'), 'bbc')
+        self.assertEqual(self.batch.get(3, 'published'), None)
+
+        event = self.batch[-1]
+        self.assertEqual((event.title, event.url, event.date, event.summary,
+                          event.guid, event.published),
+                         (u'\u03b5\u03bb', 'http://bbc/1', 'date 0', '',
+                          None, None))
+        self.assertEqual([e.title for e in self.batch][:2],
+                         ['title 0', 'title 1'])
+
+        batch = pickle.loads(pickle.dumps(self.batch, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(batch.get(2, 'title'), 'title 2')
+        batch.append(Event('new', 'http://cnn/new', 'date 1'), 'cnn')
+        self.assertEqual(list(batch.filter(channel='cnn')), [0, 1, 2, 4])
+
+    def test_chunks(self):
+        batch = EventBatch()
+        for i in range(2000):
+            batch.append(Event('title %d' % i, 'http://cnn/%d' % i,
+                               'date', 'summary ' * i), 'cnn')
+            # the reads between the appends flush the texts every time
+            self.assertEqual(batch.get(i, 'title'), 'title %d' % i)
+        self.assertTrue(1 < len(batch._chunks) < 2000)
+        self.assertEqual(batch.get(1000, 'summary'), 'summary ' * 1000)
+        self.assertEqual(batch.get(0, 'summary'), '')
+
+        # the dates and the channels are interned apart
+        batch.append(Event('dated', 'http://bbc/1', 'bbc'), 'bbc')
+        batch.append(Event('other', 'http://bbc/2', 'date'), 'cnn')
+        self.assertEqual(list(batch.filter(channel='bbc')), [2000])
+        self.assertEqual(list(batch.filter(channel='date')), [])
+
+    def test_filter_sort(self):
+        self.assertEqual(list(self.batch.filter(channel='cnn', since=1)),
+                         [1, 2])
+        self.assertEqual(list(self.batch.filter(until=1)), [0])
+        self.assertEqual(list(self.batch.filter(channel='abc')), [])
+
+        self.assertEqual(list(self.batch.sort()), [2, 1, 0, 3])
+        indexes = self.batch.filter(channel='cnn')
+        self.assertEqual(list(self.batch.sort('url', False, indexes)),
+                         [0, 1, 2])
+
+
+class TestFetcher(unittest.TestCase):
+
+    class SlowChannel(Channel):
+
+        def __init__(self, name, url, delay):
+            super(TestFetcher.SlowChannel, self).__init__(name, url)
+            self.delay = delay
+
+        def get_events(self):
+            time.sleep(self.delay)
+            if self.delay < 0.01:
+                raise ChannelServerError
+            return [Event(self.name, self.url, 'date')]
+
+    def test_fetch(self):
+        channels = [self.SlowChannel('ch%d' % i, 'http://host%d/rss' % i, 0.2)
+                    for i in range(10)]
+        channels.append(self.SlowChannel('broken', 'http://host/rss', 0))
+
+        start = time.time()
+        results = list(Fetcher(workers=20).fetch(channels))
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(len(results), len(channels))
+
+        # the failed channel is returned first along with its error
+        channel, events = results[0]
+        self.assertEqual(channel.name, 'broken')
+        self.assertEqual(events, None)
+        self.assertTrue(isinstance(channel.error, ChannelServerError))
+
+        for channel, events in results[1:]:
+            self.assertEqual(events[0].title, channel.name)
+
+    def test_fetch_per_host(self):
+        channels = [self.SlowChannel('ch%d' % i, 'http://host/rss%d' % i, 0.1)
+                    for i in range(4)]
+
+        start = time.time()
+        list(Fetcher(workers=4, per_host=1).fetch(channels))
+        self.assertTrue(time.time() - start >= 0.4)
+
+        # the other hosts do not wait for the busy one
+        channels.append(self.SlowChannel('other', 'http://other/rss', 0))
+        results = Fetcher(workers=2, per_host=1).fetch(channels)
+        self.assertEqual(next(results)[0].name, 'other')
+        list(results)
+
+    def test_concurrent_fetches(self):
+        fetcher = Fetcher(workers=1)
+        channels = [self.SlowChannel('ch%d' % i, 'http://host%d/rss' % i, 0)
+                    for i in range(4)]
+
+        def retrieve(name):
+            def inner(channel):
+                time.sleep(0.05)
+                return name
+            return inner
+
+        first = fetcher.fetch(channels[:2], retrieve('first'))
+        second = fetcher.fetch(channels[2:], retrieve('second'))
+        next(first)
+        next(second)
+        self.assertEqual([events for _, events in first] +
+                         [events for _, events in second],
+                         ['first', 'second'])
+
+    def test_parse_pool(self):
+        server, base_url = start_feed_server()
+        pool = ParsePool(2)
+        try:
+            events, hint = pool(make_rss(3))
+            expected, _ = parse_feed(make_rss(3))
+            self.assertEqual([(e.title, e.url, e.summary, e.published)
+                              for e in events],
+                             [(e.title, e.url, e.summary, e.published)
+                              for e in expected])
+
+            channels = [Channel('ch%d' % i, '%s/feed%d' % (base_url, i))
+                        for i in range(3)]
+            results = list(Fetcher(parser=pool).fetch(channels))
+            self.assertEqual(sorted(len(events) for _, events in results),
+                             [3, 3, 3])
+            self.assertTrue(all(channel.parser is pool
+                                for channel in channels))
+
+            # the processes are started only when a feed is parsed
+            streamed = ParsePool(2)
+            results = list(Fetcher(parser=streamed).fetch(
+                channels, lambda channel: list(channel.iter_events())))
+            self.assertEqual(sorted(len(events) for _, events in results),
+                             [3, 3, 3])
+            self.assertEqual(streamed._pool, None)
+        finally:
+            pool.close()
+            server.shutdown()
+
+
+class TestValidatorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.base_url = start_feed_server()
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, 'clnews.db')
+        self.store = Store(self.filename)
+        self.cache = ValidatorCache(self.store)
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.dirname)
+
+    def test_conditional_get(self):
+        url = self.base_url + '/feed'
+        self.store.add_channel('local', 'Local', url)
+        events = Channel('local', url, cache=self.cache).get_events()
+        self.assertEqual(len(events), 3)
+        self.assertEqual(self.cache.get(url), (FeedHandler.etag, None))
+
+        # the events are reused on a 304
+        events = Channel('local', url, cache=self.cache).get_events()
+        self.assertEqual(FeedHandler.not_modified, 1)
+        self.assertEqual([e.title for e in events],
+                         ['Title 0', 'Title 1', 'Title 2'])
+
+
+class TestEventCache(unittest.TestCase):
+
+    def setUp(self):
+        self.events = [Event('Title %d' % i, 'http://localhost/%d' % i,
+                             'Sat, 10 Jan 2015', 'Summary') for i in range(3)]
+
+    def test_ttl(self):
+        cache = EventCache(ttl=60)
+        self.assertEqual(cache.get('a', 'http://a', now=0), None)
+        cache.set('a', 'http://a', self.events, now=0)
+        self.assertEqual(cache.get('a', 'http://a', now=59), self.events)
+        # the URL of the channel changed
+        self.assertEqual(cache.get('a', 'http://b', now=59), None)
+
+        cache.set('a', 'http://a', self.events, now=0)
+        self.assertEqual(cache.get('a', 'http://a', now=60), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_lru(self):
+        size = events_size(self.events)
+        cache = EventCache(ttl=60, budget=2 * size)
+        cache.set('a', 'http://a', self.events, now=0)
+        cache.set('b', 'http://b', self.events, now=0)
+        cache.get('a', 'http://a', now=1)
+        cache.set('c', 'http://c', self.events, now=1)
+
+        # the least recently used channel is evicted
+        self.assertEqual(cache.get('b', 'http://b', now=1), None)
+        self.assertEqual(cache.get('a', 'http://a', now=1), self.events)
+        self.assertEqual((cache.evictions, cache.size), (1, 2 * size))
+
+        # the events larger than the budget are not cached
+        cache.set('d', 'http://d', self.events * 3, now=1)
+        self.assertEqual(cache.get('d', 'http://d', now=1), None)
+
+        cache.discard('a')
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_get_command(self):
+        server, base_url = start_feed_server()
+        Command.data['channels']['local'] = {'name': 'Local',
+                                             'url': base_url + '/feed'}
+        try:
+            command = Get()
+            command.execute('local')
+            hits, not_modified = Command.events.hits, FeedHandler.not_modified
+            command.execute('local')
+            self.assertEqual(len(command.buffer), 3)
+            self.assertEqual(Command.events.hits, hits + 1)
+
+            # the network is reached only on demand
+            self.assertEqual(FeedHandler.not_modified, not_modified)
+            command.execute('--fresh', 'local')
+            self.assertEqual(len(command.buffer), 3)
+        finally:
+            del Command.data['channels']['local']
+            server.shutdown()
+
+    def test_getall_fresh(self):
+        # nothing listens to the URL, so the events can only be read from the
+        # store, which the daemon keeps up to date
+        url = 'http://127.0.0.1:1/feed'
+        command = GetAll()
+        command.store.add_channel('daemon', 'Daemon', url)
+        command.store.save_events(url, [Event('Title', url + '/1', 'date')])
+        command.store.set_schedule('daemon', 600, int(time.time()) + 600, 0)
+        Command.data['channels']['daemon'] = {'name': 'Daemon', 'url': url}
+        try:
+            command.execute('daemon')
+            (channel, events), = command.buffer
+            self.assertEqual([event.title for event in events], ['Title'])
+        finally:
+            del Command.data['channels']['daemon']
+            Command.events.discard('daemon')
+            command.store.remove_channels(['daemon'])
+
+
+class TestStats(unittest.TestCase):
+
+    def test_stats(self):
+        stats = StatsRegistry()
+        for seconds in (0.001, 0.02, 0.3):
+            stats.observe('download', seconds, channel='cnn')
+        stats.incr('bytes', 100, channel='cnn')
+        stats.incr('bytes', 50, channel='cnn')
+        with stats.timer('parse', channel=None):
+            pass
+
+        histogram = stats.timings[('download', (('channel', 'cnn'),))]
+        self.assertEqual((histogram.count, histogram.max), (3, 0.3))
+        self.assertEqual(histogram.quantile(0.5), 0.025)
+
+        report = stats.report().splitlines()
+        self.assertTrue(report[1].startswith('download{channel="cnn"}    '))
+        self.assertTrue(report[2].startswith('parse '))
+        self.assertTrue(report[-1].endswith(' 150'))
+
+        text = stats.prometheus()
+        self.assertTrue('clnews_download_seconds_bucket{channel="cnn",'
+                        'le="0.025"} 2\n' in text)
+        self.assertTrue('clnews_download_seconds_count{channel="cnn"} 3\n'
+                        in text)
+        self.assertTrue('clnews_bytes_total{channel="cnn"} 150\n' in text)
+
+        stats.clear()
+        self.assertEqual(stats.prometheus(), '')
+
+    def test_stats_command(self):
+        server, base_url = start_feed_server()
+        Command.data['channels']['local'] = {'name': 'Local',
+                                             'url': base_url + '/feed'}
+        try:
+            STATS.clear()
+            Get().execute('--fresh', 'local')
+            command = Stats()
+            command.execute()
+            self.assertTrue('retrieve{channel="local"}' in command.buffer)
+            self.assertTrue('event cache: ' in command.buffer)
+
+            command.execute('--prometheus')
+            self.assertTrue('clnews_bytes_total{channel="local"}'
+                            in command.buffer)
+
+            command.execute('--clear')
+            self.assertEqual(STATS.report().count('\n'), 1)
+            with self.assertRaises(CommandExecutionError):
+                command.execute('--all')
+        finally:
+            del Command.data['channels']['local']
+            server.shutdown()
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, 'clnews.db')
+        self.store = Store(self.filename)
+        self.store.add_channels([('cnn', 'CNN', 'http://cnn/rss'),
+                                 ('bbc', 'BBC', 'http://bbc/rss')])
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_channels(self):
+        self.assertEqual(self.store.load()['channels']['cnn'],
+                         {'name': 'CNN', 'url': 'http://cnn/rss'})
+
+        self.store.remove_channels(['cnn'])
+        self.assertEqual(self.store.load()['channels'].keys(), ['bbc'])
+
+        self.store.clear()
+        self.assertEqual(self.store.load(), {'channels': {}})
+
+    def test_url_conflicts(self):
+        # the channels whose URL belongs to another one are reported
+        self.assertEqual(self.store.add_channels([
+            ('cnni', 'CNN Int', 'http://cnn/rss'),
+            ('nbc', 'NBC', 'http://nbc/rss')]),
+            [('cnni', 'CNN Int', 'http://cnn/rss')])
+        self.assertEqual(sorted(self.store.load()['channels']),
+                         ['bbc', 'cnn', 'nbc'])
+        with self.assertRaises(StoreConflictError):
+            self.store.add_channel('bbc', 'BBC', 'http://cnn/rss')
+
+        # a channel keeps its own URL
+        self.store.add_channel('cnn', 'CNN World', 'http://cnn/rss')
+        self.assertEqual(self.store.load()['channels']['cnn']['name'],
+                         'CNN World')
+
+    def test_events(self):
+        events = [Event('title %d' % i, 'http://cnn/%d' % i, 'date',
+                        published=i)
+                  for i in range(3)]
+        self.assertEqual(self.store.save_events('http://cnn/rss', events), 3)
+        self.assertEqual(self.store.get_validators('http://cnn/rss'),
+                         (None, None))
+
+        events[0].title = 'updated'
+        self.assertEqual(self.store.save_events('http://cnn/rss', events[:1]),
+                         0)
+
+        # only the latest retrieval
+        latest = self.store.get_events('http://cnn/rss')
+        self.assertEqual([e.title for e in latest], ['updated'])
+
+        # all the history
+        history = self.store.get_events('http://cnn/rss', latest=False)
+        self.assertEqual([e.published for e in history], [2, 1, 0])
+        batch = EventBatch(self.store.iter_events('http://cnn/rss',
+                                                  latest=False))
+        self.assertEqual(batch.get(0, 'title'), 'title 2')
+
+        history = self.store.get_events('http://cnn/rss', latest=False,
+                                        since=0, limit=1)
+        self.assertEqual([e.published for e in history], [2])
+
+        # the events are removed along with their channel
+        self.store.remove_channels(['cnn'])
+        self.assertEqual(self.store.get_events('http://cnn/rss'), [])
+
+    def test_page_events(self):
+        self.store.save_events('http://cnn/rss', [
+            Event('title %d' % i, 'http://cnn/%d' % i, 'date',
+                  published=i % 3 or None)
+            for i in range(6)])
+
+        titles = []
+        cursor = None
+        while True:
+            events, cursor = self.store.page_events('cnn', limit=2,
+                                                    cursor=cursor)
+            titles += [event.title for _, event in events]
+            if cursor is None:
+                break
+        # the events without a date come last
+        self.assertEqual(titles, ['title 5', 'title 2', 'title 4', 'title 1',
+                                  'title 3', 'title 0'])
+
+        events, cursor = self.store.page_events(since=1)
+        self.assertEqual([event.title for _, event in events],
+                         ['title 5', 'title 2'])
+        self.assertEqual(cursor, None)
+
+    def test_channels_version(self):
+        version = self.store.channels_version()
+        self.store.set_seen('cnn', 'http://cnn/1', 0)
+        self.assertEqual(self.store.channels_version(), version)
+
+        self.store.add_channels([('nbc', 'NBC', 'http://nbc/rss')])
+        self.assertTrue(self.store.channels_version() > version)
+        version = self.store.channels_version()
+        self.store.remove_channels(['nbc'])
+        self.assertTrue(self.store.channels_version() > version)
+
+    def test_reload(self):
+        command = List()
+        data = Command.data
+        try:
+            command.reload()
+            command.store.add_channel('reloaded', 'Reloaded',
+                                      'http://reloaded/rss')
+            command.reload()
+            self.assertTrue('reloaded' in Command.data['channels'])
+
+            command.store.remove_channels(['reloaded'])
+            command.reload()
+            self.assertFalse('reloaded' in Command.data['channels'])
+        finally:
+            Command.data = data
+
+    def test_migrate_data_file(self):
+        filename = os.path.join(self.dirname, 'channels.dat')
+        with open(filename, 'wb') as f:
+            pickle.dump({'channels': {'abc': {'name': 'ABC',
+                                              'url': 'http://abc/rss'}}}, f)
+
+        migrate_data_file(self.store, filename)
+        self.assertTrue('abc' in self.store.load()['channels'])
+        self.assertFalse(os.path.exists(filename))
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.base_url = start_feed_server()
+        self.dirname = tempfile.mkdtemp()
+        self.store = Store(os.path.join(self.dirname, 'clnews.db'))
+        self.store.add_channels([('ok', 'OK', self.base_url + '/ok'),
+                                 ('ko', 'KO', self.base_url + '/missing')])
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.dirname)
+
+    def test_next_interval(self):
+        # busy channels are polled more often
+        self.assertEqual(next_interval(600, 5, 0), 300)
+        # quiet and failing channels back off
+        self.assertEqual(next_interval(600, 0, 0), 900)
+        self.assertEqual(next_interval(600, 0, 1), 1200)
+        # the advertised refresh period is respected
+        self.assertEqual(next_interval(600, 5, 0, hint=3600), 3600)
+        # the limits are respected
+        self.assertEqual(next_interval(config.POLL_MIN_INTERVAL, 5, 0),
+                         config.POLL_MIN_INTERVAL)
+        self.assertEqual(next_interval(config.POLL_MAX_INTERVAL, 0, 1),
+                         config.POLL_MAX_INTERVAL)
+
+    def test_poll(self):
+        daemon = Daemon(self.store)
+        now = int(time.time())
+        self.assertEqual(daemon.poll(now), config.POLL_INTERVAL / 2)
+
+        schedule = dict((entry['code'], entry)
+                        for entry in self.store.get_schedule())
+        self.assertEqual(schedule['ok']['failures'], 0)
+        self.assertEqual(schedule['ko']['failures'], 1)
+        self.assertEqual(schedule['ko']['interval'], config.POLL_INTERVAL * 2)
+
+        # the new events are read from the disk
+        url = self.base_url + '/ok'
+        self.assertTrue(self.store.is_fresh(url))
+        self.assertEqual(len(self.store.get_events(url)), 3)
+
+        # nothing is due
+        daemon.poll(now + 1)
+        schedule = dict((entry['code'], entry)
+                        for entry in self.store.get_schedule())
+        self.assertEqual(schedule['ko']['failures'], 1)
+
+    def test_concurrent_polls(self):
+        fetched = []
+
+        class CountingFetcher(Fetcher):
+
+            def fetch(self, channels):
+                fetched.extend(channel.code for channel in channels)
+                time.sleep(0.2)
+                return Fetcher.fetch(self, channels)
+
+        # e.g. the polling loop and a refresh of the API
+        daemon = Daemon(self.store, CountingFetcher())
+        threads = [threading.Thread(target=daemon.poll) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the second poll found the channels retrieved by the first
+        self.assertEqual(sorted(fetched), ['ko', 'ok'])
+
+
+class TestChannelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ChannelRegistry({
+            'cnn': {'name': 'CNN', 'url': 'http://cnn.com/rss/'},
+            'CNNi': {'name': 'CNN Int', 'url': 'http://edition.cnn.com/rss'},
+            'bbc': {'name': 'BBC', 'url': 'http://bbc.co.uk/rss'}})
+
+    def test_urls(self):
+        self.assertEqual(self.registry.find_url('HTTP://CNN.com:80/rss/'),
+                         'cnn')
+        self.assertEqual(self.registry.find_url('https://cnn.com/rss'), None)
+        self.assertEqual(self.registry.find_url('http://www.cnn.com/rss'),
+                         None)
+        self.assertEqual(self.registry.find_url('http://nyt.com/rss'), None)
+
+        self.registry['cnn'] = {'name': 'CNN', 'url': 'http://nyt.com/rss'}
+        self.assertEqual(self.registry.find_url('http://cnn.com/rss'), None)
+        self.assertEqual(self.registry.find_url('http://nyt.com/rss'), 'cnn')
+
+        del self.registry['cnn']
+        self.assertEqual(self.registry.find_url('http://nyt.com/rss'), None)
+        self.registry.clear()
+        self.assertEqual(self.registry.find_url('http://bbc.co.uk/rss'), None)
+
+    def test_feed_url(self):
+        self.assertEqual(feed_url('HTTPS://News.com:443/feed/?rss=news'),
+                         'https://news.com/feed?rss=news')
+        self.assertEqual(feed_url('http://news.com:8080/feed'),
+                         'http://news.com:8080/feed')
+
+        self.registry['news'] = {'name': 'News',
+                                 'url': 'http://news.com/feed?rss=news'}
+        self.assertEqual(
+            self.registry.find_url('http://news.com/feed?rss=news'), 'news')
+        self.assertEqual(
+            self.registry.find_url('http://news.com/feed?rss=sport'), None)
+
+    def test_codes(self):
+        self.assertEqual(self.registry.complete('cn'), ['cnn', 'CNNi'])
+        self.assertEqual(self.registry.complete('B'), ['bbc'])
+        self.assertEqual(self.registry.complete('x'), [])
+
+        self.assertEqual(self.registry.lookup('BBC'), 'bbc')
+        self.assertEqual(self.registry.lookup('cnni'), 'CNNi')
+        self.assertEqual(self.registry.lookup('nyt'), None)
+
+        self.registry.pop('bbc')
+        self.assertEqual(self.registry.complete('b'), [])
+
+        copy = pickle.loads(pickle.dumps(self.registry, 2))
+        self.assertEqual(copy, self.registry)
+        self.assertEqual(copy.complete('c'), ['cnn', 'CNNi'])
+
+    def test_completer(self):
+        completer = Completer(['.get', '.getall', '.help', '.search'],
+                              lambda: self.registry)
+        self.assertEqual(completer.matches('', '.ge'), ['.get', '.getall'])
+        self.assertEqual(completer.matches('', '.x'), [])
+
+        # the codes and then the codes of the matching names
+        self.assertEqual(completer.matches('.get ', 'c'), ['cnn', 'CNNi'])
+        self.assertEqual(completer.matches('.getall cnn ', 'bb'), ['bbc'])
+        self.assertEqual(completer.matches('.get ', 'cnn i'), ['CNNi'])
+        self.assertEqual(completer.matches('.get ', '--f'), ['--fresh'])
+        self.assertEqual(completer.matches('.search ', 'channel:b'),
+                         ['channel:bbc'])
+        self.assertEqual(completer.matches('.help ', 'c'), [])
+
+
+class TestDedup(unittest.TestCase):
+
+    summary = 'The central bank raised interest rates by half a point on ' \
+              'Thursday, its biggest increase in over two decades.'
+
+    def setUp(self):
+        self.filename = os.path.join(tempfile.mkdtemp(), 'dedup.dat')
+        self.index = DedupIndex(self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+        if os.path.exists(self.filename + '.lock'):
+            os.remove(self.filename + '.lock')
+
+    def test_normalize_url(self):
+        self.assertEqual(
+            normalize_url('http://WWW.News.com:80/story/?b=2&utm_source=x&a=1'
+                          '#top'),
+            normalize_url('https://news.com/story?a=1&b=2'))
+        self.assertNotEqual(normalize_url('http://news.com/story?id=1'),
+                            normalize_url('http://news.com/story?id=2'))
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint('too short'), None)
+        near = similarity(fingerprint('Rates raised. ' + self.summary),
+                          fingerprint('Rates raised! ' + self.summary +
+                                      ' (Reuters)'))
+        far = similarity(fingerprint(self.summary),
+                         fingerprint('The local team won the cup final after '
+                                     'a penalty shoot-out on Sunday evening.'))
+        self.assertTrue(near >= 6)
+        self.assertTrue(far < 6)
+
+    def test_filter(self):
+        events = [Event('Rates raised', 'http://cnn.com/1', 'date',
+                        self.summary),
+                  Event('Cup final', 'http://cnn.com/2', 'date')]
+        syndicated = [Event('Rates raised', 'http://bbc.com/1', 'date',
+                            self.summary + ' (Reuters)'),
+                      Event('Other', 'http://www.cnn.com/2/?utm_medium=rss',
+                            'date'),
+                      Event('New', 'http://bbc.com/3', 'date')]
+
+        self.assertEqual(self.index.filter(events, 'cnn'), events)
+        self.assertEqual(self.index.filter(syndicated, 'bbc'),
+                         syndicated[2:])
+
+        # a channel keeps seeing its own events
+        self.assertEqual(self.index.filter(events, 'cnn'), events)
+
+        # the index is persisted
+        self.index.save()
+        index = DedupIndex.__new__(DedupIndex)
+        DedupIndex.__init__(index, self.filename)
+        self.assertEqual(len(index), len(self.index))
+        self.assertEqual(index.filter(syndicated, 'bbc'), syndicated[2:])
+
+        # and written again only when it has new keys
+        os.utime(self.filename, (1000000000, 1000000000))
+        self.index.filter(events, 'cnn')
+        self.index.save()
+        self.assertEqual(os.path.getmtime(self.filename), 1000000000)
+        self.index.filter([Event('Late', 'http://cnn.com/4', 'date')], 'cnn')
+        self.index.save()
+        self.assertNotEqual(os.path.getmtime(self.filename), 1000000000)
+
+    def test_discard(self):
+        events = [Event('Rates raised', 'http://cnn.com/1', 'date',
+                        self.summary)]
+        syndicated = [Event('Rates raised', 'http://bbc.com/1', 'date',
+                            self.summary + ' (Reuters)')]
+        self.index.filter(events, 'cnn')
+        self.index.save()
+
+        self.index.discard('cnn')
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.filter(syndicated, 'bbc'), syndicated)
+
+        # the keys of the discarded channel are not merged back from the file
+        self.index.save()
+        self.assertEqual(DedupIndex(self.filename).filter(events, 'cnn'), [])
+
+    def test_prune(self):
+        events = [Event('Rates raised', 'http://cnn.com/1', 'date',
+                        self.summary)]
+        self.index.filter(events, 'cnn')
+        self.index.save()
+
+        self.index.prune(time.time() + self.index.ttl - 86400)
+        self.assertEqual(len(self.index), 2)
+        self.index.prune(time.time() + self.index.ttl + 86400)
+        self.assertEqual(len(self.index), 0)
+
+        # the keys of the older files are kept from the day they are loaded
+        self.index.data_file.update(lambda data: {'keys': {1: 'cnn'},
+                                                  'fingerprints': {2: 'cnn'}})
+        self.assertEqual(len(DedupIndex(self.filename)), 2)
+
+    def test_guids(self):
+        events = [Event('Cup final', 'http://cnn.com/2', 'date', guid='1'),
+                  Event('Rates', 'http://cnn.com/3', 'date',
+                        guid='http://cnn.com/story/3')]
+        self.assertEqual(self.index.filter(events, 'cnn'), events)
+
+        # the GUIDs which are not URLs are unique only in their channel
+        other = Event('Other', 'http://bbc.com/1', 'date', guid='1')
+        self.assertEqual(self.index.filter([other], 'bbc'), [other])
+        republished = Event('Rates', 'http://bbc.com/3', 'date',
+                            guid='http://cnn.com/story/3')
+        self.assertEqual(self.index.filter([republished], 'bbc'), [])
+        self.index.save()
+
+    def test_concurrent_save(self):
+        # another path of the file stands for another process
+        dirname, basename = os.path.split(self.filename)
+        other = DedupIndex(os.path.join(dirname, '.', basename))
+        self.index.filter([Event('Cup final', 'http://cnn.com/2', 'date')],
+                          'cnn')
+        other.filter([Event('New', 'http://bbc.com/3', 'date')], 'bbc')
+        self.index.save()
+        other.save()
+
+        # the file is replaced keeping the events of both
+        self.assertEqual(len(DedupIndex(self.filename)), 2)
+        self.assertEqual(len(other), 2)
+        self.assertEqual(sorted(os.listdir(dirname)),
+                         [basename, basename + '.lock'])
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.store = Store(os.path.join(self.dirname, 'clnews.db'))
+        self.store.add_channels([('cnn', 'CNN', 'http://cnn/rss'),
+                                 ('bbc', 'BBC', 'http://bbc/rss')])
+        self.store.save_events('http://cnn/rss', [
+            Event('Central bank raises rates', 'http://cnn/1', 'date',
+                  'The central bank raised interest rates.', published=0),
+            Event('Rates and more rates', 'http://cnn/2', 'date',
+                  'Bank rates, mortgage rates and exchange rates.',
+                  published=2 * 86400)])
+        self.store.save_events('http://bbc/rss', [
+            Event('Cup final', 'http://bbc/1', 'date',
+                  'The local team won the cup final.', published=86400)])
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def titles(self, query):
+        return [event.title for _, _, event in self.store.search(query)]
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query('Bank "interest rates" channel:cnn '
+                                     'since:1970-01-02'),
+                         ([u'bank'], [[u'interest', u'rates']],
+                          {'channel': 'cnn', 'since': 86400}))
+        with self.assertRaises(ValueError):
+            parse_query('since:yesterday')
+
+    def test_search(self):
+        self.assertEqual(self.titles('rates'), ['Rates and more rates',
+                                                'Central bank raises rates'])
+        self.assertEqual(self.titles('"interest rates"'),
+                         ['Central bank raises rates'])
+        self.assertEqual(self.titles('"rates interest"'), [])
+        # the stopwords are not indexed
+        self.assertEqual(self.titles('the'), [])
+        self.assertEqual(self.titles('"the central bank" rates'),
+                         ['Central bank raises rates'])
+        self.assertEqual(self.titles('"interest the rates"'), [])
+        # the rare terms weigh more
+        self.assertEqual(self.titles('cup rates'), ['Cup final',
+                                                    'Rates and more rates',
+                                                    'Central bank raises rates'])
+
+        # filters
+        self.assertEqual(self.titles('cup rates channel:bbc'), ['Cup final'])
+        self.assertEqual(self.titles('rates until:1970-01-01'),
+                         ['Central bank raises rates'])
+        self.assertEqual(self.titles('rates since:1970-01-02'),
+                         ['Rates and more rates'])
+
+    def test_phrase_pages(self):
+        candidates = search.PHRASE_CANDIDATES
+        search.PHRASE_CANDIDATES = 1
+        try:
+            self.store.save_events('http://bbc/rss', [
+                Event('Central bank holds', 'http://bbc/2', 'date',
+                      'The central bank kept interest rates.', published=0)])
+            self.assertEqual(sorted(self.titles('"interest rates"')),
+                             ['Central bank holds',
+                              'Central bank raises rates'])
+        finally:
+            search.PHRASE_CANDIDATES = candidates
+
+    def test_write_after_search(self):
+        self.assertEqual(self.titles('"central bank" rates'),
+                         ['Central bank raises rates'])
+
+        # the search leaves no transaction open on the store, so another
+        # process writes to it and the store sees the change
+        other = sqlite3.connect(self.store.filename, timeout=1)
+        with other:
+            other.execute('INSERT INTO channels (code, name, url) '
+                          'VALUES (?, ?, ?)', ('nyt', 'NYT', 'http://nyt/rss'))
+        other.close()
+        self.assertIn('nyt', self.store.load()['channels'])
+        self.store.add_channel('ft', 'FT', 'http://ft/rss')
+
+    def test_incremental(self):
+        # updated events are indexed again
+        self.store.save_events('http://bbc/rss', [
+            Event('Cup final postponed', 'http://bbc/1', 'date')])
+        self.assertEqual(self.titles('postponed'), ['Cup final postponed'])
+        self.assertEqual(self.titles('team'), [])
+
+        # removed events are removed from the index
+        self.store.remove_channels(['cnn'])
+        self.assertEqual(self.titles('rates'), [])
+        self.assertEqual(self.store._execute('SELECT docs FROM search_stats')
+                         [0][0], 1)
+
+
+class TestStream(unittest.TestCase):
+
+    atom = """<?xml version="1.0"?>
+    <feed xmlns="http://www.w3.org/2005/Atom"><title>Atom</title>
+    <entry><title>Entry</title><id>urn:1</id>
+    <link rel="alternate" href="http://localhost/1"/>
+    <published>2015-01-10T12:00:00+02:00</published>
+    <content type="xhtml"><div><p>Some</p> content</div></content></entry>
+    </feed>"""
+
+    def setUp(self):
+        self.server, self.base_url = start_feed_server()
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp('Sat, 10 Jan 2015 10:00:00 GMT'),
+                         1420884000)
+        self.assertEqual(parse_timestamp('2015-01-10T12:00:00+02:00'),
+                         1420884000)
+        self.assertEqual(parse_timestamp('2015-01-10T10:00:00.5Z'),
+                         1420884000)
+        self.assertEqual(parse_timestamp('yesterday'), None)
+
+    def test_iter_events(self):
+        events = list(iter_events(StringIO.StringIO(self.atom)))
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0].title, events[0].url, events[0].guid,
+                          events[0].summary, events[0].published),
+                         ('Entry', 'http://localhost/1', 'urn:1',
+                          'Some content', 1420884000))
+
+        events = iter_events(StringIO.StringIO(make_rss(1000)))
+        self.assertEqual(next(events).title, 'Title 0')
+
+        with self.assertRaises(SyntaxError):
+            list(iter_events(StringIO.StringIO('<rss><item></rss>')))
+
+    def test_channel_iter_events(self):
+        channel = Channel('local', self.base_url + '/feed')
+        events = list(channel.iter_events())
+        self.assertEqual([e.title for e in events],
+                         ['Title 0', 'Title 1', 'Title 2'])
+
+        # the retrieval stops at the already seen events
+        events = list(channel.iter_events(since=events[1].published))
+        self.assertEqual([e.title for e in events], ['Title 0'])
+        events = list(channel.iter_events(last_guid='http://localhost/2'))
+        self.assertEqual([e.title for e in events], ['Title 0', 'Title 1'])
+
+        with self.assertRaises(ChannelDataNotFound):
+            list(Channel('local', self.base_url + '/missing').iter_events())
+
+
+class KeepAliveHandler(FeedHandler):
+    """ Serves the feed over keep-alive connections, gzipped on demand."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        if not self.path.startswith('/head'):
+            self.send_error(405)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.startswith('/moved'):
+            self.send_response(301)
+            self.send_header('Location', '/feed')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if 'gzip' not in self.headers.get('Accept-Encoding', '') or \
+           self.path.startswith('/missing'):
+            FeedHandler.do_GET(self)
+            return
+
+        buf = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(make_rss(3))
+        body = buf.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.transport = HTTPTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        default_transport().close()
+        self.server.shutdown()
+
+    def test_request(self):
+        response = self.transport.request(self.base_url + '/feed')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, make_rss(3))
+
+        response = self.transport.request(self.base_url + '/moved')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.url, self.base_url + '/feed')
+
+        response = self.transport.request(self.base_url + '/missing')
+        self.assertEqual(response.status, 404)
+
+        with self.assertRaises(TransportError):
+            self.transport.request('ftp://127.0.0.1/feed')
+
+    def test_keep_alive(self):
+        for _ in range(10):
+            channel = Channel('local', self.base_url + '/feed',
+                              transport=self.transport)
+            self.assertEqual(len(channel.get_events()), 3)
+            self.assertEqual(len(list(channel.iter_events())), 3)
+
+        # the connection is reused by all the requests
+        self.assertEqual(self.transport.connections, 1)
+
+    def test_dns(self):
+        dns = DNSCache()
+        port = self.server.server_port
+        closed = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        closed.server_close()
+        refused = ('127.0.0.1', closed.server_port)
+
+        # the addresses are tried in turn
+        dns._addresses[('feeds', port)] = ([refused, ('127.0.0.1', port)],
+                                           time.time() + 60)
+        dns.connect('feeds', port, 1).close()
+        self.assertIn(('feeds', port), dns._addresses)
+
+        # and forgotten when none of them accepts the connection
+        dns._addresses[('feeds', port)] = ([refused], time.time() + 60)
+        with self.assertRaises(socket.error):
+            dns.connect('feeds', port, 1)
+        self.assertNotIn(('feeds', port), dns._addresses)
+
+    def test_validate_url(self):
+        self.assertTrue(validate_url(self.base_url + '/head'))
+        self.assertFalse(validate_url(self.base_url + '/missing'))
+        self.assertFalse(validate_url('ftp://127.0.0.1/feed'))
+
+        # the feed downloaded by the GET fallback serves the first retrieval
+        url = self.base_url + '/feed'
+        self.assertTrue(validate_url(url))
+        channel = Channel('local', url, transport=self.transport)
+        self.assertEqual(len(channel.get_events()), 3)
+        self.assertEqual(self.transport.connections, 0)
+
+        # a failure is cached only for a while
+        url = self.base_url + '/missing'
+        self.assertFalse(validate_url(url))
+        expiry = utils._validations[url][0]
+        self.assertTrue(expiry <= time.time() + config.VALIDATE_FAILURE_TTL)
+
+        # the result of the validation is cached
+        url = self.base_url + '/feed'
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertTrue(validate_url(url))
+        with self.assertRaises(ChannelServerError):
+            Channel('local', url, transport=self.transport).get_events()
+
+
+class TestPager(unittest.TestCase):
+
+    class Terminal(StringIO.StringIO):
+        def isatty(self):
+            return True
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        self.pager = config.PAGER
+        self.formatted = 0
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        config.PAGER = self.pager
+
+    @less
+    def print_output(self):
+        for i in range(5000):
+            self.formatted += 1
+            yield 'line %d\n' % i
+
+    @less
+    def failed_output(self):
+        raise KeyboardInterrupt
+        yield
+
+    def test_less_interrupted(self):
+        sys.stdout = self.Terminal()
+        config.PAGER = 'true'
+        pipes = []
+
+        original = decorators.Popen
+
+        def popen(*args, **kwargs):
+            pipes.append(original(*args, **kwargs))
+            return pipes[-1]
+
+        decorators.Popen = popen
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                self.failed_output()
+        finally:
+            decorators.Popen = original
+
+        # the pager is not left behind
+        self.assertNotEqual(pipes[0].returncode, None)
+
+    def test_pager(self):
+        stream = StringIO.StringIO()
+        answers = iter(['', 'q'])
+        pager = Pager(stream, rows=3, prompt=lambda text: next(answers))
+        pager.write('1\n2\n3\n4\n')
+        with self.assertRaises(IOError):
+            pager.write('5\n6\n')
+        self.assertEqual(stream.getvalue(), '1\n2\n3\n4\n')
+
+    def test_less(self):
+        sys.stdout = self.Terminal()
+        config.PAGER = 'internal'
+
+        # the formatting stops as soon as the pager is closed
+        stdin, sys.stdin = sys.stdin, StringIO.StringIO('q\n')
+        try:
+            self.print_output()
+        finally:
+            sys.stdin = stdin
+        self.assertTrue(sys.stdout.getvalue().startswith('line 0\nline 1\n'))
+        self.assertLess(self.formatted, 1000)
+
+        config.PAGER = None
+        sys.stdout = StringIO.StringIO()
+        self.print_output()
+        self.assertEqual(sys.stdout.getvalue().count('\n'), 5000)
+
+
+@unittest.skipIf(EventWalker is None, 'urwid is not installed')
+class TestEventWalker(unittest.TestCase):
+
+    def test_walker(self):
+        batch = EventBatch(Event('Title %d' % i, 'http://localhost/%d' % i,
+                                 'Sat, 10 Jan 2015', 'Summary %d' % i)
+                           for i in xrange(50000))
+        walker = EventWalker(batch)
+        self.assertEqual(len(walker), 50000)
+
+        widget, position = walker.get_focus()
+        self.assertEqual(position, 0)
+        self.assertIn(u'Title 0', widget.original_widget.text)
+        self.assertEqual(walker.get_prev(0), (None, None))
+        self.assertEqual(walker.get_next(49999), (None, None))
+
+        # only the widgets of the visited rows are built and a few are kept
+        for i in xrange(1000):
+            walker.set_focus(i)
+            walker.get_focus()
+        self.assertEqual(len(walker._widgets), WIDGET_CACHE)
+        self.assertIn(u'Summary 999',
+                      walker.get_next(998)[0].original_widget.text)
+
+        walker.set_batch(EventBatch())
+        self.assertEqual(walker.get_focus(), (None, None))
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        code = 'import sys, clnews.shell, clnews.commands; ' \
+               'print [m for m in ("feedparser", "httplib", "clnews.news") ' \
+               'if m in sys.modules]'
+        root = os.path.abspath(os.path.dirname(__file__) + '/../..')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=root)
+        self.assertEqual(output.strip(), "['clnews.news']")
+
+    def test_import_profiler(self):
+        profiler = ImportProfiler()
+        profiler.start()
+        try:
+            import this_module_does_not_exist
+        except ImportError:
+            pass
+        finally:
+            profiler.stop()
+
+        self.assertEqual([name for _, name, _ in profiler.imports],
+                         ['this_module_does_not_exist'])
+        stream = StringIO.StringIO()
+        profiler.report(stream)
+        self.assertIn('this_module_does_not_exist', stream.getvalue())
+
+    def test_parse_args(self):
+        self.assertEqual(parse_args([]).func.__name__, 'run_shell')
+        args = parse_args(['--profile-startup'])
+        self.assertTrue(args.profile_startup)
+        self.assertEqual(args.func.__name__, 'run_shell')
+        self.assertEqual(parse_args(['daemon', '--once']).func.__name__,
+                         'run_daemon')
+
+    def test_invalid_search(self):
+        stream = StringIO.StringIO()
+        with self.assertRaises(SystemExit) as raised:
+            run_search(parse_args(['search', '--format', 'csv', 'rates',
+                                   'since:yesterday']), stream)
+        self.assertEqual(raised.exception.code,
+                         'Dates should be given as YYYY-MM-DD.')
+        self.assertEqual(stream.getvalue(), '')
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.base_url = start_feed_server()
+        self.store = Store(os.path.join(tempfile.mkdtemp(), 'clnews.db'))
+        self.store.add_channels([('local', 'Local', self.base_url + '/feed'),
+                                 ('missing', 'Missing',
+                                  self.base_url + '/missing')])
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_get_events(self):
+        errors = []
+        stream = StringIO.StringIO()
+        write_ndjson(stream, EVENT_FIELDS,
+                     get_events(self.store, ['local', 'missing'], errors))
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['title'], 'Title 0')
+        self.assertEqual(json.loads(lines[0])['channel'], 'local')
+        self.assertEqual(errors, ['missing'])
+
+        stream = StringIO.StringIO()
+        write_csv(stream, ('code', 'title'),
+                  [('local', u'caf\xe9, bar'), ('local', None)])
+        self.assertEqual(stream.getvalue().splitlines(),
+                         ['code,title', 'local,"caf\xc3\xa9, bar"', 'local,'])
+
+    def test_get_new_events(self):
+        self.assertEqual(self.store.get_seen('local'), (None, None))
+        records = list(get_events(self.store, ['local'], [], new=True))
+        self.assertEqual([record[1] for record in records],
+                         ['Title 0', 'Title 1', 'Title 2'])
+        guid, published = self.store.get_seen('local')
+        self.assertEqual(guid, 'http://localhost/0')
+
+        # nothing new since the last time
+        self.assertEqual(list(get_events(self.store, ['local'], [], new=True)),
+                         [])
+
+        # the parsing stops at the last seen event
+        self.store.set_seen('local', 'http://localhost/2', published - 120)
+        records = list(get_events(self.store, ['local'], [], new=True))
+        self.assertEqual([record[1] for record in records],
+                         ['Title 0', 'Title 1'])
+        self.assertEqual(self.store.get_seen('local'), (guid, published))
+
+
+class TestAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.feeds, base_url = start_feed_server()
+        self.store = Store(os.path.join(tempfile.mkdtemp(), 'clnews.db'))
+        self.store.add_channels([('local', 'Local', base_url + '/feed')])
+        self.server = APIServer(('127.0.0.1', 0), self.store)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.transport = HTTPTransport()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.feeds.shutdown()
+
+    def request(self, path, headers=None, method='GET'):
+        response = self.transport.request(self.url + path, headers, method)
+        body = json.loads(response.body) if response.body else None
+        return response, body
+
+    def test_api(self):
+        response, body = self.request('/channels')
+        self.assertEqual(body['channels'], [{'code': 'local', 'name': 'Local',
+                                             'url': self.store.load()
+                                             ['channels']['local']['url']}])
+        etag = response.headers['etag']
+        response, _ = self.request('/channels', {'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+
+        _, body = self.request('/events')
+        self.assertEqual(body, {'events': [], 'cursor': None})
+
+        response, body = self.request('/refresh', method='POST')
+        self.assertEqual(response.status, 200)
+        self.assertTrue(body['next'] > 0)
+        response, _ = self.request('/channels', {'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+
+        # the channel is not retrieved again while it is fresh
+        next_fetch = self.store.get_schedule()[0]['next_fetch']
+        time.sleep(1)
+        self.request('/refresh?channel=local', method='POST')
+        self.assertEqual(self.store.get_schedule()[0]['next_fetch'],
+                         next_fetch)
+
+        _, body = self.request('/events?limit=2')
+        self.assertEqual([e['title'] for e in body['events']],
+                         ['Title 0', 'Title 1'])
+        _, body = self.request('/events?limit=2&cursor=' + body['cursor'])
+        self.assertEqual([e['title'] for e in body['events']], ['Title 2'])
+        self.assertEqual(body['cursor'], None)
+
+        _, body = self.request('/search?q=title+channel:local&limit=1')
+        self.assertEqual(len(body['results']), 1)
+
+        response, body = self.request('/events?cursor=x')
+        self.assertEqual(response.status, 400)
+        response, body = self.request('/missing')
+        self.assertEqual(response.status, 404)
+
+        response = self.transport.request(self.url + '/metrics')
+        self.assertTrue('clnews_retrieve_seconds_count{channel="local"}'
+                        in response.body)
+
+
 class TestListCommand(unittest.TestCase):
     def setUp(self):
         name = 'cnn'
@@ -181,13 +1553,65 @@ class TestRemoveCommand(unittest.TestCase):
         with self.assertRaises(CommandExecutionError):
             command.execute(self.code, 'false_code')
 
+        # the stories of a removed channel are shown by the others
+        story = Event('Story', 'http://rss.cnn.com/story', 'date')
+        Command.dedup.add(story, self.code)
+        self.assertFalse(Command.dedup.add(story, self.code1))
+
         command.execute(self.code)
         self.assertEqual(Command.data['channels'].keys(), [self.code1,
                                                            self.code2])
+        self.assertTrue(Command.dedup.add(story, self.code1))
 
         command.execute('*')
         self.assertEqual(Command.data['channels'].keys(), [])
 
+class TestImportExportCommands(unittest.TestCase):
+
+    opml = """<?xml version="1.0"?>
+    <opml version="2.0"><head><title>Feeds</title></head><body>
+    <outline text="News">
+      <outline text="Local Feed" type="rss" xmlUrl="%(url)s/feed"/>
+      <outline text="Local Feed" type="rss" xmlUrl="%(url)s/feed?2"/>
+    </outline>
+    <outline text="Missing" type="rss" xmlUrl="%(url)s/missing"/>
+    <outline text="Again" type="rss" xmlUrl="%(url)s/feed"/>
+    </body></opml>"""
+
+    def setUp(self):
+        self.server, self.base_url = start_feed_server()
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'feeds.opml')
+        with open(self.filename, 'w') as f:
+            f.write(self.opml % {'url': self.base_url})
+
+    def tearDown(self):
+        self.server.shutdown()
+        Remove().execute(*[code for code in ('localfeed', 'localfeed2')
+                           if Command.code_exists(code)])
+
+    def test_import_export(self):
+        command = Import()
+        with self.assertRaises(CommandExecutionError):
+            command.execute()
+        with self.assertRaises(CommandExecutionError):
+            command.execute(os.path.join(self.directory, 'none.opml'))
+
+        command.execute(self.filename)
+        self.assertTrue(command.buffer.startswith('2 channel(s) were added'))
+        self.assertIn('/missing: not valid or broken', command.buffer)
+        self.assertIn('/feed: already in your list', command.buffer)
+        self.assertEqual(Command.data['channels']['localfeed2']['url'],
+                         self.base_url + '/feed?2')
+        self.assertEqual(Store(config.STORE_PATH).load()['channels']
+                         ['localfeed']['name'], 'Local Feed')
+
+        exported = os.path.join(self.directory, 'exported.opml')
+        Export().execute(exported)
+        self.assertIn(('localfeed', 'Local Feed', self.base_url + '/feed'),
+                      read_opml(exported))
+
+
 # class TestShell(unittest.TestCase):
 
 #     def setUp(self):
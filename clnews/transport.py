@@ -0,0 +1,334 @@
+"""
+.. module:: transport
+   :platform: Unix
+      :synopsis: This module contains the HTTP transport of the feeds.
+
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
+
+      """
+import ssl
+import time
+import zlib
+import socket
+import httplib
+import urlparse
+import threading
+
+from clnews import config
+from clnews.stats import STATS
+from clnews.exceptions import TransportError
+
+# the statuses of the redirections being followed
+REDIRECTS = (301, 302, 303, 307, 308)
+
+MAX_REDIRECTS = 5
+
+
+class DNSCache(object):
+    """ Caches the resolved addresses of the hosts."""
+
+    def __init__(self, ttl=None):
+        """ Initializes the class.
+
+        Kwargs:
+            ttl (int): The seconds an address is cached for.
+        """
+        self.ttl = ttl if ttl is not None else config.DNS_TTL
+        self._addresses = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """ Returns the list of the (address, port) to connect to for the
+        given host, in the order of the resolver.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._addresses.get((host, port))
+            if cached and cached[1] > now:
+                return cached[0]
+
+        with STATS.timer('dns', host=host):
+            info = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        addresses = []
+        for entry in info:
+            address = entry[4][:2]
+            if address not in addresses:
+                addresses.append(address)
+        with self._lock:
+            self._addresses[(host, port)] = (addresses, now + self.ttl)
+
+        return addresses
+
+    def evict(self, host, port):
+        """ Forgets the addresses of the given host."""
+        with self._lock:
+            self._addresses.pop((host, port), None)
+
+    def connect(self, host, port, timeout):
+        """ Connects to the first of the addresses of the host which accepts
+        the connection.
+
+        The addresses stay cached unless none of them can be connected to.
+
+        Returns:
+            socket. The connected socket.
+
+        Raises:
+            socket.error: None of the addresses could be connected to.
+        """
+        error = None
+        for address in self.resolve(host, port):
+            try:
+                sock = socket.create_connection(address, timeout)
+            except socket.error as error:
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+
+        self.evict(host, port)
+        raise error or socket.error('%s has no addresses' % host)
+
+
+class HTTPConnection(httplib.HTTPConnection):
+    """ An HTTP connection resolving its host through a :class:`DNSCache`."""
+
+    def __init__(self, host, port=None, timeout=None, dns=None):
+        httplib.HTTPConnection.__init__(self, host, port, timeout=timeout)
+        self.dns = dns
+
+    def connect(self):
+        self.sock = self.dns.connect(self.host, self.port, self.timeout)
+
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    """ An HTTPS connection resolving its host through a :class:`DNSCache`."""
+
+    def __init__(self, host, port=None, timeout=None, dns=None):
+        httplib.HTTPSConnection.__init__(self, host, port, timeout=timeout)
+        self.dns = dns
+
+    def connect(self):
+        sock = self.dns.connect(self.host, self.port, self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class Response(object):
+    """ Wraps up an HTTP response.
+
+    The body is either read at once by :meth:`HTTPTransport.request` or
+    streamed with :meth:`read` when the response is opened with
+    :meth:`HTTPTransport.open`, in which case it has to be closed.
+    """
+
+    def __init__(self, transport, key, connection, response, url):
+        self.url = url
+        self.status = response.status
+        self.headers = dict(response.getheaders())
+        self._transport = transport
+        self._key = key
+        self._connection = connection
+        self._response = response
+
+    def read(self, size=-1):
+        """ Reads the body, undecoded."""
+        if size is None or size < 0:
+            data = self._response.read()
+        else:
+            data = self._response.read(size)
+        if self._response.isclosed():
+            self.close()
+
+        return data
+
+    def close(self):
+        """ Releases the connection, back to the pool if it can be reused."""
+        if self._connection is None:
+            return
+
+        reusable = self._response.isclosed() and \
+                   not self._response.will_close
+        self._transport._release(self._key, self._connection, reusable)
+        self._connection = None
+
+
+def decode_body(body, encoding):
+    """ Decompresses a gzip or deflate encoded body."""
+    if encoding == 'gzip':
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # raw deflate stream without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+
+    return body
+
+
+class HTTPTransport(object):
+    """ Performs HTTP requests over pooled keep-alive connections.
+
+    The idle connections are kept per host and reused by the next requests
+    towards the same host, gzip and deflate encodings are negotiated and the
+    addresses of the hosts are cached.
+    """
+
+    def __init__(self, timeout=None, pool_size=None, dns=None):
+        """ Initializes the class.
+
+        Kwargs:
+            timeout (int): The timeout of the requests in seconds.
+            pool_size (int): The maximum number of idle connections per host.
+            dns (:class:`DNSCache`): The cache of the hosts' addresses.
+        """
+        self.timeout = timeout or config.FETCH_TIMEOUT
+        self.pool_size = pool_size or config.HTTP_POOL_SIZE
+        self.dns = dns or DNSCache()
+        self.connections = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+            self.connections += 1
+
+        scheme, host, port = key
+        klass = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return klass(host, port, timeout=self.timeout, dns=self.dns), False
+
+    def _release(self, key, connection, reusable):
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.pool_size:
+                    idle.append(connection)
+                    return
+
+        connection.close()
+
+    def _send(self, method, url, headers, timeout=None):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise TransportError('Unsupported URL: %s' % url)
+
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', config.USER_AGENT)
+        timeout = timeout or self.timeout
+
+        # a pooled connection may have been closed by the server meanwhile,
+        # in which case the request is sent once more on a new one
+        while True:
+            connection, reused = self._acquire(key)
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (httplib.HTTPException, socket.error, ssl.SSLError) as error:
+                connection.close()
+                if reused:
+                    continue
+                raise TransportError(str(error))
+
+            return Response(self, key, connection, response, url)
+
+    def open(self, url, headers=None, method='GET', timeout=None):
+        """ Sends a request and returns the response without reading its body.
+
+        Redirections are followed. The response has to be closed after its
+        body has been read.
+
+        Args:
+            url (str): The URL to request.
+
+        Kwargs:
+            headers (dict): The headers of the request.
+            method (str): The HTTP method.
+            timeout (int): The timeout of the request, the transport's one if
+            None.
+
+        Returns:
+            :class:`Response`. The response.
+
+        Raises:
+            TransportError: The request failed.
+        """
+        for _ in xrange(MAX_REDIRECTS + 1):
+            response = self._send(method, url, headers, timeout)
+            if response.status not in REDIRECTS or \
+               'location' not in response.headers:
+                return response
+
+            try:
+                response.read()
+            except (httplib.HTTPException, socket.error) as error:
+                raise TransportError(str(error))
+            response.close()
+            url = urlparse.urljoin(url, response.headers['location'])
+
+        raise TransportError('Too many redirections: %s' % url)
+
+    def request(self, url, headers=None, method='GET', timeout=None):
+        """ Sends a request and reads the whole response.
+
+        The body is decompressed according to its Content-Encoding.
+
+        Returns:
+            :class:`Response`. The response with its body in the body
+            attribute.
+
+        Raises:
+            TransportError: The request failed.
+        """
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
+        response = self.open(url, headers, method, timeout)
+        try:
+            body = response.read()
+        except (httplib.HTTPException, socket.error, ssl.SSLError) as error:
+            raise TransportError(str(error))
+        finally:
+            response.close()
+
+        try:
+            response.body = decode_body(body,
+                                        response.headers.get('content-encoding'))
+        except zlib.error as error:
+            raise TransportError(str(error))
+
+        return response
+
+    def close(self):
+        """ Closes all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+
+def default_transport():
+    """ Returns the transport shared by all the channels."""
+    global _default_transport
+
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = HTTPTransport()
+
+        return _default_transport
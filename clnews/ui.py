@@ -1,27 +1,22 @@
-import urwid
-
-navigate_mapper = {
-    'up': -1,
-    'down': 1
-}
+"""
+.. module:: ui
+   :platform: Unix
+      :synopsis: This module contains the terminal user interface of clnews.
 
+      .. moduleauthor:: Alexandros Ntavelos <a.ntavelos@gmail.com>
 
-def exit_on_q(key):
-    if key in ('q', 'Q'):
-        raise urwid.ExitMainLoop()
-
-    if key in ['up', 'down']:
-        fc = columns.get_focus_column()
-        listbox = channel_listbox if fc == 0 else event_listbox
-        listbox_navigate(listbox, key)
+      """
+import os
+import threading
+from Queue import Queue, Empty
+from collections import OrderedDict
 
+import urwid
 
-def listbox_navigate(listbox, key):
-    _, idx = listbox.get_focus()
-    idx = (idx + navigate_mapper[key]) % len(listbox.body)
-    listbox.set_focus(idx)
+from clnews.news import Channel, EventBatch
+from clnews.cache import ValidatorCache
 
-palette = [
+PALETTE = [
     ('title', 'black', 'light gray'),
     ('date', 'white', 'dark red'),
     ('channel', 'black', 'light gray', 'standout'),
@@ -29,38 +24,221 @@ palette = [
     ('streak', 'black', 'light gray'),
     ('separator', 'black', 'light gray'),
     ('header', 'white', 'dark blue'),
+    ('error', 'white', 'dark red'),
     ('reveal focus', 'black', 'dark cyan', 'standout')]
 
-event_text = urwid.Text([('title', u" Title - "),
-                         ('date', u"1/1/2016\n"),
-                         ('summary', u" summary" * 10), '\n'], align='left')
-event = urwid.AttrMap(event_text, None, 'reveal focus')
-
-
-event_list = urwid.SimpleListWalker([event, event, event])
-event_listbox = urwid.ListBox(event_list)
-
-event_header_text = urwid.Text("Showing X events", wrap='clip')
-event_header = urwid.AttrMap(event_header_text, 'header')
-event_column = urwid.Frame(event_listbox, event_header)
-
-channel_text = urwid.Text(u" Channel", align='left')
-channel = urwid.AttrMap(channel_text, None, 'reveal focus')
-
-channel_list = urwid.SimpleListWalker([channel, channel, channel])
-channel_listbox = urwid.ListBox(channel_list)
-
-channel_header_text = urwid.Text("My channels", wrap='clip')
-channel_header = urwid.AttrMap(channel_header_text, 'header')
-channel_column = urwid.Frame(channel_listbox, channel_header)
-
-separator = urwid.AttrWrap(urwid.SolidFill(u'\u2502'), 'separator')
-
-columns = urwid.Columns([('weight', 1, channel_column),
-                         ('fixed', 1, separator),
-                         ('weight', 5, event_column)],
-                        dividechars=0, focus_column=0)
-
-linebox = urwid.LineBox(columns)
-loop = urwid.MainLoop(linebox, palette, unhandled_input=exit_on_q)
-loop.run()
+# the number of event widgets kept around for the redraws
+WIDGET_CACHE = 256
+
+
+class Row(urwid.Text):
+    """ A text which can take the focus of a list box."""
+
+    _selectable = True
+
+    def keypress(self, size, key):
+        return key
+
+
+class EventWalker(urwid.ListWalker):
+    """ Lists the events of an :class:`news.EventBatch`.
+
+    The list box asks the walker only for the rows around its focus, so the
+    widgets are built for the visible events alone while the events stay in
+    the columns of the batch. The last built widgets are cached for the
+    redraws.
+    """
+
+    def __init__(self, batch=None):
+        """ Initializes the class.
+
+        Kwargs:
+            batch (:class:`news.EventBatch`): The events to list.
+        """
+        self.batch = batch if batch is not None else EventBatch()
+        self.focus = 0
+        self._widgets = OrderedDict()
+
+    def __len__(self):
+        return len(self.batch)
+
+    def set_batch(self, batch):
+        """ Replaces the listed events keeping the focus on the first one."""
+        self.batch = batch
+        self.focus = 0
+        self._widgets.clear()
+        self._modified()
+
+    def _widget(self, position):
+        if not 0 <= position < len(self.batch):
+            return None, None
+
+        widget = self._widgets.pop(position, None)
+        if widget is None:
+            get = self.batch.get
+            text = Row([('title', u' %s - ' % get(position, 'title')),
+                        ('date', u'%s\n' % get(position, 'date')),
+                        ('summary', u' %s' % get(position, 'summary')),
+                        u'\n'])
+            widget = urwid.AttrMap(text, None, 'reveal focus')
+            if len(self._widgets) >= WIDGET_CACHE:
+                self._widgets.popitem(last=False)
+        self._widgets[position] = widget
+
+        return widget, position
+
+    def get_focus(self):
+        return self._widget(self.focus)
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        return self._widget(position + 1)
+
+    def get_prev(self, position):
+        return self._widget(position - 1)
+
+
+class Browser(object):
+    """ Browses the channels of the store and their events.
+
+    The channels are retrieved by background threads which hand over their
+    results to the urwid event loop through a pipe, so the interface keeps
+    responding while a slow channel loads.
+    """
+
+    def __init__(self, store):
+        """ Initializes the class.
+
+        Args:
+            store (:class:`store.Store`): The store of the channels and their
+            events.
+        """
+        self.store = store
+        self.cache = ValidatorCache(store)
+        self.channels = store.load()['channels']
+        self.codes = sorted(self.channels)
+        self.current = None
+        self.loading = set()
+        self.errors = set()
+        self._results = Queue()
+
+        self.channel_walker = urwid.SimpleFocusListWalker(
+            [urwid.AttrMap(Row(u' %s' % self.channels[code]['name'],
+                               wrap='clip'), None, 'reveal focus')
+             for code in self.codes])
+        channel_column = urwid.Frame(
+            urwid.ListBox(self.channel_walker),
+            urwid.AttrMap(urwid.Text('My channels', wrap='clip'), 'header'))
+
+        self.event_walker = EventWalker()
+        self.event_header = urwid.Text('Select a channel', wrap='clip')
+        event_column = urwid.Frame(
+            urwid.ListBox(self.event_walker),
+            urwid.AttrMap(self.event_header, 'header'))
+
+        separator = urwid.AttrMap(urwid.SolidFill(u'\u2502'), 'separator')
+        self.columns = urwid.Columns([('weight', 1, channel_column),
+                                      ('fixed', 1, separator),
+                                      ('weight', 5, event_column)],
+                                     dividechars=0, focus_column=0)
+
+        self.loop = urwid.MainLoop(urwid.LineBox(self.columns), PALETTE,
+                                   unhandled_input=self.on_input)
+        self._pipe = self.loop.watch_pipe(self._on_results)
+
+    def run(self):
+        """ Runs the event loop until the user quits."""
+        try:
+            self.loop.run()
+        finally:
+            os.close(self._pipe)
+
+    def on_input(self, key):
+        """ Handles the keys which are not handled by the widgets."""
+        if key in ('q', 'Q'):
+            raise urwid.ExitMainLoop()
+
+        if not self.codes or self.columns.focus_position != 0:
+            return
+
+        code = self.codes[self.channel_walker.focus]
+        if key in ('enter', 'right'):
+            self.show(code)
+            self.columns.focus_position = 2
+        elif key in ('r', 'R'):
+            self.show(code, refresh=True)
+
+    def show(self, code, refresh=False):
+        """ Lists the stored events of a channel.
+
+        The channel is retrieved in the background unless it was recently
+        retrieved.
+
+        Args:
+            code (str): The code of the channel.
+
+        Kwargs:
+            refresh (bool): Retrieve the channel even if it is fresh.
+        """
+        self.current = code
+        url = self.channels[code]['url']
+        if (refresh or not self.store.is_fresh(url)) and \
+           code not in self.loading:
+            self.fetch(code)
+        self._list(code)
+
+    def _list(self, code):
+        url = self.channels[code]['url']
+        # the events are packed in the batch as they are read
+        self.event_walker.set_batch(
+            EventBatch(self.store.iter_events(url, latest=False), code))
+        self._update_header()
+
+    def fetch(self, code):
+        """ Retrieves a channel in a background thread."""
+        self.loading.add(code)
+        self.errors.discard(code)
+        thread = threading.Thread(target=self._fetch, args=(code,))
+        thread.daemon = True
+        thread.start()
+
+    def _fetch(self, code):
+        data = self.channels[code]
+        channel = Channel(data['name'], data['url'], code, self.cache)
+        try:
+            channel.get_events()
+            failed = False
+        except Exception:
+            failed = True
+
+        self._results.put((code, failed))
+        # wakes up the event loop
+        os.write(self._pipe, '.')
+
+    def _on_results(self, data):
+        while True:
+            try:
+                code, failed = self._results.get_nowait()
+            except Empty:
+                break
+
+            self.loading.discard(code)
+            if failed:
+                self.errors.add(code)
+            if code == self.current:
+                self._list(code)
+
+        # keeps the pipe open
+        return True
+
+    def _update_header(self):
+        name = self.channels[self.current]['name']
+        text = 'Showing %d events of %s' % (len(self.event_walker), name)
+        if self.current in self.loading:
+            text += ' (loading...)'
+        elif self.current in self.errors:
+            text += ' (error while retrieving data)'
+        self.event_header.set_text(text)
@@ -8,22 +8,69 @@
       """
 import re
 import os
+import time
 import urlparse
-import urllib
+import fcntl
 import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
+from htmlentitydefs import name2codepoint
+
+from clnews import config
+from clnews.stats import STATS
+from clnews.exceptions import TransportError
+
+
+# separates the texts cleaned in bulk, it is removed from the texts themselves
+# if they contain it
+SEPARATOR = u'\x00'
+
+# none of the patterns spans a separator
+TAG = re.compile(ur'<[^>\x00]*>')
+
+# comments, scripts and styles are removed along with their contents
+SPECIAL = re.compile(ur'<(?:!--[^\x00]*?--|(script|style)\b[^\x00]*?</\1\s*)>',
+                     re.IGNORECASE)
+
+ENTITY = re.compile(ur'(&(?:#(\d+)|#[xX]([0-9a-fA-F]+)|([A-Za-z][A-Za-z0-9]*));)')
+
+ENTITIES = dict((name, unichr(code)) for name, code in name2codepoint.items())
+ENTITIES['apos'] = u"'"
+
+
+def _decode_entity(entity, decimal, hexadecimal, name):
+    try:
+        if decimal:
+            return unichr(int(decimal))
+        elif hexadecimal:
+            return unichr(int(hexadecimal, 16))
+    except (ValueError, OverflowError):
+        return entity
+
+    return ENTITIES.get(name, entity)
 
 
 class DataFileMeta(type):
     _instances = {}
 
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(DataFileMeta, cls).__call__(*args,
+        # one instance per data file
+        key = (cls,) + args
+        if key not in cls._instances:
+            cls._instances[key] = super(DataFileMeta, cls).__call__(*args,
                                                                     **kwargs)
-        return cls._instances[cls]
+        return cls._instances[key]
 
 
 class DataFile(object):
+    """ A pickled data file shared by many processes.
+
+    The data are written in a temporary file which replaces the file once it
+    is synced, so that a crash never leaves a truncated file behind, while an
+    advisory lock on a companion .lock file keeps the processes from reading
+    or writing it at the same time.
+    """
     __metaclass__ = DataFileMeta
 
     def __init__(self, filename):
@@ -34,33 +81,242 @@ class DataFile(object):
             open(filename, 'wb').close()
 
         self.filename = filename
+        # the signature of the file as it was last read or written
+        self.signature = None
 
-    def load(self):
+    def _signature(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+
+        return stat.st_ino, stat.st_mtime, stat.st_size
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        """ Holds the lock of the file in the enclosed block.
+
+        Kwargs:
+            exclusive (bool): Take the lock for writing, which waits for every
+            other holder, instead of for reading.
+        """
+        with open(self.filename + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def changed(self):
+        """ Returns True if the file was written by another process since it
+        was last read or written.
+        """
+        return self._signature() != self.signature
+
+    def _read(self):
         with open(self.filename, 'rb') as f:
+            self.signature = self._signature()
             try:
                 return pickle.load(f)
             except EOFError:
                 return {}
 
+    def _write(self, data):
+        dirname, basename = os.path.split(os.path.abspath(self.filename))
+        fd, temp = tempfile.mkstemp(prefix=basename + '.', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temp, self.filename)
+        except:
+            os.remove(temp)
+            raise
+
+        # the rename itself is persisted along with the directory
+        fd = os.open(dirname, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.signature = self._signature()
+
+    @STATS.timed('datafile_load')
+    def load(self):
+        """ Returns the data of the file, {} if it is empty."""
+        with self.lock():
+            return self._read()
+
+    @STATS.timed('datafile_save')
     def save(self, data):
-        with open(self.filename, 'wb') as f:
-            pickle.dump(data, f)
+        """ Replaces the data of the file atomically."""
+        with self.lock(exclusive=True):
+            self._write(data)
+
+    @STATS.timed('datafile_save')
+    def update(self, func):
+        """ Replaces the data of the file without losing the changes of the
+        other processes.
+
+        Args:
+            func (function): Given the data of the file, or None if it was not
+            changed since it was last read or written, returns the data to
+            write.
+        """
+        with self.lock(exclusive=True):
+            self._write(func(self._read() if self.changed() else None))
+
+
+def to_unicode(text):
+    """ Decodes the given UTF-8 text if it is not unicode already."""
+    if isinstance(text, str):
+        return text.decode('utf-8', 'replace')
+
+    return text or u''
+
+
+def _clean(text):
+    if u'<![CDATA[' in text:
+        # the contents of the CDATA sections are kept
+        text = text.replace(u'<![CDATA[', u'').replace(u']]>', u'')
+    if u'<' in text:
+        lowered = text.lower()
+        if u'<!--' in text or u'<script' in lowered or u'<style' in lowered:
+            text = SPECIAL.sub(u'', text)
+        text = TAG.sub(u'', text)
+    if u'&' in text:
+        # every distinct entity is replaced once; the ones decoded to an
+        # ampersand go last so that nothing is decoded twice
+        ampersands = []
+        for groups in set(ENTITY.findall(text)):
+            char = _decode_entity(*groups)
+            if char == u'&':
+                ampersands.append(groups[0])
+            else:
+                text = text.replace(groups[0], char)
+        for entity in ampersands:
+            text = text.replace(entity, u'&')
+
+    return text
 
 
 def remove_html(string):
-    p = re.compile(r'<.*?>')
-    string = p.sub('', string)
+    """ Removes the HTML markup of a text and decodes its entities.
+
+    The contents of the CDATA sections are kept while comments, scripts and
+    styles are removed altogether.
+
+    Args:
+        string (str): The text to clean.
+
+    Returns:
+        str. The clean text, of the same type as the given one.
+    """
+    if isinstance(string, str):
+        return _clean(string.decode('utf-8', 'replace')).encode('utf-8')
+
+    return _clean(string)
+
+
+def remove_html_bulk(strings):
+    """ Cleans many texts at once, see :func:`remove_html`.
+
+    The texts are joined and cleaned in a single pass, which is much faster
+    than cleaning them one by one.
+
+    Args:
+        strings (list): The texts to clean.
+
+    Returns:
+        list. The clean texts as unicode.
+    """
+    if not strings:
+        return []
+
+    strings = [string if isinstance(string, unicode) else to_unicode(string)
+               for string in strings]
+    text = SEPARATOR.join(strings)
+    if text.count(SEPARATOR) != len(strings) - 1:
+        # some of the texts contain the separator
+        text = SEPARATOR.join(string.replace(SEPARATOR, u'')
+                              for string in strings)
+
+    return _clean(text).split(SEPARATOR)
+
 
-    return string
+# url: (expiry, valid, response)
+_validations = {}
+_validations_lock = threading.Lock()
 
 
-def validate_url(url):
+def validate_url(url, timeout=None):
+    """ Checks that a URL can be retrieved.
+
+    A HEAD request is sent first and a GET one only if the server does not
+    answer HEAD requests properly. The result is cached for
+    config.VALIDATE_TTL seconds along with the response of the GET request, if
+    any, which is handed over to the first retrieval of the URL, see
+    :func:`pop_validated_response`. A failure is cached only for
+    config.VALIDATE_FAILURE_TTL seconds.
+
+    Args:
+        url (str): The URL to validate.
+
+    Kwargs:
+        timeout (int): The timeout of each request, config.VALIDATE_TIMEOUT
+        if None.
+
+    Returns:
+        bool. True if the URL is valid.
+    """
+    now = time.time()
+    with _validations_lock:
+        cached = _validations.get(url)
+        if cached and cached[0] > now:
+            return cached[1]
+
     parse_url = urlparse.urlparse(url)
-    if parse_url.scheme != 'http':
+    if parse_url.scheme not in ('http', 'https') or not parse_url.netloc:
         return False
 
-    result = urllib.urlopen(url)
-    if result.code != 200:
-        return False
+    from clnews.transport import default_transport
+
+    transport = default_transport()
+    timeout = timeout or config.VALIDATE_TIMEOUT
+    response = None
+    try:
+        status = transport.request(url, method='HEAD', timeout=timeout).status
+        if status not in (200, 404):
+            # HEAD is not supported by every server
+            response = transport.request(url, timeout=timeout)
+            status = response.status
+    except TransportError:
+        status = None
+
+    valid = status == 200
+    ttl = config.VALIDATE_TTL if valid else config.VALIDATE_FAILURE_TTL
+    with _validations_lock:
+        _validations[url] = (now + ttl, valid, response if valid else None)
+
+    return valid
+
+
+def pop_validated_response(url):
+    """ Returns the response retrieved while validating a URL, if any.
+
+    The response is handed over only once.
+
+    Args:
+        url (str): The validated URL.
+
+    Returns:
+        :class:`transport.Response`. The response or None.
+    """
+    with _validations_lock:
+        cached = _validations.get(url)
+        if not cached or cached[0] <= time.time() or cached[2] is None:
+            return None
+        _validations[url] = cached[:2] + (None,)
 
-    return True
+    return cached[2]
@@ -28,5 +28,8 @@ setup(
         "feedparser==5.1.3",
         "termcolor==1.1.0",
     ],
+    extras_require={
+        'ui': ["urwid"],
+    },
     **extra
 )